@@ -0,0 +1,427 @@
+# -*- coding: utf-8 -*-
+"""
+Cœur asynchrone de NakamaBot (SERVER_MODE=asgi)
+
+Un seul event loop reçoit le webhook et porte les attentes longues, sans
+immobiliser un thread par conversation:
+- POST /webhook est traité directement en ASGI
+- chat libre, /chat et recherche appellent Mistral avec httpx (AsyncClient partagé)
+- les réponses (texte et images) partent vers Graph en asynchrone; les images
+  sont d'abord générées chez Pollinations pour que Facebook les trouve prêtes
+- les autres commandes (cmd_* et commandes/*.execute restent synchrones)
+  tournent dans le pool de threads de leur file via run_in_executor
+- toutes les autres routes sont servies par l'application Flask (asgiref)
+
+Dépendances: httpx, uvicorn, asgiref (sinon app.py reste sur le serveur Flask)
+Lancement: SERVER_MODE=asgi python app.py   ou   uvicorn aio:application
+"""
+
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import time
+
+import app as bot
+
+MISSING = []
+try:
+    import httpx
+except ImportError:
+    httpx = None
+    MISSING.append("httpx")
+try:
+    import uvicorn
+except ImportError:
+    uvicorn = None
+    MISSING.append("uvicorn")
+try:
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError:
+    WsgiToAsgi = None
+    MISSING.append("asgiref")
+
+logger = logging.getLogger(__name__)
+# Une ligne par requête httpx noierait les logs du bot
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+# Conversations simultanées portées par l'event loop (une coroutine chacune, pas un thread)
+ASYNC_CHAT_CONCURRENCY = int(os.getenv("ASYNC_CHAT_CONCURRENCY", "1000"))
+ASYNC_IMAGE_CONCURRENCY = int(os.getenv("ASYNC_IMAGE_CONCURRENCY", "200"))
+# Threads de l'adaptateur pour les commandes synchrones de ces files
+ASYNC_SYNC_THREADS = int(os.getenv("ASYNC_SYNC_THREADS", "4"))
+# Une connexion par appel en vol: une réserve plus petite ferait attendre (et ralentirait) l'event loop
+ASYNC_MAX_CONNECTIONS = int(os.getenv("ASYNC_MAX_CONNECTIONS", str(ASYNC_CHAT_CONCURRENCY + ASYNC_IMAGE_CONCURRENCY + 100)))
+
+# === CLIENTS ASYNCHRONES ===
+
+class AsyncUpstreams:
+    """Mistral, Graph et Pollinations sur un seul AsyncClient (connexions keep-alive partagées)"""
+
+    def __init__(self):
+        self.client = None
+
+    async def start(self):
+        self.client = httpx.AsyncClient(
+            timeout=30,
+            limits=httpx.Limits(max_connections=ASYNC_MAX_CONNECTIONS, max_keepalive_connections=100)
+        )
+
+    @bot.observe_upstream("mistral")
+    async def mistral(self, messages, max_tokens=200, temperature=0.7, purpose=None):
+        """Équivalent asynchrone de call_mistral_api (même retry, même max_tokens adaptatif)"""
+        if not bot.MISTRAL_API_KEY:
+            return None
+
+        model = bot.choose_model()
+        if model is None:
+            raise bot.TokenBudgetExceeded()
+        purpose = bot.completion_purpose(purpose)
+        limit, phase = bot.completion_budget.max_tokens(purpose, max_tokens)
+        headers, data = bot.mistral_request(messages, limit, temperature, model)
+        for attempt in range(2):
+            try:
+                async with bot.mistral_limiter.slot_async() as slot:
+                    started = time.perf_counter()
+                    response = await self.client.post(f"{bot.MISTRAL_API_URL}/v1/chat/completions",
+                                                      headers=headers, json=data, timeout=30)
+                    slot.overloaded = bot.overloaded_status(response.status_code)
+                if response.status_code == 200:
+                    payload = response.json()
+                    bot.record_usage(payload, model)
+                    bot.completion_budget.record(purpose, phase, max_tokens, payload, time.perf_counter() - started)
+                    return payload["choices"][0]["message"]["content"]
+                if response.status_code == 401:
+                    logger.error("❌ Clé API Mistral invalide")
+                    return None
+                if attempt == 0:
+                    with bot.trace_span("retry_wait"):
+                        await asyncio.sleep(2)
+                    continue
+                return None
+            except bot.LimiterTimeout:
+                logger.warning("⏳ Mistral saturé: aucune place libérée à temps")
+                return None
+            except Exception as e:
+                if attempt == 0:
+                    with bot.trace_span("retry_wait"):
+                        await asyncio.sleep(2)
+                    continue
+                logger.error(f"❌ Erreur Mistral: {e}")
+                return None
+        return None
+
+    @bot.observe_upstream("graph_send")
+    async def send_message(self, recipient_id, text):
+        """Équivalent asynchrone de send_message"""
+        if not bot.PAGE_ACCESS_TOKEN:
+            logger.error("❌ PAGE_ACCESS_TOKEN manquant")
+            return {"success": False, "error": "No token"}
+        if not text or not isinstance(text, str):
+            logger.warning("⚠️ Message vide")
+            return {"success": False, "error": "Empty message"}
+        return await self._graph_post(bot.text_message_payload(recipient_id, text), timeout=15)
+
+    @bot.observe_upstream("pollinations")
+    async def render_image(self, image_url):
+        """Faire générer l'image avant de la confier à Facebook (son téléchargement expire vite)"""
+        try:
+            response = await self.client.get(image_url, timeout=60)
+            return response.status_code == 200
+        except Exception as e:
+            logger.warning(f"⚠️ Pré-génération Pollinations impossible: {e}")
+            return False
+
+    @bot.observe_upstream("graph_send_image")
+    async def send_image_message(self, recipient_id, image_url, caption=""):
+        """Équivalent asynchrone de send_image_message"""
+        if not bot.PAGE_ACCESS_TOKEN:
+            logger.error("❌ PAGE_ACCESS_TOKEN manquant")
+            return {"success": False, "error": "No token"}
+        if not image_url:
+            logger.warning("⚠️ URL d'image vide")
+            return {"success": False, "error": "Empty image URL"}
+
+        if image_url.startswith(bot.POLLINATIONS_URL):
+            await self.render_image(image_url)
+        result = await self._graph_post(bot.image_message_payload(recipient_id, image_url), timeout=20)
+        if result["success"] and caption:
+            with bot.trace_span("caption_wait"):
+                await asyncio.sleep(0.5)
+            return await self.send_message(recipient_id, caption)
+        return result
+
+    async def _graph_post(self, data, timeout):
+        try:
+            response = await self.client.post(f"{bot.GRAPH_API_URL}/v18.0/me/messages",
+                                              params={"access_token": bot.PAGE_ACCESS_TOKEN},
+                                              json=data, timeout=timeout)
+            if response.status_code == 200:
+                return {"success": True}
+            logger.error(f"❌ Erreur Facebook API: {response.status_code}")
+            return {"success": False, "error": f"API Error {response.status_code}"}
+        except Exception as e:
+            logger.error(f"❌ Erreur envoi: {e}")
+            return {"success": False, "error": str(e)}
+
+upstreams = AsyncUpstreams()
+
+# === FILES ASYNCHRONES ===
+
+class AsyncLane(bot.WorkLane):
+    """File dont les tâches sont des coroutines; ses threads ne servent qu'aux commandes synchrones
+
+    limiter: limiteur de l'amont qui borne réellement le débit de la file (Mistral pour le chat)
+    """
+
+    def __init__(self, name, concurrency, threads, sheddable=False, limiter=None):
+        super().__init__(name, threads, sheddable)
+        self.workers = concurrency  # Coroutines simultanées (sémaphore), affiché dans les stats
+        self.limiter = limiter
+        self.loop = None
+        self.semaphore = None
+        self.tasks = set()  # L'event loop ne garde qu'une référence faible à ses tâches
+
+    def bind(self, loop):
+        self.loop = loop
+        self.semaphore = asyncio.Semaphore(self.workers)
+
+    def estimated_wait(self):
+        """Attente d'une nouvelle tâche: ce ne sont pas les coroutines qui manquent, mais les places de l'amont
+
+        Chaque tâche en file ou en cours attend une place du limiteur; celui-ci en libère
+        limit toutes les latence moyenne.
+        """
+        if self.limiter is None:
+            return super().estimated_wait()
+        limit = max(int(self.limiter.limit), 1)
+        latency = self.limiter.mean_latency() or self.service_time
+        with self.lock:
+            ahead = self.queued + self.active
+        if ahead < limit:
+            return 0.0
+        return (ahead - limit + 1) / limit * latency
+
+    def submit(self, func, *args):
+        """Mettre une tâche en file sur l'event loop (appelable depuis n'importe quel thread)"""
+        number, context, trace = self._enqueue(func, args)
+        enqueued_at = time.monotonic()
+        job = ASYNC_JOBS.get(func.__name__)
+
+        async def run():
+            async with self.semaphore:
+                started_at = self._start(number, enqueued_at, trace)
+                if started_at is None:
+                    return
+                try:
+                    if job is not None:
+                        await job(self, *args)
+                    else:
+                        await self.run_sync(func, *args)
+                except Exception as e:
+                    logger.error(f"❌ Erreur file {self.name}: {e}")
+                finally:
+                    self._finish(started_at, trace)
+
+        def start():
+            task = self.loop.create_task(run())
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+        # La tâche hérite du contexte (trace) de l'événement qui l'a créée
+        self.loop.call_soon_threadsafe(start, context=context)
+        return None
+
+    async def run_sync(self, func, *args):
+        """Adaptateur: exécuter un code synchrone dans les threads de la file"""
+        context = contextvars.copy_context()
+        return await self.loop.run_in_executor(self.executor, context.run, func, *args)
+
+    def park_pending(self):
+        """Retirer les tâches pas encore commencées (elles s'arrêteront en obtenant le sémaphore)"""
+        with self.lock:
+            pending = list(self.pending.values())
+            self.pending.clear()
+            self.queued -= len(pending)
+        for _, _, _, trace in pending:
+            bot.release_trace(trace)
+        return [(func.__name__, list(args)) for _, func, args, _ in pending]
+
+async def chat_command(sender_id, args):
+    """Équivalent asynchrone de cmd_chat (mêmes étapes, appels Mistral sans thread)"""
+    reply, intent = bot.chat_prelude(args)
+    if reply:
+        return reply
+
+    if intent == "search":
+        search_result = await upstreams.mistral(bot.search_messages(args), max_tokens=150, temperature=0.3,
+                                              purpose="search")
+        if search_result:
+            return bot.search_reply(sender_id, args, search_result)
+
+    faq = await bot.faq_cache.lookup_async(args, sender_id)
+    if faq.answer:
+        return bot.chat_reply(sender_id, args, faq.answer)
+
+    # Question devenue fréquente: réponse sans la mémoire de l'utilisateur, pour pouvoir la resservir
+    response = await upstreams.mistral(bot.chat_messages(sender_id, args, memory=not faq.learn),
+                                       max_tokens=200, temperature=0.7)
+    bot.faq_cache.learn(faq, response)
+    return bot.chat_reply(sender_id, args, response)
+
+# Commandes servies nativement en asynchrone ("text" = message libre)
+ASYNC_COMMANDS = {
+    "text": chat_command,
+    "chat": chat_command
+}
+
+async def respond(lane, sender_id, message_text):
+    """Réponse à un message: coroutine si elle existe, sinon process_command dans un thread"""
+    command = bot.command_label(message_text)
+    handler = ASYNC_COMMANDS.get(command)
+    if handler is None:
+        return await lane.run_sync(bot.process_command, sender_id, message_text)
+
+    text = message_text.strip()
+    args = text if command == "text" else (text.split(' ', 1)[1] if ' ' in text else "")
+    started = time.perf_counter()
+    bot.annotate_trace(command=command)
+    try:
+        return await handler(str(sender_id), args)
+    except bot.TokenBudgetExceeded:
+        return bot.BUDGET_TEXT
+    except Exception as e:
+        if command == "text":
+            raise
+        logger.error(f"❌ Erreur commande {command}: {e}")
+        return f"💥 Oh non ! Petite erreur dans /{command} ! Réessaie ou tape /help ! 💕"
+    finally:
+        bot.COMMAND_LATENCY.observe(time.perf_counter() - started, command)
+
+async def handle_text_message(lane, sender_id, message_text):
+    """Équivalent asynchrone de handle_text_message"""
+    with bot.trace_span("dispatch"):
+        response = await respond(lane, sender_id, message_text)
+
+    if not response:
+        return
+    if isinstance(response, dict) and response.get("type") == "image":
+        send_result = await upstreams.send_image_message(sender_id, response["url"], response["caption"])
+        if send_result.get("success"):
+            logger.info("✅ Image envoyée à %s", sender_id, extra=bot.LOG_OUTBOUND)
+        else:
+            logger.warning("❌ Échec envoi image à %s", sender_id, extra=bot.LOG_OUTBOUND)
+            await upstreams.send_message(sender_id, "🎨 Image créée avec amour mais petite erreur d'envoi ! Réessaie ! 💕")
+    else:
+        send_result = await upstreams.send_message(sender_id, response)
+        if send_result.get("success"):
+            logger.info("✅ Réponse envoyée à %s", sender_id, extra=bot.LOG_OUTBOUND)
+        else:
+            logger.warning("❌ Échec envoi à %s", sender_id, extra=bot.LOG_OUTBOUND)
+
+# Tâches de file qui ont une version asynchrone (les autres passent par l'adaptateur)
+ASYNC_JOBS = {
+    "handle_text_message": handle_text_message
+}
+
+# Files portées par l'event loop (static et vision restent sur leurs threads)
+ASYNC_LANES = {
+    "chat": (ASYNC_CHAT_CONCURRENCY, True, bot.mistral_limiter),
+    "image": (ASYNC_IMAGE_CONCURRENCY, False, None)
+}
+
+# === APPLICATION ASGI ===
+
+flask_app = WsgiToAsgi(bot.app) if WsgiToAsgi is not None else None
+
+async def read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+async def send_json(send, status, payload):
+    body = json.dumps(payload).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    })
+    await send({"type": "http.response.body", "body": body})
+
+async def webhook(receive, send):
+    """POST /webhook sans thread: parsing, dédup et mise en file (mêmes réponses que Flask)"""
+    body = await read_body(receive)
+
+    # Arrêt en cours: Facebook relivrera l'événement au processus suivant
+    if bot.draining.is_set():
+        return await send_json(send, 503, {"error": "Draining"})
+
+    try:
+        data = json.loads(body or b"null")
+    except ValueError:
+        data = None
+    if not data:
+        logger.warning("⚠️ Aucune donnée reçue")
+        return await send_json(send, 400, {"error": "No data received"})
+
+    try:
+        if bot.CAPTURE_FILE:
+            # Ajout au fichier de capture (écriture bloquante): hors de l'event loop
+            await asyncio.get_running_loop().run_in_executor(None, bot.record_capture, data)
+        bot.process_webhook(data, capture=False)
+    except Exception as e:
+        logger.error(f"❌ Erreur webhook: {e}")
+        return await send_json(send, 500, {"error": f"Webhook error: {str(e)}"})
+    return await send_json(send, 200, {"status": "ok"})
+
+async def startup():
+    """Installer les files asynchrones puis lancer les services habituels"""
+    loop = asyncio.get_running_loop()
+    await upstreams.start()
+    for name, (concurrency, sheddable, limiter) in ASYNC_LANES.items():
+        lane = AsyncLane(name, concurrency, ASYNC_SYNC_THREADS, sheddable, limiter)
+        lane.bind(loop)
+        bot.LANES[name] = lane
+
+    bot.restore_state()
+    bot.start_background_services()
+    logger.info("⚡ Cœur asynchrone prêt: %s", ", ".join(f"{name}={concurrency}" for name, (concurrency, _, _) in ASYNC_LANES.items()))
+
+async def shutdown():
+    """SIGTERM reçu par uvicorn: même vidage que /restart, puis uvicorn termine le processus normalement"""
+    loop = asyncio.get_running_loop()
+    # Le vidage attend les files dans un thread: l'event loop continue à faire avancer leurs tâches
+    if bot.draining.is_set():
+        # /restart déjà en cours: son propre thread de vidage quittera le processus
+        await loop.run_in_executor(None, bot.drain_done.wait, bot.DRAIN_TIMEOUT + 60)
+        return
+    bot.draining.set()
+    await loop.run_in_executor(None, bot.drain, "arrêt du serveur ASGI")
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await startup()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await shutdown()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def application(scope, receive, send):
+    """Point d'entrée ASGI: webhook natif, tout le reste via Flask"""
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] == "http" and scope["path"] == "/webhook" and scope["method"] == "POST":
+        return await webhook(receive, send)
+    return await flask_app(scope, receive, send)
+
+def serve(port):
+    """Lancer uvicorn sur l'application ASGI"""
+    logger.info("⚡ Serveur ASGI (uvicorn) sur le port %d", port)
+    uvicorn.run(application, host="0.0.0.0", port=port, lifespan="on", access_log=False)
@@ -1,21 +1,152 @@
+import time
+
+# Profil de démarrage: repères depuis le début du chargement de ce module
+BOOT_STARTED = time.perf_counter()
+STARTUP_PROFILE = {}
+
 import os
+import re
 import logging
+import logging.handlers
+import queue
+import atexit
 import json
 import random
-from flask import Flask, request, jsonify
-import requests
+_flask_started = time.perf_counter()
+from flask import Flask, request, jsonify, Response, stream_with_context
+STARTUP_PROFILE["import_flask_ms"] = round((time.perf_counter() - _flask_started) * 1000, 1)
 from datetime import datetime
 from collections import defaultdict, deque
+from itertools import chain, islice
+from concurrent.futures import ThreadPoolExecutor
 import threading
-import time
+import bisect
+import functools
+import inspect
+import heapq
+import contextvars
 import sys
-import base64
-from io import BytesIO
+import hashlib
+import hmac
+import signal
+from array import array
+from userids import StripedUserIdSet, StripedUserIdMap, UserIdMap, encode
+from metrics import Counter, Histogram, Gauge, register_metric, render_metrics
+from faq import FaqCache, normalize
+from ledger import TokenLedger, TokenBudgetExceeded, CompletionBudget
+from limiter import AdaptiveLimiter, LimiterTimeout, SenderRateLimiter, overloaded_status, parse_rates
+from scheduler import BROADCAST_OFFPEAK, BROADCAST_TICK, BroadcastScheduler, next_offpeak, parse_duration
+from tracing import trace_buffer, traced, current_trace, annotate_trace, hold_trace, release_trace, trace_span
 
-# Configuration du logging 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# Configuration du logging: les threads de requête déposent les records dans une file,
+# un thread dédié les formate et les écrit
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # "text" ou "json" (une ligne JSON par record)
+LOG_SAMPLING = os.getenv("LOG_SAMPLING", "broadcast=0.01")  # catégorie=taux, séparés par des virgules
+LOG_RATE_LIMIT = float(os.getenv("LOG_RATE_LIMIT", "50"))  # records/seconde max par catégorie
+
+# Catégories des logs à fort volume (à passer en extra=)
+LOG_INBOUND = {"category": "inbound"}
+LOG_OUTBOUND = {"category": "outbound"}
+LOG_BROADCAST = {"category": "broadcast"}
+
+class JsonFormatter(logging.Formatter):
+    """Une ligne JSON par record"""
+    
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        if getattr(record, "category", None):
+            entry["category"] = record.category
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+class SamplingFilter(logging.Filter):
+    """Échantillonnage et limite de débit par catégorie (les logs sans catégorie passent tous)"""
+    
+    def __init__(self, sample_rates, rate_limit):
+        super().__init__()
+        self.sample_rates = sample_rates
+        self.rate_limit = rate_limit
+        self.buckets = {}  # catégorie -> [jetons, dernier remplissage]
+        self.dropped = defaultdict(int)
+        self.lock = threading.Lock()
+    
+    def filter(self, record):
+        category = getattr(record, "category", None)
+        if category is None or record.levelno >= logging.WARNING:
+            return True
+        sampled_out = random.random() >= self.sample_rates.get(category, 1.0)
+        now = time.monotonic()
+        with self.lock:
+            # Les filtres tournent sur tous les threads producteurs: compteurs et seaux sous le même verrou
+            if sampled_out:
+                self.dropped[category] += 1
+                return False
+            bucket = self.buckets.setdefault(category, [self.rate_limit, now])
+            bucket[0] = min(self.rate_limit, bucket[0] + (now - bucket[1]) * self.rate_limit)
+            bucket[1] = now
+            if bucket[0] < 1:
+                self.dropped[category] += 1
+                return False
+            bucket[0] -= 1
+        return True
+    
+    def dropped_counts(self):
+        """Copie des compteurs de logs écartés, par catégorie"""
+        with self.lock:
+            return dict(self.dropped)
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler qui laisse le formatage au thread d'écriture"""
+    
+    def prepare(self, record):
+        if record.exc_info:
+            return super().prepare(record)
+        return record
+
+def _parse_sampling(spec):
+    rates = {}
+    for part in spec.split(","):
+        name, _, rate = part.partition("=")
+        if name.strip() and rate.strip():
+            rates[name.strip()] = float(rate)
+    return rates
+
+def setup_logging():
+    """Brancher le logging racine sur une file écrite en arrière-plan"""
+    stream = logging.StreamHandler()
+    if LOG_FORMAT == "json":
+        stream.setFormatter(JsonFormatter())
+    else:
+        stream.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    
+    log_queue = queue.SimpleQueue()
+    sampling = SamplingFilter(_parse_sampling(LOG_SAMPLING), LOG_RATE_LIMIT)
+    handler = DeferredQueueHandler(log_queue)
+    handler.addFilter(sampling)
+    
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(logging.INFO)
+    
+    listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    
+    global _log_listener
+    _log_listener = listener
+    return sampling
+
+log_sampling = setup_logging()
 logger = logging.getLogger(__name__)
 
+STARTUP_PROFILE["imports_ms"] = round((time.perf_counter() - BOOT_STARTED) * 1000, 1)
+
 app = Flask(__name__)
 
 # Configuration
@@ -23,61 +154,369 @@ VERIFY_TOKEN = os.getenv("VERIFY_TOKEN", "nakamaverifytoken")
 PAGE_ACCESS_TOKEN = os.getenv("PAGE_ACCESS_TOKEN", "")
 MISTRAL_API_KEY = os.getenv("MISTRAL_API_KEY", "")
 ADMIN_IDS = set(id.strip() for id in os.getenv("ADMIN_IDS", "").split(",") if id.strip())
+ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN", "")  # Protège les routes d'administration HTTP
 
-# Mémoire du bot (stockage local uniquement)
-user_memory = defaultdict(lambda: deque(maxlen=8))
-user_list = set()
-user_last_image = {}  # Stocker la dernière image de chaque utilisateur
+# Services externes (surchargeables pour les tests de charge avec doublures locales)
+MISTRAL_API_URL = os.getenv("MISTRAL_API_URL", "https://api.mistral.ai")
+GRAPH_API_URL = os.getenv("GRAPH_API_URL", "https://graph.facebook.com")
+POLLINATIONS_URL = os.getenv("POLLINATIONS_URL", "https://image.pollinations.ai")
+GRAPH_BATCH_SIZE = min(int(os.getenv("GRAPH_BATCH_SIZE", "50")), 50)  # Messages par requête batch Graph (1 = envois unitaires)
 
-def call_mistral_api(messages, max_tokens=200, temperature=0.7):
-    """API Mistral avec retry"""
-    if not MISTRAL_API_KEY:
-        return None
-    
+# "flask" (un thread par requête) ou "asgi" (cœur asynchrone de aio.py, via uvicorn)
+SERVER_MODE = os.getenv("SERVER_MODE", "flask").lower()
+
+# Capture du trafic webhook (JSONL anonymisé) pour le rejouer ensuite
+CAPTURE_FILE = os.getenv("CAPTURE_FILE", "")
+CAPTURE_SALT = os.getenv("CAPTURE_SALT", "nakamabot")
+
+# Mémoire du bot (stockage local uniquement, PSID rangés en int64: voir userids.py)
+# Partagée entre les threads: un verrou par tranche d'IDs, parcours sur instantané
+STATE_STRIPES = int(os.getenv("STATE_STRIPES", "32"))
+user_memory = StripedUserIdMap(lambda: deque(maxlen=8), stripes=STATE_STRIPES)
+user_list = StripedUserIdSet(stripes=STATE_STRIPES)
+user_last_image = StripedUserIdMap(stripes=STATE_STRIPES)  # Stocker la dernière image de chaque utilisateur
+game_sessions = StripedUserIdMap(stripes=STATE_STRIPES)  # Sessions de jeu des commandes (commandes/)
+
+# === CLIENT HTTP PARTAGÉ ===
+
+_http_session = None
+_http_lock = threading.Lock()
+
+def http():
+    """Session HTTP partagée (import de requests différé, connexions keep-alive réutilisées)"""
+    global _http_session
+    if _http_session is None:
+        with _http_lock:
+            if _http_session is None:
+                started = time.perf_counter()
+                import requests
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=8, pool_maxsize=64)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                STARTUP_PROFILE.setdefault("import_requests_ms", round((time.perf_counter() - started) * 1000, 1))
+                _http_session = session
+    return _http_session
+
+def warm_connections():
+    """Ouvrir à l'avance les connexions TLS vers Facebook et Mistral"""
+    started = time.perf_counter()
+    for url in (GRAPH_API_URL, MISTRAL_API_URL):
+        try:
+            http().head(url, timeout=5)
+        except Exception as e:
+            logger.warning("⚠️ Préchauffage %s impossible: %s", url, e)
+    STARTUP_PROFILE["warmup_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+# === MÉTRIQUES ===
+
+COMMAND_LATENCY = register_metric(Histogram(
+    "nakamabot_command_duration_seconds", "Durée de traitement par commande", ("command",)))
+UPSTREAM_LATENCY = register_metric(Histogram(
+    "nakamabot_upstream_duration_seconds", "Latence des appels externes", ("upstream", "outcome")))
+UPSTREAM_CALLS = register_metric(Counter(
+    "nakamabot_upstream_calls_total", "Appels externes par résultat", ("upstream", "outcome")))
+BROADCAST_LATENCY = register_metric(Histogram(
+    "nakamabot_broadcast_duration_seconds", "Durée totale d'un broadcast",
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)))
+BROADCAST_MESSAGES = register_metric(Counter(
+    "nakamabot_broadcast_messages_total", "Messages de broadcast par résultat", ("result",)))
+
+def observe_upstream(upstream):
+    """Décorateur: mesurer latence et résultat d'un appel externe"""
+    def outcome_of(result):
+        success = result.get("success") if isinstance(result, dict) else bool(result)
+        return "ok" if success else "error"
+    
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            # Clients asynchrones (aio.py): mêmes métriques et mêmes spans
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                outcome = "error"
+                try:
+                    with trace_span(upstream):
+                        result = await func(*args, **kwargs)
+                    outcome = outcome_of(result)
+                    return result
+                except TokenBudgetExceeded:
+                    outcome = "budget"  # Rien n'a été envoyé
+                    raise
+                finally:
+                    UPSTREAM_LATENCY.observe(time.perf_counter() - started, upstream, outcome)
+                    UPSTREAM_CALLS.inc(upstream, outcome)
+            return async_wrapper
+        
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            outcome = "error"
+            try:
+                with trace_span(upstream):
+                    result = func(*args, **kwargs)
+                outcome = outcome_of(result)
+                return result
+            except TokenBudgetExceeded:
+                outcome = "budget"  # Rien n'a été envoyé
+                raise
+            finally:
+                UPSTREAM_LATENCY.observe(time.perf_counter() - started, upstream, outcome)
+                UPSTREAM_CALLS.inc(upstream, outcome)
+        return wrapper
+    return decorator
+
+# === TRAÇAGE DES REQUÊTES ===
+
+def format_traces(traces):
+    """Résumé lisible des traces pour Messenger"""
+    if not traces:
+        return "🔍 Aucune trace enregistrée pour le moment !"
+    text = f"🐢 {len(traces)} TRACES LES PLUS LENTES:\n"
+    for trace in traces:
+        command = trace.attrs.get("command", "?")
+        text += f"\n⏱️ {trace.duration_ms:.0f} ms - /{command} - {trace.attrs.get('sender_id', '?')} ({trace.trace_id})\n"
+        for span in sorted(trace.spans, key=lambda span: span["start_ms"]):
+            text += f"   • {span['name']}: {span['duration_ms']:.0f} ms\n"
+    return text
+
+# === ROUTAGE DES INTENTIONS ===
+
+# Mots-clés par intention, par ordre de priorité (la première intention l'emporte)
+INTENT_KEYWORDS = {
+    "creator": ['créateur', 'createur', 'qui t\'a', 'créé', 'créee', 'maker', 'développeur'],
+    "image": ['image', 'images', 'photo', 'photos', 'dessiner', 'créer', 'génerer', 'generer'],
+    "search": ['2025', 'actualité', 'récent', 'nouveau', 'maintenant', 'aujourd\'hui'],
+}
+
+# /ai n'a que l'intention "creator", avec ses propres mots-clés: sans 'créé' ni 'développeur'
+# seuls, "je suis développeur" reste une conversation
+AI_INTENT_KEYWORDS = {
+    "creator": ['créateur', 'createur', 'qui t\'a', 'qui t\'a créé', 'maker', 'developer', 'qui t\'a fait'],
+}
+
+def build_intent_router(intent_keywords):
+    """Compiler toutes les intentions en un seul motif (une seule passe par message)"""
+    groups = []
+    for intent, words in intent_keywords.items():
+        # Les mots les plus longs d'abord pour que 'images' ne soit pas coupé en 'image'
+        alternatives = "|".join(re.escape(word) for word in sorted(set(words), key=len, reverse=True))
+        groups.append(f"(?P<{intent}>{alternatives})")
+    priority = {intent: rank for rank, intent in enumerate(intent_keywords)}
+    return re.compile("|".join(groups)), priority
+
+CHAT_INTENTS = build_intent_router(INTENT_KEYWORDS)
+AI_INTENTS = build_intent_router(AI_INTENT_KEYWORDS)
+
+def classify_intent(text, router=CHAT_INTENTS):
+    """Classer un message libre: 'creator', 'image', 'search' ou 'chat' (router: mots-clés du chemin appelant)"""
+    pattern, priority = router
+    best = None
+    for match in pattern.finditer(text.lower()):
+        intent = match.lastgroup
+        if best is None or priority[intent] < priority[best]:
+            best = intent
+            if priority[best] == 0:
+                break
+    return best or "chat"
+
+# === LIMITEUR ADAPTATIF (MISTRAL) ===
+
+LIMITERS = {
+    "mistral": AdaptiveLimiter("mistral", int(os.getenv("MISTRAL_LIMIT_INITIAL", "8")),
+                               int(os.getenv("MISTRAL_LIMIT_MIN", "1")), int(os.getenv("MISTRAL_LIMIT_MAX", "64"))),
+    "mistral_vision": AdaptiveLimiter("mistral_vision", int(os.getenv("VISION_LIMIT_INITIAL", "2")),
+                                      int(os.getenv("VISION_LIMIT_MIN", "1")), int(os.getenv("VISION_LIMIT_MAX", "16")))
+}
+mistral_limiter = LIMITERS["mistral"]
+vision_limiter = LIMITERS["mistral_vision"]
+
+def limiter_stats(history=False):
+    return {name: limiter.stats(history) for name, limiter in LIMITERS.items()}
+
+register_metric(Gauge("nakamabot_llm_concurrency_limit", "Limite courante d'appels simultanés", ("limiter",),
+                      lambda: {name: int(limiter.limit) for name, limiter in LIMITERS.items()}))
+register_metric(Gauge("nakamabot_llm_inflight", "Appels en cours", ("limiter",),
+                      lambda: {name: limiter.inflight for name, limiter in LIMITERS.items()}))
+register_metric(Gauge("nakamabot_llm_waiting", "Appels en attente d'une place", ("limiter",),
+                      lambda: {name: len(limiter.waiters) for name, limiter in LIMITERS.items()}))
+register_metric(Gauge("nakamabot_llm_rejected_total", "Appels abandonnés faute de place", ("limiter",),
+                      lambda: {name: limiter.rejected for name, limiter in LIMITERS.items()}, kind="counter"))
+register_metric(Gauge("nakamabot_llm_overloads_total", "Réponses 429/5xx ou délais dépassés", ("limiter",),
+                      lambda: {name: limiter.overloads for name, limiter in LIMITERS.items()}, kind="counter"))
+
+# === CONSOMMATION DE TOKENS ===
+
+DEFAULT_MODEL = os.getenv("MISTRAL_MODEL", "mistral-small-latest")
+CHEAP_MODEL = os.getenv("MISTRAL_CHEAP_MODEL", "ministral-3b-latest")
+VISION_MODEL = "pixtral-12b-2409"
+# Budgets quotidiens (0 = illimité): au-delà du premier, modèle économique; au-delà du second, réponse toute prête
+USER_TOKEN_BUDGET = int(os.getenv("USER_TOKEN_BUDGET", "20000"))
+USER_TOKEN_HARD_LIMIT = int(os.getenv("USER_TOKEN_HARD_LIMIT", "40000"))
+# Budget quotidien par commande, ex: "text=2000000,vision=300000" (modèle économique au-delà)
+COMMAND_TOKEN_BUDGETS = {name: int(value) for name, value in _parse_sampling(os.getenv("COMMAND_TOKEN_BUDGETS", "")).items()}
+
+BUDGET_TEXT = "🌙 Oh là là, on a énormément papoté aujourd'hui ! Je reprends des forces et je suis toute à toi demain ! 💕 En attendant, /help te montre tout ce que je sais faire ✨"
+
+token_ledger = TokenLedger(DEFAULT_MODEL, CHEAP_MODEL, USER_TOKEN_BUDGET, USER_TOKEN_HARD_LIMIT,
+                           COMMAND_TOKEN_BUDGETS, exempt=ADMIN_IDS)
+
+def usage_owner():
+    """(utilisateur ou None, commande) de l'appel courant, lus dans la trace de l'événement"""
+    trace = current_trace()
+    if trace is None:
+        return None, "system"
+    sender_id = trace.attrs.get("sender_id")
+    return (str(sender_id) if sender_id is not None else None), trace.attrs.get("command", "unknown")
+
+def choose_model():
+    """Modèle pour l'appel courant selon les budgets (None: réponse toute prête)"""
+    return token_ledger.decide(*usage_owner())
+
+def record_usage(payload, model):
+    """Comptabiliser le bloc usage d'une réponse chat/completions"""
+    usage = payload.get("usage") or {}
+    user_id, command = usage_owner()
+    token_ledger.record(user_id, command, model, int(usage.get("prompt_tokens") or 0),
+                        int(usage.get("completion_tokens") or 0))
+
+def format_token_report(count=10):
+    """Résumé de la consommation pour /admin tokens"""
+    snapshot = token_ledger.snapshot()
+    calls, prompt, completion = snapshot["last_hour"]
+    text = "🧮 CONSOMMATION MISTRAL\n\n"
+    text += f"⏱️ Dernière heure : {calls} appels, {prompt + completion} tokens ({prompt} prompt + {completion} réponse)\n"
+    calls, prompt, completion = snapshot["last_day"]
+    text += f"📅 Dernières 24 h : {calls} appels, {prompt + completion} tokens ({prompt} prompt + {completion} réponse)\n"
+    
+    text += "\n📋 Par commande (depuis le démarrage) :\n"
+    commands = sorted(snapshot["per_command"].items(), key=lambda item: item[1][1] + item[1][2], reverse=True)
+    for command, (calls, prompt, completion) in commands or [("aucune", (0, 0, 0))]:
+        text += f"• /{command} : {calls} appels, {prompt + completion} tokens (moy. {(prompt + completion) // max(calls, 1)})\n"
+    
+    text += f"\n🏆 Top consommateurs aujourd'hui ({snapshot['users_today']} utilisateurs) :\n"
+    for rank, (user_id, tokens) in enumerate(token_ledger.top_users(count), 1):
+        share = f" ({tokens / USER_TOKEN_BUDGET * 100:.0f}% du budget)" if USER_TOKEN_BUDGET else ""
+        text += f"{rank}. {user_id} : {tokens} tokens{share}\n"
+    
+    text += f"\n💸 Budgets : {snapshot['downgraded']} appels passés sur {CHEAP_MODEL}, {snapshot['refused']} réponses toutes prêtes"
+    return text
+
+register_metric(Gauge("nakamabot_llm_tokens_total", "Tokens Mistral par commande", ("command", "kind"),
+                      lambda: {key: value for command, counters in token_ledger.snapshot()["per_command"].items()
+                               for key, value in (((command, "prompt"), counters[1]), ((command, "completion"), counters[2]))},
+                      kind="counter"))
+register_metric(Gauge("nakamabot_llm_budget_actions_total", "Appels modifiés par les budgets", ("action",),
+                      lambda: {"downgraded": token_ledger.downgraded, "refused": token_ledger.refused}, kind="counter"))
+
+# === MAX_TOKENS ADAPTATIF ===
+
+completion_budget = CompletionBudget()
+
+def completion_purpose(purpose=None):
+    """Usage d'un appel: explicite (recherche, vision) ou la commande de la trace courante"""
+    return purpose or usage_owner()[1]
+
+def format_completion_report():
+    """Longueurs de réponse, troncatures et temps gagné, avant (fixe) / après (adaptatif)"""
+    stats = completion_budget.stats()
+    if not stats:
+        return "📏 Aucune réponse Mistral enregistrée pour l'instant."
+    
+    text = f"📏 MAX_TOKENS {'ADAPTATIF' if completion_budget.adaptive else 'FIXE (COMPLETION_ADAPTIVE=0)'}\n"
+    for purpose, entry in sorted(stats.items()):
+        text += f"\n🔹 {purpose} : {entry['requested']} → {entry['max_tokens']} tokens max ({entry['samples']} réponses, médiane {entry['p50']}, p95 {entry['p95']})\n"
+        averages = {}
+        for phase, (calls, tokens, truncated, seconds) in entry["phases"].items():
+            if calls:
+                averages[phase] = seconds / calls
+                text += f"• {phase} : {calls} appels, {tokens // calls} tokens en moyenne, {truncated / calls * 100:.1f}% tronquées, {seconds / calls * 1000:.0f} ms\n"
+        if len(averages) == 2:
+            saved = (averages["fixe"] - averages["adaptatif"]) * entry["phases"]["adaptatif"][0]
+            text += f"• ⏱️ Temps de génération gagné : {saved:+.1f} s\n"
+    return text
+
+register_metric(Gauge("nakamabot_llm_max_tokens", "max_tokens envoyé par usage", ("purpose",),
+                      lambda: {purpose: entry["max_tokens"] or 0 for purpose, entry in completion_budget.stats().items()}))
+register_metric(Gauge("nakamabot_llm_truncation_ratio", "Part des réponses coupées (finish_reason=length)", ("purpose",),
+                      lambda: {purpose: entry["truncation_rate"] for purpose, entry in completion_budget.stats().items()}))
+
+def mistral_request(messages, max_tokens, temperature, model=DEFAULT_MODEL):
+    """En-têtes et corps d'un appel chat/completions (partagés avec le client asynchrone)"""
     headers = {
         "Content-Type": "application/json", 
         "Authorization": f"Bearer {MISTRAL_API_KEY}"
     }
     data = {
-        "model": "mistral-small-latest",
+        "model": model,
         "messages": messages,
         "max_tokens": max_tokens,
         "temperature": temperature
     }
+    return headers, data
+
+@observe_upstream("mistral")
+def call_mistral_api(messages, max_tokens=200, temperature=0.7, purpose=None):
+    """API Mistral avec retry (max_tokens: plafond de l'appelant, ajusté selon l'usage)"""
+    if not MISTRAL_API_KEY:
+        return None
+    
+    model = choose_model()
+    if model is None:
+        raise TokenBudgetExceeded()
+    purpose = completion_purpose(purpose)
+    limit, phase = completion_budget.max_tokens(purpose, max_tokens)
+    headers, data = mistral_request(messages, limit, temperature, model)
     
     for attempt in range(2):
         try:
-            response = requests.post(
-                "https://api.mistral.ai/v1/chat/completions", 
-                headers=headers, 
-                json=data, 
-                timeout=30
-            )
+            with mistral_limiter.slot() as slot:
+                started = time.perf_counter()
+                response = http().post(
+                    f"{MISTRAL_API_URL}/v1/chat/completions", 
+                    headers=headers, 
+                    json=data, 
+                    timeout=30
+                )
+                slot.overloaded = overloaded_status(response.status_code)
             
             if response.status_code == 200:
-                return response.json()["choices"][0]["message"]["content"]
+                payload = response.json()
+                record_usage(payload, model)
+                completion_budget.record(purpose, phase, max_tokens, payload, time.perf_counter() - started)
+                return payload["choices"][0]["message"]["content"]
             elif response.status_code == 401:
                 logger.error("❌ Clé API Mistral invalide")
                 return None
             else:
                 if attempt == 0:
-                    time.sleep(2)
+                    with trace_span("retry_wait"):
+                        time.sleep(2)
                     continue
                 return None
-                
+        
+        except LimiterTimeout:
+            logger.warning("⏳ Mistral saturé: aucune place libérée à temps")
+            return None
         except Exception as e:
             if attempt == 0:
-                time.sleep(2)
+                with trace_span("retry_wait"):
+                    time.sleep(2)
                 continue
             logger.error(f"❌ Erreur Mistral: {e}")
             return None
     
     return None
 
+@observe_upstream("mistral_vision")
 def analyze_image_with_vision(image_url):
     """Analyser une image avec l'API Vision de Mistral"""
     if not MISTRAL_API_KEY:
         return None
+    if choose_model() is None:
+        raise TokenBudgetExceeded()
+    limit, phase = completion_budget.max_tokens("vision", 400)
     
     try:
         headers = {
@@ -102,25 +541,34 @@ def analyze_image_with_vision(image_url):
         }]
         
         data = {
-            "model": "pixtral-12b-2409",  # Modèle vision de Mistral
+            "model": VISION_MODEL,  # Modèle vision de Mistral
             "messages": messages,
-            "max_tokens": 400,
+            "max_tokens": limit,
             "temperature": 0.3
         }
         
-        response = requests.post(
-            "https://api.mistral.ai/v1/chat/completions", 
-            headers=headers, 
-            json=data, 
-            timeout=30
-        )
+        with vision_limiter.slot() as slot:
+            started = time.perf_counter()
+            response = http().post(
+                f"{MISTRAL_API_URL}/v1/chat/completions", 
+                headers=headers, 
+                json=data, 
+                timeout=30
+            )
+            slot.overloaded = overloaded_status(response.status_code)
         
         if response.status_code == 200:
-            return response.json()["choices"][0]["message"]["content"]
+            payload = response.json()
+            record_usage(payload, VISION_MODEL)
+            completion_budget.record("vision", phase, 400, payload, time.perf_counter() - started)
+            return payload["choices"][0]["message"]["content"]
         else:
             logger.error(f"❌ Erreur Vision API: {response.status_code}")
             return None
-            
+    
+    except LimiterTimeout:
+        logger.warning("⏳ Vision saturée: aucune place libérée à temps")
+        return None
     except Exception as e:
         logger.error(f"❌ Erreur analyse image: {e}")
         return None
@@ -128,7 +576,8 @@ def analyze_image_with_vision(image_url):
 def download_image_as_base64(image_url):
     """Télécharger une image et la convertir en base64"""
     try:
-        response = requests.get(image_url, timeout=15)
+        import base64
+        response = http().get(image_url, timeout=15)
         if response.status_code == 200:
             return base64.b64encode(response.content).decode('utf-8')
         return None
@@ -136,21 +585,269 @@ def download_image_as_base64(image_url):
         logger.error(f"❌ Erreur téléchargement image: {e}")
         return None
 
+def search_messages(query):
+    """Prompt de la recherche (simulée avec une IA qui connaît 2025)"""
+    return [{
+        "role": "system",
+        "content": f"Tu es NakamaBot, une assistante IA très gentille et amicale qui aide avec les recherches. Nous sommes en 2025. Réponds à cette recherche: '{query}' avec tes connaissances de 2025. Si tu ne sais pas, dis-le gentiment. Réponds en français avec une personnalité amicale et bienveillante, maximum 300 caractères."
+    }]
+
 def web_search(query):
     """Recherche web pour les informations récentes"""
     try:
-        # Simuler une recherche web avec une IA qui connaît 2025
-        search_context = f"Recherche web pour '{query}' en 2025. Je peux répondre avec mes connaissances de 2025."
-        messages = [{
-            "role": "system",
-            "content": f"Tu es NakamaBot, une assistante IA très gentille et amicale qui aide avec les recherches. Nous sommes en 2025. Réponds à cette recherche: '{query}' avec tes connaissances de 2025. Si tu ne sais pas, dis-le gentiment. Réponds en français avec une personnalité amicale et bienveillante, maximum 300 caractères."
-        }]
-        
-        return call_mistral_api(messages, max_tokens=150, temperature=0.3)
+        return call_mistral_api(search_messages(query), max_tokens=150, temperature=0.3, purpose="search")
+    except TokenBudgetExceeded:
+        raise
     except Exception as e:
         logger.error(f"❌ Erreur recherche: {e}")
         return "Oh non ! Une petite erreur de recherche... Désolée ! 💕"
 
+class MemoryStats:
+    """Compteurs tenus à jour à chaque écriture: les stats admin sont des lectures O(1)"""
+    
+    TOP_K = 5
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.messages = 0  # Messages actuellement en mémoire
+        self.active_users = 0  # Utilisateurs inscrits ayant une conversation
+        self.per_user = UserIdMap(int, typecode='q')  # Messages cumulés par utilisateur (PSID en int64)
+        self.top = {}  # Les TOP_K utilisateurs les plus actifs -> compteur
+    
+    def record_message(self, user_id, new_session, evicted):
+        """Un message vient d'être ajouté à la mémoire de user_id"""
+        with self.lock:
+            if not evicted:
+                self.messages += 1
+            if new_session and user_id in user_list:
+                self.active_users += 1
+            
+            count = self.per_user[user_id] = self.per_user[user_id] + 1
+            if user_id in self.top or len(self.top) < self.TOP_K:
+                self.top[user_id] = count
+            else:
+                # Les compteurs ne font que croître: il suffit de comparer au plus petit du top
+                weakest = min(self.top, key=self.top.get)
+                if count > self.top[weakest]:
+                    del self.top[weakest]
+                    self.top[user_id] = count
+    
+    def record_user(self, user_id):
+        """Un nouvel utilisateur vient d'être inscrit dans user_list"""
+        if user_id in user_memory:
+            with self.lock:
+                self.active_users += 1
+    
+    def top_users(self):
+        """[(user_id, messages cumulés depuis reset_memory)] du plus actif au moins actif"""
+        with self.lock:
+            return sorted(self.top.items(), key=lambda item: item[1], reverse=True)
+    
+    def reset_memory(self):
+        """Après effacement de user_memory"""
+        with self.lock:
+            self.messages = 0
+            self.active_users = 0
+            self.per_user.clear()
+            self.top.clear()
+    
+    def reset_users(self):
+        """Après effacement de user_list"""
+        with self.lock:
+            self.active_users = 0
+    
+    def rebuild(self, per_user):
+        """Recalculer tous les compteurs après une restauration de l'état"""
+        with self.lock:
+            memory = user_memory.snapshot()
+            self.messages = sum(len(messages) for _, messages in memory)
+            self.active_users = sum(1 for user_id, _ in memory if user_id in user_list)
+            self.per_user = UserIdMap(int, per_user, typecode='q')
+            self.top = dict(heapq.nlargest(self.TOP_K, self.per_user.items(), key=lambda item: item[1]))
+
+memory_stats = MemoryStats()
+
+class UserDirectory:
+    """Index des utilisateurs: ordre de dernière activité + IDs triés pour la recherche par préfixe
+    
+    Tout est rangé par PSID en int64 (voir userids.py), aucune str gardée par utilisateur:
+    - un journal des activités (clé, heure) dans deux arrays; une nouvelle activité périme
+      l'ancienne ligne de l'utilisateur, le journal est compacté quand les lignes périmées dominent
+    - clé -> ligne du journal (UserIdMap)
+    - un array trié des clés (recherche par préfixe, pagination par curseur); un nouvel utilisateur
+      est seulement ajouté à un array de clés en attente, fusionné à la prochaine recherche
+    Un ID non numérique reçoit une clé à partir de ALIAS_BASE, au-delà de tout PSID.
+    """
+    
+    PAGE_SIZE = 20
+    ALIAS_BASE = 10 ** 18
+    STALE = -1  # Ligne du journal périmée
+    INSORT_MAX = 1024  # Au-delà de ce nombre de clés en attente, un tri complet coûte moins que les insertions
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._reset()
+    
+    def _reset(self):
+        self.rows = UserIdMap(typecode='q')  # Clé -> ligne de sa dernière activité
+        self.log_keys = array('q')
+        self.log_times = array('d')
+        self.sorted_keys = array('q')
+        self.unsorted_keys = array('q')  # Nouvelles clés pas encore fusionnées dans sorted_keys
+        self.aliases = {}  # ID non numérique -> clé
+        self.names = {}  # Clé -> ID non numérique
+    
+    def _key(self, user_id, create=False):
+        key = encode(user_id)
+        if key is None:
+            key = self.aliases.get(user_id)
+            if key is None and create:
+                key = self.aliases[user_id] = self.ALIAS_BASE + len(self.aliases)
+                self.names[key] = user_id
+        return key
+    
+    def _name(self, key):
+        return self.names[key] if key >= self.ALIAS_BASE else str(key)
+    
+    def _append(self, key, seen):
+        """Nouvelle activité de key (appelé sous verrou)"""
+        row = self.rows.get(key)
+        if row is None:
+            self.unsorted_keys.append(key)  # O(1): l'inscription ne décale jamais sorted_keys
+        else:
+            self.log_keys[row] = self.STALE
+        self.rows[key] = len(self.log_keys)
+        self.log_keys.append(key)
+        self.log_times.append(seen)
+        if len(self.log_keys) > 2 * len(self.rows) + 64:
+            self._compact()
+    
+    def _compact(self):
+        """Retirer les lignes périmées du journal (appelé sous verrou, O(n) amorti)"""
+        live = [row for row, key in enumerate(self.log_keys) if key != self.STALE]
+        self.log_keys = array('q', [self.log_keys[row] for row in live])
+        self.log_times = array('d', [self.log_times[row] for row in live])
+        for row, key in enumerate(self.log_keys):
+            self.rows[key] = row
+    
+    def _sorted(self):
+        """sorted_keys à jour (appelé sous verrou): les clés en attente y sont rangées à la demande"""
+        if self.unsorted_keys:
+            if len(self.unsorted_keys) < self.INSORT_MAX:
+                for key in self.unsorted_keys:
+                    bisect.insort(self.sorted_keys, key)
+            else:
+                # Timsort repère la partie déjà triée: O(n) plus le tri des nouvelles clés
+                self.sorted_keys = array('q', sorted(chain(self.sorted_keys, self.unsorted_keys)))
+            self.unsorted_keys = array('q')
+        return self.sorted_keys
+    
+    def _entry(self, key):
+        row = self.rows.get(key)
+        return (self._name(key), self.log_times[row] if row is not None else None)
+    
+    def touch(self, user_id):
+        """Noter l'activité d'un utilisateur (O(1) amorti, nouveaux utilisateurs compris)"""
+        with self.lock:
+            self._append(self._key(user_id, create=True), time.time())
+    
+    def last_seen(self, user_id):
+        with self.lock:
+            key = self._key(user_id)
+            row = self.rows.get(key) if key is not None else None
+            return self.log_times[row] if row is not None else None
+    
+    def page(self, number):
+        """Page n (à partir de 1) des utilisateurs, du plus récemment actif au plus ancien"""
+        start = (max(number, 1) - 1) * self.PAGE_SIZE
+        with self.lock:
+            live = (row for row in range(len(self.log_keys) - 1, -1, -1) if self.log_keys[row] != self.STALE)
+            return [(self._name(self.log_keys[row]), self.log_times[row])
+                    for row in islice(live, start, start + self.PAGE_SIZE)]
+    
+    def find(self, prefix, limit=PAGE_SIZE):
+        """Utilisateurs dont l'ID commence par prefix (recherche dichotomique par nombre de chiffres)"""
+        with self.lock:
+            sorted_keys = self._sorted()
+            if not prefix:
+                return [self._entry(key) for key in sorted_keys[:limit]]
+            found = []
+            if prefix.isdigit() and prefix.isascii() and encode(prefix) is not None:
+                # "123" -> [123, 124), [1230, 1240), [12300, 12400)... jusqu'à 18 chiffres
+                value = int(prefix)
+                for digits in range(len(prefix), 19 if value else 2):  # "0" n'est le préfixe d'aucun autre PSID
+                    scale = 10 ** (digits - len(prefix))
+                    index = bisect.bisect_left(sorted_keys, value * scale)
+                    end = bisect.bisect_left(sorted_keys, (value + 1) * scale)
+                    for key in sorted_keys[index:min(end, index + limit - len(found))]:
+                        found.append(self._entry(key))
+                    if len(found) >= limit:
+                        return found
+            for user_id in sorted(self.aliases):
+                if len(found) >= limit:
+                    break
+                if user_id.startswith(prefix):
+                    found.append(self._entry(self.aliases[user_id]))
+            return found
+    
+    def after(self, cursor, limit):
+        """Pagination par curseur: les limit IDs qui suivent cursor (ordre des clés)"""
+        with self.lock:
+            key = self._key(cursor) if cursor else None
+            if cursor and key is None:
+                return []
+            sorted_keys = self._sorted()
+            index = bisect.bisect_right(sorted_keys, key) if cursor else 0
+            return [self._entry(key) for key in sorted_keys[index:index + limit]]
+    
+    def iter_all(self, chunk=1000):
+        """Parcourir tout l'index par morceaux (mémoire constante, verrou bref)"""
+        cursor = ""
+        while True:
+            rows = self.after(cursor, chunk)
+            if not rows:
+                return
+            yield from rows
+            cursor = rows[-1][0]
+    
+    def clear(self):
+        with self.lock:
+            self._reset()
+    
+    def snapshot(self):
+        """[(user_id, dernière activité)] du plus ancien au plus récent"""
+        with self.lock:
+            return [(self._name(key), seen) for key, seen in zip(self.log_keys, self.log_times) if key != self.STALE]
+    
+    def restore(self, rows):
+        """Recharger l'index depuis snapshot()"""
+        with self.lock:
+            self._reset()
+            for user_id, seen in rows:
+                key = self._key(user_id, create=True)
+                row = self.rows.get(key)
+                if row is not None:
+                    self.log_keys[row] = self.STALE
+                self.rows[key] = len(self.log_keys)
+                self.log_keys.append(key)
+                self.log_times.append(seen)
+            self.sorted_keys = array('q', sorted(key for key in self.log_keys if key != self.STALE))
+            self._compact()
+    
+    def __len__(self):
+        return len(self.rows)
+
+user_directory = UserDirectory()
+
+def register_user(user_id):
+    """Inscrire un utilisateur et noter son activité (tient les compteurs à jour)"""
+    user_directory.touch(user_id)
+    with user_list.lock_for(user_id):
+        new_user = user_id not in user_list
+        user_list.add(user_id)
+    if new_user:
+        memory_stats.record_user(user_id)
+
 def add_to_memory(user_id, msg_type, content):
     """Ajouter à la mémoire"""
     if not user_id or not msg_type or not content:
@@ -160,11 +857,17 @@ def add_to_memory(user_id, msg_type, content):
     if len(content) > 1500:
         content = content[:1400] + "...[tronqué]"
     
-    user_memory[str(user_id)].append({
-        'type': msg_type,
-        'content': content,
-        'timestamp': datetime.now().isoformat()
-    })
+    user_id = str(user_id)
+    with user_memory.lock_for(user_id):
+        new_session = user_id not in user_memory
+        memory = user_memory[user_id]
+        evicted = len(memory) == memory.maxlen
+        memory.append({
+            'type': msg_type,
+            'content': content,
+            'timestamp': datetime.now().isoformat()
+        })
+    memory_stats.record_message(user_id, new_session, evicted)
 
 def get_memory_context(user_id):
     """Obtenir le contexte mémoire"""
@@ -178,38 +881,83 @@ def is_admin(user_id):
     """Vérifier admin"""
     return str(user_id) in ADMIN_IDS
 
-def broadcast_message(text):
-    """Diffusion de messages"""
-    if not text or not user_list:
-        return {"sent": 0, "total": 0, "errors": 0}
+def deliver_batch(batch, text):
+    """Envoyer un lot de diffusion après la pause anti-spam; un résultat par destinataire"""
+    time.sleep(0.2)  # Éviter le spam (une pause par requête Graph)
+    
+    try:
+        results = send_text_batch(batch, text)
+    except Exception as e:
+        logger.error(f"❌ Erreur broadcast pour {len(batch)} destinataires: {e}")
+        results = [{"success": False, "error": str(e)}] * len(batch)
+    
+    sent = 0
+    for user_id, result in zip(batch, results):
+        if result.get("success"):
+            sent += 1
+            logger.debug("✅ Broadcast envoyé à %s", user_id, extra=LOG_BROADCAST)
+        else:
+            logger.warning("❌ Échec broadcast pour %s: %s", user_id, result.get("error"), extra=LOG_BROADCAST)
+    BROADCAST_MESSAGES.inc("sent", amount=sent)
+    BROADCAST_MESSAGES.inc("error", amount=len(batch) - sent)
+    return results
+
+def broadcast_message(text, recipients=None):
+    """Diffusion de messages (recipients: reprise d'une diffusion interrompue)"""
+    recipients = user_list.snapshot() if recipients is None else recipients
+    if not text or not recipients:
+        return {"sent": 0, "total": 0, "errors": 0, "parked": 0, "failures": {}}
     
     success = 0
     errors = 0
-    total_users = len(user_list)
-    
-    logger.info(f"📢 Début broadcast vers {total_users} utilisateurs")
-    
-    for user_id in list(user_list):
-        try:
-            if not user_id or not str(user_id).strip():
-                continue
-                
-            time.sleep(0.2)  # Éviter le spam
-            
-            result = send_message(str(user_id), text)
+    parked = 0
+    failures = defaultdict(int)  # Cause d'échec -> nombre de destinataires
+    total_users = len(recipients)
+    batch_size = max(GRAPH_BATCH_SIZE, 1)
+    started = time.perf_counter()
+    
+    logger.info("📢 Début broadcast vers %d utilisateurs (lots de %d)", total_users, batch_size)
+    
+    for index in range(0, total_users, batch_size):
+        if draining.is_set():
+            # Arrêt en cours: le prochain processus enverra le reste
+            parked = park_broadcast(text, recipients[index:])
+            break
+        
+        batch = [str(user_id) for user_id in recipients[index:index + batch_size] if user_id and str(user_id).strip()]
+        if not batch:
+            continue
+        
+        for result in deliver_batch(batch, text):
             if result.get("success"):
                 success += 1
-                logger.debug(f"✅ Broadcast envoyé à {user_id}")
             else:
                 errors += 1
-                logger.warning(f"❌ Échec broadcast pour {user_id}")
-                
-        except Exception as e:
-            errors += 1
-            logger.error(f"❌ Erreur broadcast pour {user_id}: {e}")
+                failures[result.get("error") or "inconnue"] += 1
     
-    logger.info(f"📊 Broadcast terminé: {success} succès, {errors} erreurs")
-    return {"sent": success, "total": total_users, "errors": errors}
+    BROADCAST_LATENCY.observe(time.perf_counter() - started)
+    logger.info("📊 Broadcast terminé: %d succès, %d erreurs, %d reportés", success, errors, parked)
+    return {"sent": success, "total": total_users, "errors": errors, "parked": parked, "failures": dict(failures)}
+
+# === RÉPONSES STATIQUES PRÉCALCULÉES ===
+
+_static_responses = {}
+
+def cached_response(name, render, *key):
+    """Servir une réponse rendue une seule fois, rendue à nouveau seulement si sa clé change"""
+    cached = _static_responses.get(name)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    text = render(*key)
+    _static_responses[name] = (key, text)
+    return text
+
+def invalidate_responses(*names):
+    """Oublier des réponses précalculées (toutes si aucun nom n'est donné)"""
+    if not names:
+        _static_responses.clear()
+    for name in names:
+        _static_responses.pop(name, None)
 
 # === NOUVELLES COMMANDES ===
 
@@ -237,7 +985,7 @@ def cmd_anime(sender_id, args=""):
         
         # Générer l'image anime avec un seed différent
         seed = random.randint(100000, 999999)
-        anime_image_url = f"https://image.pollinations.ai/prompt/{encoded_prompt}?width=768&height=768&seed={seed}&enhance=true&nologo=true"
+        anime_image_url = f"{POLLINATIONS_URL}/prompt/{encoded_prompt}?width=768&height=768&seed={seed}&enhance=true&nologo=true"
         
         # Sauvegarder dans la mémoire
         add_to_memory(sender_id, 'user', "Transformation anime demandée")
@@ -276,7 +1024,7 @@ def cmd_vision(sender_id, args=""):
         last_image_url = user_last_image[sender_id]
         
         # Analyser l'image avec l'API Vision
-        logger.info(f"🔍 Analyse vision pour {sender_id}")
+        logger.info("🔍 Analyse vision pour %s", sender_id, extra=LOG_INBOUND)
         
         vision_result = analyze_image_with_vision(last_image_url)
         
@@ -293,6 +1041,8 @@ def cmd_vision(sender_id, args=""):
 📸 Réessaie avec /vision ou envoie une nouvelle image !
 💡 Ou tape /help pour voir mes autres talents ! 💖"""
         
+    except TokenBudgetExceeded:
+        return BUDGET_TEXT
     except Exception as e:
         logger.error(f"❌ Erreur analyse vision: {e}")
         return f"""👁️ Oups ! Une petite erreur dans mes circuits visuels ! 😅
@@ -303,9 +1053,7 @@ def cmd_vision(sender_id, args=""):
 
 # === COMMANDES EXISTANTES ===
 
-def cmd_start(sender_id, args=""):
-    """Commande de démarrage"""
-    return f"""💖 Coucou ! Je suis NakamaBot, créée avec amour par Durand ! 
+START_TEXT = """💖 Coucou ! Je suis NakamaBot, créée avec amour par Durand ! 
 
 ✨ Voici ce que je peux faire pour toi :
 🎨 /image [description] - Je crée de magnifiques images avec l'IA !
@@ -316,11 +1064,7 @@ def cmd_start(sender_id, args=""):
 
 🌸 Je suis là pour t'aider avec le sourire ! N'hésite pas à me demander tout ce que tu veux ! 💕"""
 
-def cmd_image(sender_id, args=""):
-    """Générateur d'images avec IA"""
-    
-    if not args.strip():
-        return f"""🎨 OH OUI ! Je peux générer des images magnifiques ! ✨
+IMAGE_USAGE_TEXT = """🎨 OH OUI ! Je peux générer des images magnifiques ! ✨
 
 🖼️ /image [ta description] - Je crée ton image de rêve !
 🎨 /image chat robot mignon - Exemple adorable
@@ -332,6 +1076,22 @@ def cmd_image(sender_id, args=""):
 
 💡 Plus tu me donnes de détails, plus ton image sera parfaite !
 ❓ Besoin d'aide ? Tape /help pour voir toutes mes capacités ! 🌟"""
+
+IMAGE_HINT_TEXT = "🎨 OH OUI ! Je peux créer des images magnifiques grâce à /image ! ✨ Donne-moi une description et je te crée la plus belle image ! Essaie /image [ta description] ou tape /help pour voir toutes mes commandes ! 💕"
+
+BUSY_TEXT = "⏳ Oh là là, je suis un peu débordée en ce moment ! Réessaie dans quelques minutes et je te réponds avec plaisir ! 💕"
+
+CREATOR_TEXT = "👨‍💻 Mon adorable créateur c'est Durand ! Il m'a conçue avec tellement d'amour et de tendresse ! Je l'adore énormément ! 💖 C'est grâce à lui que je peux être là pour t'aider aujourd'hui ! ✨"
+
+def cmd_start(sender_id, args=""):
+    """Commande de démarrage"""
+    return START_TEXT
+
+def cmd_image(sender_id, args=""):
+    """Générateur d'images avec IA"""
+    
+    if not args.strip():
+        return IMAGE_USAGE_TEXT
     
     prompt = args.strip()
     sender_id = str(sender_id)
@@ -364,7 +1124,7 @@ def cmd_image(sender_id, args=""):
         
         # Générer l'image avec l'API Pollinations
         seed = random.randint(100000, 999999)
-        image_url = f"https://image.pollinations.ai/prompt/{encoded_prompt}?width=768&height=768&seed={seed}&enhance=true&nologo=true"
+        image_url = f"{POLLINATIONS_URL}/prompt/{encoded_prompt}?width=768&height=768&seed={seed}&enhance=true&nologo=true"
         
         # Sauvegarder dans la mémoire
         add_to_memory(sender_id, 'user', f"Image demandée: {prompt}")
@@ -385,29 +1145,107 @@ def cmd_image(sender_id, args=""):
 🎲 Ou essaie /image random pour une surprise !
 ❓ Tape /help si tu as besoin d'aide ! 💖"""
 
-def cmd_chat(sender_id, args=""):
-    """Chat IA libre"""
-    
+# Le chat est découpé en étapes sans E/S pour être partagé avec le cœur asynchrone (aio.py)
+
+# === CACHE SÉMANTIQUE (FAQ) ===
+
+EMBED_MODEL = os.getenv("EMBED_MODEL", "mistral-embed")
+EMBED_TIMEOUT = 5
+
+# Questions fréquentes connues d'avance (réponse rendue au moment du service)
+FAQ_SEEDS = [
+    (("Qui t'a créée ?", "C'est qui ton créateur ?", "Qui a fait ce bot ?", "Qui t'a programmée ?"),
+     lambda: CREATOR_TEXT),
+    (("Comment créer une image ?", "Tu peux dessiner ?", "Comment marche /image ?", "Tu sais faire des images ?"),
+     lambda: IMAGE_HINT_TEXT),
+    (("Qu'est-ce que tu sais faire ?", "Quelles sont tes commandes ?", "Tu sers à quoi ?", "Comment tu marches ?"),
+     lambda: cmd_help("")),
+]
+
+@observe_upstream("mistral_embed")
+def embed_texts(texts):
+    """Embeddings Mistral de plusieurs textes en un appel (vecteurs normalisés, None si échec)"""
+    if not MISTRAL_API_KEY:
+        return None
+    try:
+        response = http().post(
+            f"{MISTRAL_API_URL}/v1/embeddings",
+            headers={"Authorization": f"Bearer {MISTRAL_API_KEY}"},
+            json={"model": EMBED_MODEL, "input": texts},
+            timeout=EMBED_TIMEOUT
+        )
+        if response.status_code != 200:
+            logger.warning(f"⚠️ Embeddings indisponibles: {response.status_code}")
+            return None
+        payload = response.json()
+        token_ledger.record(None, "faq", EMBED_MODEL, int((payload.get("usage") or {}).get("prompt_tokens") or 0), 0)
+        return [normalize(item["embedding"]) for item in sorted(payload["data"], key=lambda item: item["index"])]
+    except Exception as e:
+        logger.warning(f"⚠️ Erreur embeddings: {e}")
+        return None
+
+faq_cache = FaqCache(embed_texts, enabled=bool(MISTRAL_API_KEY))
+
+def format_faq_report(args=""):
+    """/admin faq [revue | oubli ID]: taux de réussite, entrées les plus servies, revue des correspondances"""
+    action, _, rest = args.strip().partition(" ")
+    if action == "oubli":
+        entry = faq_cache.forget(int(rest)) if rest.strip().isdigit() else None
+        return f"🗑️ Entrée #{entry.id} oubliée : {entry.question}" if entry else "❌ Usage : /admin faq oubli [numéro d'entrée]"
+    if action == "revue":
+        hits = faq_cache.review()
+        if not hits:
+            return "🔎 Aucune réponse servie depuis le cache pour l'instant."
+        text = "🔎 REVUE DES CORRESPONDANCES (plus récentes d'abord)\n"
+        for asked, entry, entry_id, score in hits:
+            matched = entry.question if entry else "(oubliée)"
+            text += f"\n#{entry_id} ({score:.2f}) « {asked[:60]} » → « {matched[:60]} »"
+        return text + "\n\n🗑️ Fausse correspondance ? /admin faq oubli [numéro]"
+    
+    stats = faq_cache.stats()
+    counters = stats["counters"]
+    text = f"🧠 CACHE FAQ ({stats['mode']}, seuil {faq_cache.threshold}, {'NumPy' if stats['numpy'] else 'Python pur'})\n\n"
+    text += f"📚 Entrées : {stats['entries']} ({counters.get('learned', 0)} apprises, {counters.get('forgotten', 0)} oubliées)\n"
+    text += f"🎯 Taux de réussite : {stats['hit_rate'] * 100:.1f}% sur {stats['lookups']} messages"
+    text += f" ({counters.get('hit', 0)} servis, {counters.get('shadow_hit', 0)} en observation)\n"
+    text += f"⚠️ Sans embedding : {counters.get('skip', 0)}, trop lents (> {faq_cache.budget} s, l'IA a répondu) : {counters.get('late', 0)}\n"
+    text += f"📦 Embeddings : {stats['embedded_texts']} textes en {stats['embedding_batches']} appels\n"
+    text += "\n🏆 Plus servies :\n"
+    for entry in faq_cache.top_entries():
+        text += f"#{entry.id} [{entry.source}] {entry.hits}× « {entry.question[:50]} »\n"
+    return text + "\n🔎 /admin faq revue pour vérifier les dernières correspondances"
+
+register_metric(Gauge("nakamabot_faq_lookups_total", "Recherches dans le cache FAQ par résultat", ("result",),
+                      lambda: {result: faq_cache.counters[result] for result in ("hit", "shadow_hit", "miss", "skip", "late")},
+                      kind="counter"))
+register_metric(Gauge("nakamabot_faq_entries", "Questions en cache", (), lambda: len(faq_cache.entries)))
+
+def chat_prelude(args):
+    """(réponse immédiate ou None, intention) avant tout appel à l'IA"""
     if not args.strip():
-        return f"💬 Coucou ! Dis-moi tout ce qui te passe par la tête ! Je suis là pour papoter avec toi ! ✨ N'hésite pas à taper /help pour voir tout ce que je peux faire ! 💕"
+        return f"💬 Coucou ! Dis-moi tout ce qui te passe par la tête ! Je suis là pour papoter avec toi ! ✨ N'hésite pas à taper /help pour voir tout ce que je peux faire ! 💕", None
+    
+    intent = classify_intent(args)
     
     # Vérifier si on demande le créateur
-    if any(word in args.lower() for word in ['créateur', 'createur', 'qui t\'a', 'créé', 'créee', 'maker', 'développeur']):
-        return f"👨‍💻 Mon adorable créateur c'est Durand ! Il m'a conçue avec tellement d'amour et de tendresse ! Je l'adore énormément ! 💖 C'est grâce à lui que je peux être là pour t'aider aujourd'hui ! ✨"
+    if intent == "creator":
+        return CREATOR_TEXT, intent
     
     # Vérifier si on demande les images
-    if any(word in args.lower() for word in ['image', 'images', 'photo', 'photos', 'dessiner', 'créer', 'génerer', 'generer']):
-        return f"🎨 OH OUI ! Je peux créer des images magnifiques grâce à /image ! ✨ Donne-moi une description et je te crée la plus belle image ! Essaie /image [ta description] ou tape /help pour voir toutes mes commandes ! 💕"
+    if intent == "image":
+        return IMAGE_HINT_TEXT, intent
     
-    # Recherche si c'est une question sur 2025 ou récente
-    if any(word in args.lower() for word in ['2025', 'actualité', 'récent', 'nouveau', 'maintenant', 'aujourd\'hui']):
-        search_result = web_search(args)
-        if search_result:
-            add_to_memory(sender_id, 'user', args)
-            add_to_memory(sender_id, 'bot', search_result)
-            return f"🔍 Voici ce que j'ai trouvé pour toi : {search_result} ✨\n\n❓ Tape /help pour voir tout ce que je peux faire ! 💕"
-    
-    context = get_memory_context(sender_id)
+    return None, intent
+
+def search_reply(sender_id, args, search_result):
+    """Mémoriser et formater le résultat d'une recherche"""
+    add_to_memory(sender_id, 'user', args)
+    add_to_memory(sender_id, 'bot', search_result)
+    return f"🔍 Voici ce que j'ai trouvé pour toi : {search_result} ✨\n\n❓ Tape /help pour voir tout ce que je peux faire ! 💕"
+
+def chat_messages(sender_id, args, memory=True):
+    """Prompt système + mémoire + message de l'utilisateur (memory=False: réponse destinée au cache FAQ)"""
+    context = get_memory_context(sender_id) if memory else []
     
     messages = [{
         "role": "system", 
@@ -415,9 +1253,10 @@ def cmd_chat(sender_id, args=""):
     }]
     messages.extend(context)
     messages.append({"role": "user", "content": args})
-    
-    response = call_mistral_api(messages, max_tokens=200, temperature=0.7)
-    
+    return messages
+
+def chat_reply(sender_id, args, response):
+    """Mémoriser la réponse de l'IA (ou excuse si elle n'a pas répondu)"""
     if response:
         add_to_memory(sender_id, 'user', args)
         add_to_memory(sender_id, 'bot', response)
@@ -428,6 +1267,27 @@ def cmd_chat(sender_id, args=""):
     else:
         return f"🤔 Oh là là ! J'ai un petit souci technique ! Peux-tu reformuler ta question ? 💕 Ou tape /help pour voir mes commandes ! ✨"
 
+def cmd_chat(sender_id, args=""):
+    """Chat IA libre"""
+    reply, intent = chat_prelude(args)
+    if reply:
+        return reply
+    
+    # Recherche si c'est une question sur 2025 ou récente
+    if intent == "search":
+        search_result = web_search(args)
+        if search_result:
+            return search_reply(sender_id, args, search_result)
+    
+    faq = faq_cache.lookup(args, sender_id)
+    if faq.answer:
+        return chat_reply(sender_id, args, faq.answer)
+    
+    # Question devenue fréquente: réponse sans la mémoire de l'utilisateur, pour pouvoir la resservir
+    response = call_mistral_api(chat_messages(sender_id, args, memory=not faq.learn), max_tokens=200, temperature=0.7)
+    faq_cache.learn(faq, response)
+    return chat_reply(sender_id, args, response)
+
 def cmd_stats(sender_id, args=""):
     """Statistiques du bot - RÉSERVÉ AUX ADMINS"""
     if not is_admin(sender_id):
@@ -454,14 +1314,39 @@ def cmd_broadcast(sender_id, args=""):
     if not is_admin(sender_id):
         return f"🔐 Oh ! Accès réservé aux admins seulement !\nTon ID: {sender_id}\n💕 Mais tu peux utiliser /help pour voir mes autres commandes !"
     
-    if not args.strip():
+    # Options: --over 2h (étaler sur une durée), --offpeak (heures creuses), --status, --cancel
+    args = args.strip()
+    over = None
+    offpeak = False
+    while args.startswith("--"):
+        flag, _, args = args.partition(" ")
+        args = args.strip()
+        if flag == "--status":
+            return format_broadcast_schedule()
+        if flag == "--cancel":
+            return f"🛑 {broadcast_scheduler.cancel()} diffusion(s) étalée(s) annulée(s) ! 💕"
+        if flag == "--offpeak":
+            offpeak = True
+        elif flag == "--over":
+            value, _, args = args.partition(" ")
+            args = args.strip()
+            over = parse_duration(value)
+            if not over:
+                return f"❌ Durée illisible : {value} ! Exemple : /broadcast --over 2h Ton message 💕"
+        else:
+            return f"❌ Option inconnue : {flag} ! Tape /broadcast pour l'aide 💕"
+    
+    if not args:
         return f"""📢 COMMANDE BROADCAST ADMIN
 Usage: /broadcast [message]
+🗓️ /broadcast --over 2h [message] - Étaler l'envoi sur 2 heures
+🌙 /broadcast --offpeak [message] - Envoyer pendant les heures creuses ({BROADCAST_OFFPEAK}h)
+📋 /broadcast --status | --cancel - Suivre ou annuler les diffusions étalées
 
 📊 Mes petits utilisateurs connectés: {len(user_list)} 💕
 🔐 Commande réservée aux admins"""
     
-    message_text = args.strip()
+    message_text = args
     
     if len(message_text) > 1800:
         return "❌ Oh non ! Ton message est trop long ! Maximum 1800 caractères s'il te plaît ! 💕"
@@ -472,16 +1357,31 @@ Usage: /broadcast [message]
     # Message final
     formatted_message = f"📢 ANNONCE OFFICIELLE DE NAKAMABOT 💖\n\n{message_text}\n\n— Avec tout mon amour, NakamaBot (créée par Durand) ✨"
     
+    if over or offpeak:
+        start_at, deadline = next_offpeak() if offpeak else (time.time(), None)
+        deadline = start_at + over if over else deadline
+        job = broadcast_scheduler.schedule(formatted_message, user_list.snapshot(), start_at, deadline, admin_id=str(sender_id))
+        return f"""🗓️ DIFFUSION ÉTALÉE PROGRAMMÉE ! 💕
+
+📱 Destinataires : {len(job.recipients)}
+⏰ Du {datetime.fromtimestamp(start_at).strftime('%d/%m %H:%M')} au {datetime.fromtimestamp(deadline).strftime('%d/%m %H:%M')}
+🧠 Rythme ajusté aux réponses et à la capacité de l'IA
+📋 /broadcast --status pour suivre"""
+    
     # Envoyer
     result = broadcast_message(formatted_message)
     success_rate = (result['sent'] / result['total'] * 100) if result['total'] > 0 else 0
+    parked_line = f"\n⏸️ Reportés après redémarrage : {result['parked']}" if result['parked'] else ""
+    failures = sorted(result.get("failures", {}).items(), key=lambda item: item[1], reverse=True)[:3]
+    if failures:
+        parked_line += "\n🔎 Causes : " + ", ".join(f"{error} ({count})" for error, count in failures)
     
     return f"""📊 BROADCAST ENVOYÉ AVEC AMOUR ! 💕
 
 ✅ Messages réussis : {result['sent']}
 📱 Total d'amis : {result['total']}
 ❌ Petites erreurs : {result['errors']}
-📈 Taux de réussite : {success_rate:.1f}% 🌟"""
+📈 Taux de réussite : {success_rate:.1f}% 🌟{parked_line}"""
 
 def cmd_restart(sender_id, args=""):
     """Redémarrage pour admin (Render)"""
@@ -494,36 +1394,47 @@ def cmd_restart(sender_id, args=""):
         # Envoyer confirmation avant redémarrage
         send_message(sender_id, "🔄 Je redémarre avec amour... À très bientôt ! 💖✨")
         
-        # Forcer l'arrêt du processus (Render va le redémarrer automatiquement)
-        threading.Timer(2.0, lambda: os._exit(0)).start()
+        # Vider les files et sauver l'état, puis quitter (Render relance le processus)
+        if not request_shutdown(f"/restart par {sender_id}"):
+            return "⏳ Un redémarrage est déjà en cours ! Patience, je reviens vite ! 💕"
         
-        return "🔄 Redémarrage initié avec tendresse ! Je reviens dans 2 secondes ! 💕"
+        return f"🔄 Redémarrage initié avec tendresse ! Je termine mes messages en cours (max {DRAIN_TIMEOUT:.0f} s) et je reviens sans rien oublier ! 💕"
         
     except Exception as e:
         logger.error(f"❌ Erreur redémarrage: {e}")
         return f"❌ Oups ! Petite erreur lors du redémarrage : {str(e)} 💕"
 
-def cmd_admin(sender_id, args=""):
-    """Panneau admin simplifié"""
-    if not is_admin(sender_id):
-        return f"🔐 Oh ! Accès réservé aux admins ! ID: {sender_id}\n💕 Tape /help pour voir mes autres talents !"
-    
-    if not args.strip():
-        return f"""🔐 PANNEAU ADMIN v4.0 AMICALE + VISION 💖
+def _render_admin_panel(users, conversations, images, ai_ready, facebook_ready):
+    """Texte du panneau admin (recalculé seulement quand les compteurs changent)"""
+    return f"""🔐 PANNEAU ADMIN v4.0 AMICALE + VISION 💖
 
 • /admin stats - Mes statistiques détaillées
+• /admin traces [N] - Les N traces les plus lentes
+• /admin tokens - Consommation Mistral et top consommateurs
+• /admin longueurs - max_tokens adaptatif et troncatures
+• /admin faq [revue | oubli N] - Cache sémantique des questions fréquentes
 • /stats - Statistiques publiques admin
 • /broadcast [msg] - Diffusion pleine d'amour
 • /restart - Me redémarrer en douceur
 
 📊 MON ÉTAT ACTUEL :
-👥 Mes utilisateurs : {len(user_list)}
-💾 Conversations en cours : {len(user_memory)}
-📸 Images en mémoire : {len(user_last_image)}
-🤖 IA intelligente : {'✅ JE SUIS BRILLANTE !' if MISTRAL_API_KEY else '❌'}
-👁️ Vision IA : {'✅ J\'AI DES YEUX DE ROBOT !' if MISTRAL_API_KEY else '❌'}
-📱 Facebook connecté : {'✅ PARFAIT !' if PAGE_ACCESS_TOKEN else '❌'}
+👥 Mes utilisateurs : {users}
+💾 Conversations en cours : {conversations}
+📸 Images en mémoire : {images}
+🤖 IA intelligente : {'✅ JE SUIS BRILLANTE !' if ai_ready else '❌'}
+👁️ Vision IA : {"✅ J'AI DES YEUX DE ROBOT !" if ai_ready else '❌'}
+📱 Facebook connecté : {'✅ PARFAIT !' if facebook_ready else '❌'}
 👨‍💻 Mon créateur adoré : Durand 💕"""
+
+def cmd_admin(sender_id, args=""):
+    """Panneau admin simplifié"""
+    if not is_admin(sender_id):
+        return f"🔐 Oh ! Accès réservé aux admins ! ID: {sender_id}\n💕 Tape /help pour voir mes autres talents !"
+    
+    if not args.strip():
+        return cached_response("admin_panel", _render_admin_panel,
+                               len(user_list), len(user_memory), len(user_last_image),
+                               bool(MISTRAL_API_KEY), bool(PAGE_ACCESS_TOKEN))
     
     if args.strip().lower() == "stats":
         return f"""📊 MES STATISTIQUES DÉTAILLÉES AVEC AMOUR 💖
@@ -539,14 +1450,25 @@ def cmd_admin(sender_id, args=""):
 👁️ Analyses visuelles : ✅ J'AI DES YEUX DE ROBOT !
 💬 Chat IA : ✅ ON PAPOTE !
 🌐 Statut API : {'✅ Tout fonctionne parfaitement !' if MISTRAL_API_KEY and PAGE_ACCESS_TOKEN else '❌ Quelques petits soucis'}
+⏳ Réponses en mode dégradé : {shed_total()}
 
 ⚡ Je suis opérationnelle et heureuse ! 🌟"""
     
+    action, _, option = args.strip().lower().partition(' ')
+    if action == "traces":
+        count = int(option) if option.isdigit() else 5
+        return format_traces(trace_buffer.slowest_traces(min(count, 20)))
+    if action == "tokens":
+        return format_token_report()
+    if action == "longueurs":
+        return format_completion_report()
+    if action == "faq":
+        return format_faq_report(option)
+    
     return f"❓ Oh ! L'action '{args}' m'est inconnue ! 💕"
 
-def cmd_help(sender_id, args=""):
-    """Aide du bot"""
-    
+def _render_help(admin, command_count):
+    """Texte de l'aide (une version utilisateur, une version admin)"""
     commands = {
         "/start": "🤖 Ma présentation toute mignonne",
         "/image [description]": "🎨 Je crée des images magnifiques avec l'IA !", 
@@ -561,7 +1483,7 @@ def cmd_help(sender_id, args=""):
     for cmd, desc in commands.items():
         text += f"{cmd} - {desc}\n"
     
-    if is_admin(sender_id):
+    if admin:
         text += "\n🔐 COMMANDES ADMIN SPÉCIALES :\n"
         text += "/stats - Mes statistiques (admin seulement)\n"
         text += "/admin - Mon panneau admin\n"
@@ -576,6 +1498,11 @@ def cmd_help(sender_id, args=""):
     text += f"\n💖 N'hésite jamais à me demander quoi que ce soit !"
     return text
 
+def cmd_help(sender_id, args=""):
+    """Aide du bot"""
+    admin = is_admin(sender_id)
+    return cached_response("help_admin" if admin else "help", _render_help, admin, len(COMMANDS))
+
 # Dictionnaire des commandes
 COMMANDS = {
     'start': cmd_start,
@@ -592,8 +1519,27 @@ COMMANDS = {
 
 def process_command(sender_id, message_text):
     """Traiter les commandes utilisateur"""
-    sender_id = str(sender_id)
-    
+    started = time.perf_counter()
+    # Annoté avant l'exécution: la comptabilité des tokens lit la commande dans la trace
+    command = command_label(message_text)
+    annotate_trace(command=command)
+    try:
+        return _dispatch_command(str(sender_id), message_text)
+    except TokenBudgetExceeded:
+        # La commande s'arrête avant de mémoriser ou d'habiller une réponse qui n'existe pas
+        return BUDGET_TEXT
+    finally:
+        COMMAND_LATENCY.observe(time.perf_counter() - started, command)
+
+def command_label(message_text):
+    """Étiquette de métrique d'un message: nom de commande, 'unknown', 'text' ou 'invalid'"""
+    if isinstance(message_text, str) and message_text.strip().startswith('/'):
+        command = message_text.strip()[1:].split(' ', 1)[0].lower()
+        return command if command in COMMANDS else "unknown"
+    return "text" if message_text else "invalid"
+
+def _dispatch_command(sender_id, message_text):
+    """Parser et exécuter une commande"""
     if not message_text or not isinstance(message_text, str):
         return f"🤖 Oh là là ! Message vide ! Tape /start ou /help pour commencer notre belle conversation ! 💕"
     
@@ -611,12 +1557,41 @@ def process_command(sender_id, message_text):
     if command in COMMANDS:
         try:
             return COMMANDS[command](sender_id, args)
+        except TokenBudgetExceeded:
+            raise
         except Exception as e:
             logger.error(f"❌ Erreur commande {command}: {e}")
             return f"💥 Oh non ! Petite erreur dans /{command} ! Réessaie ou tape /help ! 💕"
     
     return f"❓ Oh ! La commande /{command} m'est inconnue ! Tape /help pour voir tout ce que je sais faire ! ✨💕"
 
+def text_message_payload(recipient_id, text):
+    """Corps d'un message texte Graph (tronqué à la limite de Messenger)"""
+    # Limiter taille
+    if len(text) > 2000:
+        text = text[:1950] + "...\n✨ [Message tronqué avec amour]"
+    
+    return {
+        "recipient": {"id": str(recipient_id)},
+        "message": {"text": text}
+    }
+
+def image_message_payload(recipient_id, image_url):
+    """Corps d'un message image Graph"""
+    return {
+        "recipient": {"id": str(recipient_id)},
+        "message": {
+            "attachment": {
+                "type": "image",
+                "payload": {
+                    "url": image_url,
+                    "is_reusable": True
+                }
+            }
+        }
+    }
+
+@observe_upstream("graph_send")
 def send_message(recipient_id, text):
     """Envoyer un message Facebook"""
     if not PAGE_ACCESS_TOKEN:
@@ -627,18 +1602,11 @@ def send_message(recipient_id, text):
         logger.warning("⚠️ Message vide")
         return {"success": False, "error": "Empty message"}
     
-    # Limiter taille
-    if len(text) > 2000:
-        text = text[:1950] + "...\n✨ [Message tronqué avec amour]"
-    
-    data = {
-        "recipient": {"id": str(recipient_id)},
-        "message": {"text": text}
-    }
+    data = text_message_payload(recipient_id, text)
     
     try:
-        response = requests.post(
-            "https://graph.facebook.com/v18.0/me/messages",
+        response = http().post(
+            f"{GRAPH_API_URL}/v18.0/me/messages",
             params={"access_token": PAGE_ACCESS_TOKEN},
             json=data,
             timeout=15
@@ -654,6 +1622,7 @@ def send_message(recipient_id, text):
         logger.error(f"❌ Erreur envoi: {e}")
         return {"success": False, "error": str(e)}
 
+@observe_upstream("graph_send_image")
 def send_image_message(recipient_id, image_url, caption=""):
     """Envoyer une image via Facebook Messenger"""
     if not PAGE_ACCESS_TOKEN:
@@ -665,22 +1634,11 @@ def send_image_message(recipient_id, image_url, caption=""):
         return {"success": False, "error": "Empty image URL"}
     
     # Envoyer l'image
-    data = {
-        "recipient": {"id": str(recipient_id)},
-        "message": {
-            "attachment": {
-                "type": "image",
-                "payload": {
-                    "url": image_url,
-                    "is_reusable": True
-                }
-            }
-        }
-    }
+    data = image_message_payload(recipient_id, image_url)
     
     try:
-        response = requests.post(
-            "https://graph.facebook.com/v18.0/me/messages",
+        response = http().post(
+            f"{GRAPH_API_URL}/v18.0/me/messages",
             params={"access_token": PAGE_ACCESS_TOKEN},
             json=data,
             timeout=20
@@ -689,7 +1647,8 @@ def send_image_message(recipient_id, image_url, caption=""):
         if response.status_code == 200:
             # Envoyer la caption séparément si fournie
             if caption:
-                time.sleep(0.5)
+                with trace_span("caption_wait"):
+                    time.sleep(0.5)
                 return send_message(recipient_id, caption)
             return {"success": True}
         else:
@@ -700,8 +1659,741 @@ def send_image_message(recipient_id, image_url, caption=""):
         logger.error(f"❌ Erreur envoi image: {e}")
         return {"success": False, "error": str(e)}
 
+# === ENVOIS GROUPÉS (BATCH GRAPH) ===
+
+def batch_item(payload):
+    """Un appel Send API dans une requête batch (corps encodé comme un formulaire)"""
+    import urllib.parse
+    return {
+        "method": "POST",
+        "relative_url": "v18.0/me/messages",
+        "body": urllib.parse.urlencode({key: json.dumps(value, ensure_ascii=False) for key, value in payload.items()})
+    }
+
+def batch_result(item):
+    """Résultat d'un élément du batch (None: non traité par Graph, à renvoyer seul)"""
+    if item is None:
+        return {"success": False, "error": "Not processed", "retry": True}
+    if item.get("code") == 200:
+        return {"success": True}
+    try:
+        error = json.loads(item.get("body") or "{}").get("error", {}).get("message")
+    except ValueError:
+        error = None
+    return {"success": False, "error": f"API Error {item.get('code')}" + (f": {error}" if error else "")}
+
+@observe_upstream("graph_batch")
+def send_batch(payloads):
+    """Jusqu'à GRAPH_BATCH_SIZE messages en une requête HTTP; un résultat par message, dans l'ordre"""
+    if not PAGE_ACCESS_TOKEN:
+        logger.error("❌ PAGE_ACCESS_TOKEN manquant")
+        return [{"success": False, "error": "No token"} for _ in payloads]
+    
+    try:
+        response = http().post(
+            f"{GRAPH_API_URL}/",
+            data={
+                "access_token": PAGE_ACCESS_TOKEN,
+                "include_headers": "false",
+                "batch": json.dumps([batch_item(payload) for payload in payloads], ensure_ascii=False)
+            },
+            timeout=30
+        )
+        if response.status_code != 200:
+            logger.error(f"❌ Erreur batch Facebook: {response.status_code}")
+            return [{"success": False, "error": f"API Error {response.status_code}"} for _ in payloads]
+        items = response.json()
+    except Exception as e:
+        logger.error(f"❌ Erreur envoi batch: {e}")
+        return [{"success": False, "error": str(e)} for _ in payloads]
+    
+    # Graph renvoie les éléments dans l'ordre de la requête (null pour ceux qu'il n'a pas eu le temps de traiter)
+    items = list(items) + [None] * (len(payloads) - len(items))
+    return [batch_result(item) for item in items[:len(payloads)]]
+
+def send_text_batch(recipient_ids, text):
+    """Un même texte vers plusieurs destinataires; résultats alignés sur recipient_ids"""
+    if GRAPH_BATCH_SIZE <= 1:
+        return [send_message(recipient_id, text) for recipient_id in recipient_ids]
+    results = send_batch([text_message_payload(recipient_id, text) for recipient_id in recipient_ids])
+    return [send_message(recipient_id, text) if result.get("retry") else result
+            for recipient_id, result in zip(recipient_ids, results)]
+
+# === DÉDUPLICATION DES LIVRAISONS ===
+
+class RecentMessageIds:
+    """Index borné des mid déjà vus: fenêtre TTL + capacité fixe (anneau d'empreintes 64 bits)"""
+    
+    def __init__(self, ttl, capacity):
+        self.ttl = ttl
+        self.capacity = capacity
+        self.ring = deque()  # (horodatage, empreinte) dans l'ordre d'arrivée
+        self.seen = {}  # empreinte -> horodatage
+        self.lock = threading.Lock()
+        self.duplicates = 0
+    
+    @staticmethod
+    def fingerprint(mid):
+        """Empreinte stable de 8 octets (plus compacte qu'un mid de ~90 caractères)"""
+        return int.from_bytes(hashlib.blake2b(mid.encode("utf-8"), digest_size=8).digest(), "big")
+    
+    def seen_before(self, mid):
+        """Enregistrer un mid; True s'il a déjà été livré dans la fenêtre"""
+        key = self.fingerprint(mid)
+        now = time.monotonic()
+        with self.lock:
+            # Expirer les plus anciens (par âge ou par capacité)
+            while self.ring and (now - self.ring[0][0] > self.ttl or len(self.ring) >= self.capacity):
+                stamp, old = self.ring.popleft()
+                if self.seen.get(old) == stamp:
+                    del self.seen[old]
+            
+            if key in self.seen:
+                self.duplicates += 1
+                return True
+            
+            self.seen[key] = now
+            self.ring.append((now, key))
+            return False
+
+# Facebook relivre les événements si on répond lentement ou en 5xx
+delivered_mids = RecentMessageIds(
+    ttl=float(os.getenv("DEDUP_TTL_SECONDS", "900")),
+    capacity=int(os.getenv("DEDUP_CAPACITY", "100000"))
+)
+
+# === CAPTURE DU TRAFIC ===
+
+_capture_lock = threading.Lock()
+
+def pseudonymize(user_id):
+    """Remplacer un PSID par un identifiant numérique stable et non réversible"""
+    digest = hashlib.sha256(f"{CAPTURE_SALT}:{user_id}".encode("utf-8")).digest()
+    return str(int.from_bytes(digest[:8], "big") % 10**15 + 10**15)
+
+def sanitize_payload(data):
+    """Copie du payload sans PSID réels ni URL de pièces jointes"""
+    clean = json.loads(json.dumps(data))
+    for entry in clean.get('entry', []):
+        if 'id' in entry:
+            entry['id'] = pseudonymize(entry['id'])
+        for event in entry.get('messaging', []):
+            for role in ('sender', 'recipient'):
+                if event.get(role, {}).get('id'):
+                    event[role]['id'] = pseudonymize(event[role]['id'])
+            for attachment in event.get('message', {}).get('attachments', []):
+                if attachment.get('payload', {}).get('url'):
+                    attachment['payload']['url'] = f"{POLLINATIONS_URL}/prompt/captured"
+    return clean
+
+def capture_webhook(data):
+    """Ajouter un payload webhook anonymisé au fichier de capture"""
+    line = json.dumps({"ts": time.time(), "payload": sanitize_payload(data)}, ensure_ascii=False)
+    with _capture_lock:
+        with open(CAPTURE_FILE, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+# === FILES DE PRIORITÉ (BULKHEADS) ===
+
+class WorkLane:
+    """File de travail isolée avec sa propre limite de concurrence"""
+    
+    def __init__(self, name, workers, sheddable=False):
+        self.name = name
+        self.workers = workers
+        self.sheddable = sheddable
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"lane-{name}")
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.active = 0
+        self.completed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.service_time = 0.0  # Moyenne glissante de la durée d'une tâche
+        self.shed = 0
+        self.pending = {}  # numéro -> (future, fonction, arguments, trace) pas encore commencées
+        self.sequence = 0
+    
+    def estimated_wait(self):
+        """Estimer l'attente d'une nouvelle tâche à partir des durées récentes"""
+        with self.lock:
+            if self.active < self.workers:
+                return 0.0
+            return (self.queued + 1) / self.workers * self.service_time
+    
+    def overloaded(self):
+        """La file dépasse-t-elle le seuil d'attente acceptable ?"""
+        return self.sheddable and self.estimated_wait() > SHED_WAIT_SECONDS
+    
+    def submit(self, func, *args):
+        """Mettre une tâche en file (retourne immédiatement)"""
+        number, context, trace = self._enqueue(func, args)
+        enqueued_at = time.monotonic()
+        
+        def run():
+            started_at = self._start(number, enqueued_at, trace)
+            if started_at is None:
+                return None
+            try:
+                return func(*args)
+            except Exception as e:
+                logger.error(f"❌ Erreur file {self.name}: {e}")
+            finally:
+                self._finish(started_at, trace)
+        
+        future = self.executor.submit(context.run, run)
+        with self.lock:
+            if number in self.pending:
+                self.pending[number] = (future, func, args, trace)
+        return future
+    
+    def _enqueue(self, func, args):
+        """Compter une tâche en attente (elle poursuit la trace de l'événement qui l'a créée)"""
+        context = contextvars.copy_context()
+        trace = current_trace()
+        hold_trace(trace)
+        with self.lock:
+            self.queued += 1
+            self.sequence += 1
+            number = self.sequence
+            self.pending[number] = (None, func, args, trace)
+        return number, context, trace
+    
+    def _start(self, number, enqueued_at, trace):
+        """Passage de l'attente à l'exécution; None si la tâche a été mise de côté entre-temps"""
+        wait = time.monotonic() - enqueued_at
+        with self.lock:
+            if self.pending.pop(number, None) is None:
+                return None
+            self.queued -= 1
+            self.active += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+        if trace is not None:
+            trace.spans.append({
+                "name": f"queue:{self.name}",
+                "start_ms": round((time.perf_counter() - wait - trace.t0) * 1000, 1),
+                "duration_ms": round(wait * 1000, 1),
+                "thread": threading.current_thread().name
+            })
+        return time.monotonic()
+    
+    def _finish(self, started_at, trace):
+        duration = time.monotonic() - started_at
+        with self.lock:
+            self.active -= 1
+            self.completed += 1
+            self.service_time = duration if self.completed == 1 else 0.8 * self.service_time + 0.2 * duration
+        release_trace(trace)
+    
+    def park_pending(self):
+        """Retirer les tâches pas encore commencées; retourne [(nom de fonction, arguments)]"""
+        with self.lock:
+            pending = list(self.pending.items())
+        parked = []
+        for number, (future, func, args, trace) in pending:
+            if future is None or not future.cancel():
+                continue
+            with self.lock:
+                self.pending.pop(number, None)
+                self.queued -= 1
+            release_trace(trace)
+            parked.append((func.__name__, list(args)))
+        return parked
+    
+    def idle(self):
+        with self.lock:
+            return self.queued == 0 and self.active == 0
+    
+    def stats(self):
+        """Profondeur de file et temps d'attente de cette file"""
+        with self.lock:
+            started = self.completed + self.active
+            return {
+                "workers": self.workers,
+                "queued": self.queued,
+                "active": self.active,
+                "completed": self.completed,
+                "avg_wait_ms": round(self.total_wait / started * 1000, 1) if started else 0.0,
+                "max_wait_ms": round(self.max_wait * 1000, 1),
+                "service_ms": round(self.service_time * 1000, 1),
+                "shed": self.shed
+            }
+
+# Au-delà de cette attente estimée (secondes), on répond en mode dégradé
+SHED_WAIT_SECONDS = float(os.getenv("SHED_WAIT_SECONDS", "30"))
+
+# Une file par classe de travail: une lenteur de Mistral ne bloque jamais /help
+LANES = {
+    "static": WorkLane("static", int(os.getenv("LANE_STATIC_WORKERS", "4"))),
+    "chat": WorkLane("chat", int(os.getenv("LANE_CHAT_WORKERS", "8")), sheddable=True),
+    "vision": WorkLane("vision", int(os.getenv("LANE_VISION_WORKERS", "2")), sheddable=True),
+    "image": WorkLane("image", int(os.getenv("LANE_IMAGE_WORKERS", "4"))),
+    # Une diffusion complète dure des minutes: elle ne doit jamais occuper un worker de "static"
+    "broadcast": WorkLane("broadcast", int(os.getenv("LANE_BROADCAST_WORKERS", "1")))
+}
+
+# File de chaque commande (les messages libres vont dans "chat")
+COMMAND_LANES = {
+    'start': 'static',
+    'help': 'static',
+    'stats': 'static',
+    'admin': 'static',
+    'broadcast': 'broadcast',
+    'restart': 'static',
+    'chat': 'chat',
+    'image': 'image',
+    'anime': 'image',
+    'vision': 'vision'
+}
+
+def lane_for(message_text):
+    """Choisir la file d'un message (les commandes inconnues répondent instantanément)"""
+    if not message_text.startswith('/'):
+        return "chat"
+    command = message_text[1:].split(' ', 1)[0].lower()
+    return COMMAND_LANES.get(command, "static")
+
+def lane_stats():
+    """Statistiques de toutes les files"""
+    return {name: lane.stats() for name, lane in LANES.items()}
+
+def shed_total():
+    """Nombre total de messages servis en mode dégradé"""
+    return sum(lane.shed for lane in LANES.values())
+
+def degraded_reply(message_text):
+    """Réponse sans appel IA: réponses toutes prêtes si possible, sinon 'réessaie bientôt'"""
+    if not message_text.startswith('/'):
+        intent = classify_intent(message_text)
+        if intent == "creator":
+            return CREATOR_TEXT
+        if intent == "image":
+            return IMAGE_HINT_TEXT
+    return BUSY_TEXT
+
+# === LIMITATION PAR UTILISATEUR ===
+
+# Messages autorisés par classe de commande (= file): "rafale/période en secondes"
+RATE_LIMITS = os.getenv("RATE_LIMITS", "chat=6/60,image=3/60,vision=3/120,static=20/60")
+
+SLOW_DOWN_TEXT = "🐢 Doucement ! Tu m'envoies beaucoup de messages d'un coup ! Laisse-moi {wait} secondes pour souffler et je te réponds avec plaisir ! 💕"
+
+sender_limiter = SenderRateLimiter(parse_rates(RATE_LIMITS))
+
+register_metric(Gauge("nakamabot_ratelimited_total", "Messages refusés par la limitation par utilisateur", ("lane", "action"),
+                      lambda: dict(sender_limiter.counters), kind="counter"))
+
+def dispatch_message(sender_id, message_text):
+    """Contrôle d'admission puis mise en file du message"""
+    lane_name = lane_for(message_text)
+    lane = LANES[lane_name]
+    
+    if sender_id not in ADMIN_IDS:
+        admitted, wait = sender_limiter.admit(sender_id, lane_name)
+        if not admitted:
+            if sender_limiter.throttled(sender_id, lane_name, wait):
+                logger.info("🐢 %s limité sur %s (%.0f s)", sender_id, lane_name, wait, extra=LOG_INBOUND)
+                LANES["static"].submit(send_message, sender_id, SLOW_DOWN_TEXT.format(wait=max(int(wait) + 1, 1)))
+            return False
+    
+    if lane.overloaded():
+        with lane.lock:
+            lane.shed += 1
+        logger.warning("⏳ File %s saturée, réponse dégradée pour %s", lane.name, sender_id, extra=LOG_INBOUND)
+        LANES["static"].submit(send_message, sender_id, degraded_reply(message_text))
+        return False
+    
+    lane.submit(handle_text_message, sender_id, message_text)
+    return True
+
+def handle_message_event(sender_id, message):
+    """Traiter un événement 'message' du webhook (image et/ou texte)"""
+    with trace_span("parse"):
+        # Ignorer les relivraisons d'un message déjà traité
+        mid = message.get('mid')
+        if mid and delivered_mids.seen_before(mid):
+            logger.info("🔁 Message %.20s déjà traité, ignoré", mid, extra=LOG_INBOUND)
+            return
+        
+        # Ajouter utilisateur
+        register_user(sender_id)
+        
+        # Vérifier si c'est une image
+        if 'attachments' in message:
+            for attachment in message['attachments']:
+                if attachment.get('type') == 'image':
+                    # Stocker l'URL de l'image pour les commandes /anime et /vision
+                    image_url = attachment.get('payload', {}).get('url')
+                    if image_url:
+                        user_last_image[sender_id] = image_url
+                        logger.info("📸 Image reçue de %s", sender_id, extra=LOG_INBOUND)
+                        
+                        # Répondre automatiquement
+                        response = f"📸 Super ! J'ai bien reçu ton image ! ✨\n\n🎭 Tape /anime pour la transformer en style anime !\n👁️ Tape /vision pour que je te dise ce que je vois !\n\n💕 Ou continue à me parler normalement !"
+                        LANES["static"].submit(send_message, sender_id, response)
+                        continue
+        
+        # Récupérer texte
+        message_text = message.get('text', '').strip()
+    
+    if message_text:
+        logger.info("📨 Message de %s: %.50s...", sender_id, message_text, extra=LOG_INBOUND)
+        broadcast_scheduler.note_inbound(sender_id)
+        
+        # Traiter commande dans sa file (réponse immédiate à Facebook)
+        dispatch_message(sender_id, message_text)
+
+def handle_text_message(sender_id, message_text):
+    """Traiter un message texte et envoyer la réponse (exécuté dans une file)"""
+    with trace_span("dispatch"):
+        response = process_command(sender_id, message_text)
+    
+    if response:
+        # Vérifier si c'est une image
+        if isinstance(response, dict) and response.get("type") == "image":
+            # Envoyer image
+            send_result = send_image_message(sender_id, response["url"], response["caption"])
+            
+            if send_result.get("success"):
+                logger.info("✅ Image envoyée à %s", sender_id, extra=LOG_OUTBOUND)
+            else:
+                logger.warning("❌ Échec envoi image à %s", sender_id, extra=LOG_OUTBOUND)
+                # Fallback texte
+                send_message(sender_id, f"🎨 Image créée avec amour mais petite erreur d'envoi ! Réessaie ! 💕")
+        else:
+            # Message texte normal
+            send_result = send_message(sender_id, response)
+            
+            if send_result.get("success"):
+                logger.info("✅ Réponse envoyée à %s", sender_id, extra=LOG_OUTBOUND)
+            else:
+                logger.warning("❌ Échec envoi à %s", sender_id, extra=LOG_OUTBOUND)
+
+register_metric(Gauge("nakamabot_lane_queued", "Tâches en attente par file", ("lane",),
+                      lambda: {name: lane.queued for name, lane in LANES.items()}))
+register_metric(Gauge("nakamabot_lane_active", "Tâches en cours par file", ("lane",),
+                      lambda: {name: lane.active for name, lane in LANES.items()}))
+register_metric(Gauge("nakamabot_lane_shed_total", "Messages servis en mode dégradé par file", ("lane",),
+                      lambda: {name: lane.shed for name, lane in LANES.items()}, kind="counter"))
+register_metric(Gauge("nakamabot_duplicates_suppressed_total", "Relivraisons Facebook ignorées", (),
+                      lambda: delivered_mids.duplicates, kind="counter"))
+register_metric(Gauge("nakamabot_log_dropped_total", "Logs écartés par échantillonnage ou limite de débit", ("category",),
+                      log_sampling.dropped_counts, kind="counter"))
+register_metric(Gauge("nakamabot_users", "Utilisateurs connus", (), lambda: len(user_list)))
+register_metric(Gauge("nakamabot_conversations", "Conversations en mémoire", (), lambda: len(user_memory)))
+
+# === ARRÊT EN DOUCEUR ===
+
+# État sauvé à l'arrêt et rechargé au démarrage suivant
+STATE_FILE = os.getenv("STATE_FILE", "nakamabot_state.json")
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "20"))
+
+# Tâches de file qui peuvent être rejouées par le processus suivant
+REPLAYABLE_JOBS = ("handle_text_message", "send_message")
+
+draining = threading.Event()
+drain_done = threading.Event()  # Vidage terminé, état sauvé
+_parked_broadcasts = []
+_parked_lock = threading.Lock()
+
+def park_broadcast(text, recipients, schedule=None):
+    """Mettre de côté les destinataires restants d'une diffusion interrompue (schedule: fenêtre d'une diffusion étalée)"""
+    with _parked_lock:
+        _parked_broadcasts.append({"text": text, "recipients": list(recipients), "schedule": schedule})
+    return len(recipients)
+
+def wait_for_lanes(deadline):
+    """Attendre que toutes les files soient vides (True) ou l'échéance (False)"""
+    while time.monotonic() < deadline:
+        if all(lane.idle() for lane in LANES.values()):
+            return True
+        time.sleep(0.05)
+    return False
+
+def save_state(jobs):
+    """Écrire l'état en mémoire et les tâches en attente (écriture atomique)"""
+    with memory_stats.lock:
+        per_user = dict(memory_stats.per_user.items())
+    with _parked_lock:
+        broadcasts = list(_parked_broadcasts)
+    state = {
+        "saved_at": time.time(),
+        "users": user_directory.snapshot(),
+        "extra_users": [user_id for user_id in user_list.snapshot() if user_directory.last_seen(user_id) is None],
+        "memory": {user_id: list(memory) for user_id, memory in user_memory.snapshot()},
+        "messages_per_user": per_user,
+        "last_image": dict(user_last_image.snapshot()),
+        "jobs": jobs,
+        "broadcasts": broadcasts
+    }
+    temporary = f"{STATE_FILE}.tmp"
+    with open(temporary, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(temporary, STATE_FILE)
+    return state
+
+def restore_state():
+    """Recharger l'état laissé par le processus précédent et relancer ses tâches"""
+    if not STATE_FILE or not os.path.exists(STATE_FILE):
+        return None
+    try:
+        with open(STATE_FILE, encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.error(f"❌ État illisible ({STATE_FILE}): {e}")
+        return None
+    
+    user_directory.restore([tuple(row) for row in state.get("users", [])])
+    user_list.update(user_id for user_id, _ in state.get("users", []))
+    user_list.update(state.get("extra_users", []))
+    for user_id, messages in state.get("memory", {}).items():
+        user_memory[user_id].extend(messages)
+    user_last_image.update(state.get("last_image", {}))
+    memory_stats.rebuild(state.get("messages_per_user", {}))
+    invalidate_responses()
+    
+    replayed = 0
+    for name, args in state.get("jobs", []):
+        if name in REPLAYABLE_JOBS:
+            job = globals()[name]
+            lane = LANES[lane_for(args[1])] if name == "handle_text_message" else LANES["static"]
+            lane.submit(job, *args)
+            replayed += 1
+    for broadcast in state.get("broadcasts", []):
+        if broadcast.get("schedule"):
+            broadcast_scheduler.schedule(broadcast["text"], broadcast["recipients"], **broadcast["schedule"])
+        else:
+            LANES["broadcast"].submit(broadcast_message, broadcast["text"], broadcast["recipients"])
+    
+    # Ne jamais rejouer deux fois les mêmes tâches
+    os.remove(STATE_FILE)
+    logger.info("♻️ État restauré: %d utilisateurs, %d conversations, %d tâches, %d diffusions reprises",
+                len(user_list), len(user_memory), replayed, len(state.get("broadcasts", [])))
+    return state
+
+def drain(reason):
+    """Finir ou sauver le travail en cours (draining déjà levé: plus de nouveau travail)"""
+    started = time.monotonic()
+    logger.info("🛑 Arrêt en douceur (%s): vidage des files (max %.0f s)", reason, DRAIN_TIMEOUT)
+    
+    drained = wait_for_lanes(started + DRAIN_TIMEOUT)
+    jobs = []
+    for lane in LANES.values():
+        for name, args in lane.park_pending():
+            if name in REPLAYABLE_JOBS:
+                jobs.append((name, args))
+            else:
+                logger.warning("⚠️ Tâche %s non rejouable abandonnée (file %s)", name, lane.name)
+    # Laisser les diffusions en cours noter leurs destinataires restants
+    wait_for_lanes(time.monotonic() + 1.0)
+    for text, recipients, schedule in broadcast_scheduler.park():
+        park_broadcast(text, recipients, schedule)
+    abandoned = sum(lane.active for lane in LANES.values())
+    
+    if not STATE_FILE:
+        logger.warning("⚠️ STATE_FILE vide: état non sauvé")
+    else:
+        try:
+            state = save_state(jobs)
+            logger.info("💾 État sauvé dans %s: %d utilisateurs, %d tâches, %d diffusions",
+                        STATE_FILE, len(state["users"]) + len(state["extra_users"]), len(jobs), len(state["broadcasts"]))
+        except Exception as e:
+            logger.error(f"❌ Sauvegarde de l'état impossible: {e}")
+    if not drained and abandoned:
+        logger.warning("⚠️ Échéance atteinte: %d tâches en cours interrompues", abandoned)
+    
+    logger.info("👋 Vidage terminé en %.1f s", time.monotonic() - started)
+    drain_done.set()
+
+def drain_and_exit(reason):
+    """Vider puis quitter (serveur Flask: ses threads de requête ne s'arrêteraient pas d'eux-mêmes)"""
+    drain(reason)
+    _log_listener.stop()
+    os._exit(0)
+
+def request_shutdown(reason):
+    """Lancer l'arrêt en douceur en arrière-plan (False s'il est déjà en cours)"""
+    if draining.is_set():
+        return False
+    draining.set()
+    threading.Thread(target=drain_and_exit, args=(reason,), name="drain", daemon=True).start()
+    return True
+
+# === DIFFUSION ÉTALÉE ===
+
+def notify_admin(admin_id, text):
+    LANES["static"].submit(send_message, admin_id, text)
+
+broadcast_scheduler = BroadcastScheduler(BROADCAST_TICK, deliver_batch, mistral_limiter, draining,
+                                         notify=notify_admin, batch_size=GRAPH_BATCH_SIZE)
+
+def format_broadcast_schedule():
+    """État des diffusions étalées pour /broadcast --status"""
+    stats = broadcast_scheduler.stats()
+    if not stats["jobs"]:
+        return "🗓️ Aucune diffusion étalée en cours ! 🌸"
+    text = "🗓️ DIFFUSIONS ÉTALÉES\n"
+    for number, job in enumerate(stats["jobs"], 1):
+        window = f"{datetime.fromtimestamp(job['start_at']).strftime('%d/%m %H:%M')} → {datetime.fromtimestamp(job['deadline']).strftime('%d/%m %H:%M')}"
+        text += f"\n{number}. {window} : ✅ {job['sent']} envoyés, ⏳ {job['remaining']} restants, ❌ {job['errors']} erreurs"
+    text += f"\n\n💬 Taux de réponse observé : {stats['reply_ratio'] * 100:.0f}% ({stats['replies']} réponses)"
+    text += f"\n🧠 Pauses faute de capacité Mistral : {stats['throttled_ticks']} ticks"
+    return text
+
+register_metric(Gauge("nakamabot_broadcast_scheduled_remaining", "Destinataires restants des diffusions étalées", (),
+                      lambda: sum(job["remaining"] for job in broadcast_scheduler.stats()["jobs"])))
+
+# === SONDES DE SANTÉ ===
+
+PROBE_INTERVAL = float(os.getenv("PROBE_INTERVAL", "60"))
+
+class HealthProber:
+    """Sondes légères en arrière-plan; /health et /admin test lisent le dernier résultat"""
+    
+    def __init__(self, interval):
+        self.interval = interval
+        self.results = {}
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+    
+    @staticmethod
+    def probe_mistral():
+        """Liste des modèles: aucun token consommé"""
+        if not MISTRAL_API_KEY:
+            return None
+        return http().get(f"{MISTRAL_API_URL}/v1/models",
+                            headers={"Authorization": f"Bearer {MISTRAL_API_KEY}"}, timeout=5).status_code
+    
+    @staticmethod
+    def probe_graph():
+        if not PAGE_ACCESS_TOKEN:
+            return None
+        return http().get(f"{GRAPH_API_URL}/v18.0/me", params={"fields": "id", "access_token": PAGE_ACCESS_TOKEN},
+                            timeout=5).status_code
+    
+    @staticmethod
+    def probe_pollinations():
+        return http().head(POLLINATIONS_URL, timeout=5, allow_redirects=True).status_code
+    
+    def run_once(self):
+        """Lancer toutes les sondes et mémoriser leurs résultats horodatés"""
+        probes = {
+            "mistral": self.probe_mistral,
+            "facebook": self.probe_graph,
+            "pollinations": self.probe_pollinations
+        }
+        for name, probe in probes.items():
+            started = time.perf_counter()
+            result = {"checked_at": datetime.now().isoformat()}
+            try:
+                status = probe()
+                if status is None:
+                    result.update(ok=False, error="not configured")
+                else:
+                    # Pollinations répond parfois 4xx sur la racine: seul le 5xx compte comme panne
+                    ok = status < 500 if name == "pollinations" else status == 200
+                    result.update(ok=ok, status=status)
+            except Exception as e:
+                result.update(ok=False, error=str(e)[:100])
+            result["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            with self.lock:
+                self.results[name] = result
+    
+    def snapshot(self):
+        with self.lock:
+            return {name: dict(result) for name, result in self.results.items()}
+    
+    def _loop(self):
+        while not self.stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"❌ Erreur sondes: {e}")
+            self.stop_event.wait(self.interval)
+    
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._loop, name="health-prober", daemon=True)
+            self.thread.start()
+    
+    def stop(self):
+        self.stop_event.set()
+
+health_prober = HealthProber(PROBE_INTERVAL)
+
+WARMUP_DELAY = float(os.getenv("WARMUP_DELAY", "1"))
+
+def start_background_services():
+    """Services d'arrière-plan, lancés juste après le démarrage du serveur"""
+    def delayed():
+        # Laisser le serveur ouvrir son port avant de consommer du CPU
+        time.sleep(WARMUP_DELAY)
+        warm_connections()
+        health_prober.start()
+        faq_cache.seed(FAQ_SEEDS)
+    threading.Thread(target=delayed, name="warmup", daemon=True).start()
+
+def _process_age_ms():
+    """Âge du processus (depuis le lancement de l'interpréteur), Linux uniquement"""
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return round((uptime - start_ticks / os.sysconf("SC_CLK_TCK")) * 1000, 1)
+    except (OSError, ValueError, IndexError):
+        return None
+
+@app.after_request
+def record_first_response(response):
+    """Noter le temps jusqu'à la première réponse servie (une seule fois)"""
+    if "first_response_ms" not in STARTUP_PROFILE:
+        STARTUP_PROFILE["first_response_ms"] = round((time.perf_counter() - BOOT_STARTED) * 1000, 1)
+        STARTUP_PROFILE["first_response_process_age_ms"] = _process_age_ms()
+        logger.info("⏱️ Première réponse servie: %s", STARTUP_PROFILE)
+    return response
+
+register_metric(Gauge("nakamabot_upstream_up", "Dernier résultat des sondes (1 = joignable)", ("upstream",),
+                      lambda: {name: int(result["ok"]) for name, result in health_prober.snapshot().items()}))
+register_metric(Gauge("nakamabot_upstream_probe_latency_ms", "Latence de la dernière sonde", ("upstream",),
+                      lambda: {name: result["latency_ms"] for name, result in health_prober.snapshot().items()}))
+
 # === ROUTES FLASK ===
 
+def record_capture(data):
+    """Capturer le payload si CAPTURE_FILE est configuré (une erreur n'interrompt pas le webhook)"""
+    if not CAPTURE_FILE:
+        return
+    try:
+        capture_webhook(data)
+    except Exception as e:
+        logger.error(f"❌ Erreur capture: {e}")
+
+def process_webhook(data, capture=True):
+    """Parcourir un payload webhook et mettre ses messages en file (aussi utilisé par aio.py)
+
+    capture=False: le payload a déjà été capturé par l'appelant (aio.py le fait hors de l'event loop).
+    """
+    if capture:
+        record_capture(data)
+    
+    # Traiter les messages
+    for entry in data.get('entry', []):
+        for event in entry.get('messaging', []):
+            sender_id = event.get('sender', {}).get('id')
+            
+            if not sender_id:
+                continue
+            
+            sender_id = str(sender_id)
+            
+            # Messages non-echo
+            if 'message' in event and not event['message'].get('is_echo'):
+                with traced("webhook", sender_id=sender_id):
+                    handle_message_event(sender_id, event['message'])
+
 @app.route("/", methods=['GET'])
 def home():
     """Route d'accueil"""
@@ -736,6 +2428,10 @@ def webhook():
             return "Verification failed", 403
         
     elif request.method == 'POST':
+        # Arrêt en cours: Facebook relivrera l'événement au processus suivant
+        if draining.is_set():
+            return jsonify({"error": "Draining"}), 503
+        
         try:
             data = request.get_json()
             
@@ -743,65 +2439,7 @@ def webhook():
                 logger.warning("⚠️ Aucune donnée reçue")
                 return jsonify({"error": "No data received"}), 400
             
-            # Traiter les messages
-            for entry in data.get('entry', []):
-                for event in entry.get('messaging', []):
-                    sender_id = event.get('sender', {}).get('id')
-                    
-                    if not sender_id:
-                        continue
-                    
-                    sender_id = str(sender_id)
-                    
-                    # Messages non-echo
-                    if 'message' in event and not event['message'].get('is_echo'):
-                        # Ajouter utilisateur
-                        user_list.add(sender_id)
-                        
-                        # Vérifier si c'est une image
-                        if 'attachments' in event['message']:
-                            for attachment in event['message']['attachments']:
-                                if attachment.get('type') == 'image':
-                                    # Stocker l'URL de l'image pour les commandes /anime et /vision
-                                    image_url = attachment.get('payload', {}).get('url')
-                                    if image_url:
-                                        user_last_image[sender_id] = image_url
-                                        logger.info(f"📸 Image reçue de {sender_id}")
-                                        
-                                        # Répondre automatiquement
-                                        response = f"📸 Super ! J'ai bien reçu ton image ! ✨\n\n🎭 Tape /anime pour la transformer en style anime !\n👁️ Tape /vision pour que je te dise ce que je vois !\n\n💕 Ou continue à me parler normalement !"
-                                        send_message(sender_id, response)
-                                        continue
-                        
-                        # Récupérer texte
-                        message_text = event['message'].get('text', '').strip()
-                        
-                        if message_text:
-                            logger.info(f"📨 Message de {sender_id}: {message_text[:50]}...")
-                            
-                            # Traiter commande
-                            response = process_command(sender_id, message_text)
-
-                            if response:
-                                # Vérifier si c'est une image
-                                if isinstance(response, dict) and response.get("type") == "image":
-                                    # Envoyer image
-                                    send_result = send_image_message(sender_id, response["url"], response["caption"])
-                                    
-                                    if send_result.get("success"):
-                                        logger.info(f"✅ Image envoyée à {sender_id}")
-                                    else:
-                                        logger.warning(f"❌ Échec envoi image à {sender_id}")
-                                        # Fallback texte
-                                        send_message(sender_id, f"🎨 Image créée avec amour mais petite erreur d'envoi ! Réessaie ! 💕")
-                                else:
-                                    # Message texte normal
-                                    send_result = send_message(sender_id, response)
-                                    
-                                    if send_result.get("success"):
-                                        logger.info(f"✅ Réponse envoyée à {sender_id}")
-                                    else:
-                                        logger.warning(f"❌ Échec envoi à {sender_id}")
+            process_webhook(data)
                                         
         except Exception as e:
             logger.error(f"❌ Erreur webhook: {e}")
@@ -825,6 +2463,60 @@ def stats():
         "note": "Statistiques détaillées réservées aux admins via /stats"
     })
 
+@app.route("/metrics", methods=['GET'])
+def metrics():
+    """Métriques au format texte Prometheus"""
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+def admin_api_authorized():
+    """Vérifier le jeton des routes d'administration HTTP (en-tête seulement: une URL finit dans les logs)"""
+    token = request.headers.get("X-Admin-Token", "")
+    return bool(ADMIN_API_TOKEN) and hmac.compare_digest(token.encode(), ADMIN_API_TOKEN.encode())
+
+@app.route("/traces", methods=['GET'])
+def traces():
+    """Les traces les plus lentes (admin)"""
+    if not admin_api_authorized():
+        return jsonify({"error": "Forbidden"}), 403
+    count = request.args.get("n", default=10, type=int)
+    return jsonify([trace.to_dict() for trace in trace_buffer.slowest_traces(count)])
+
+@app.route("/admin/limits", methods=['GET'])
+def limits():
+    """Limites adaptatives courantes et leur historique (admin)"""
+    if not admin_api_authorized():
+        return jsonify({"error": "Forbidden"}), 403
+    return jsonify(limiter_stats(history=True))
+
+@app.route("/admin/users/export", methods=['GET'])
+def export_users():
+    """Export CSV ou JSONL de tous les utilisateurs, en flux (admin)"""
+    if not admin_api_authorized():
+        return jsonify({"error": "Forbidden"}), 403
+    
+    export_format = request.args.get("format", "csv")
+    if export_format not in ("csv", "jsonl"):
+        return jsonify({"error": "format must be csv or jsonl"}), 400
+    
+    def rows():
+        if export_format == "csv":
+            yield "user_id,last_seen,messages_in_memory,has_image\n"
+        for user_id, last_seen in user_directory.iter_all():
+            seen = datetime.fromtimestamp(last_seen).isoformat() if last_seen else ""
+            memory = user_memory.get(user_id)
+            messages = len(memory) if memory else 0
+            has_image = user_id in user_last_image
+            if export_format == "csv":
+                yield f"{user_id},{seen},{messages},{int(has_image)}\n"
+            else:
+                yield json.dumps({"user_id": user_id, "last_seen": seen,
+                                  "messages_in_memory": messages, "has_image": has_image}) + "\n"
+    
+    mimetype = "text/csv" if export_format == "csv" else "application/x-ndjson"
+    response = Response(stream_with_context(rows()), mimetype=mimetype)
+    response.headers["Content-Disposition"] = f"attachment; filename=users.{export_format}"
+    return response
+
 @app.route("/health", methods=['GET'])
 def health():
     """Santé du bot"""
@@ -841,6 +2533,14 @@ def health():
             "conversations": len(user_memory),
             "images_stored": len(user_last_image)
         },
+        "probes": health_prober.snapshot(),
+        "lanes": lane_stats(),
+        "startup": STARTUP_PROFILE,
+        "shed_total": shed_total(),
+        "limiters": limiter_stats(),
+        "rate_limits": sender_limiter.stats(),
+        "duplicates_suppressed": delivered_mids.duplicates,
+        "draining": draining.is_set(),
         "version": "4.0 Amicale + Vision",
         "creator": "Durand",
         "timestamp": datetime.now().isoformat()
@@ -852,14 +2552,23 @@ def health():
         issues.append("Clé IA manquante")
     if not PAGE_ACCESS_TOKEN:
         issues.append("Token Facebook manquant")
+    for name, result in health_status["probes"].items():
+        if not result["ok"] and result.get("error") != "not configured":
+            issues.append(f"{name} injoignable")
     
     if issues:
         health_status["status"] = "degraded"
         health_status["issues"] = issues
+    if draining.is_set():
+        health_status["status"] = "draining"
     
-    status_code = 200 if health_status["status"] == "healthy" else 503
+    # 503 seulement si cette instance ne doit plus recevoir de trafic: une panne de Mistral,
+    # Graph ou Pollinations touche toutes les instances, la redémarrer n'y changerait rien
+    status_code = 503 if health_status["status"] == "draining" else 200
     return jsonify(health_status), status_code
 
+STARTUP_PROFILE["module_ready_ms"] = round((time.perf_counter() - BOOT_STARTED) * 1000, 1)
+
 # === DÉMARRAGE ===
 
 if __name__ == "__main__":
@@ -888,8 +2597,25 @@ if __name__ == "__main__":
     logger.info(f"🎨 {len(COMMANDS)} commandes disponibles")
     logger.info(f"🔐 {len(ADMIN_IDS)} administrateurs")
     logger.info(f"🌐 Serveur sur le port {port}")
+    logger.info("⏱️ Chargement du module en %s ms (imports %s ms)", STARTUP_PROFILE["module_ready_ms"], STARTUP_PROFILE["imports_ms"])
     logger.info("🎉 NakamaBot Amicale + Vision prête à aider avec gentillesse !")
     
+    if SERVER_MODE == "asgi":
+        # aio.py importe "app": réutiliser ce module plutôt que d'en charger une seconde copie
+        sys.modules.setdefault("app", sys.modules[__name__])
+        import aio
+        if aio.MISSING:
+            logger.warning("⚠️ SERVER_MODE=asgi mais %s absent(s): serveur Flask", ", ".join(aio.MISSING))
+        else:
+            aio.serve(port)
+            sys.exit(0)
+    
+    restore_state()
+    start_background_services()
+    
+    # Les redéploiements envoient SIGTERM: même arrêt en douceur que /restart
+    signal.signal(signal.SIGTERM, lambda signum, frame: request_shutdown("SIGTERM"))
+    
     try:
         app.run(
             host="0.0.0.0", 
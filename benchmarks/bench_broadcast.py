@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Diffusion: envois unitaires contre requêtes batch Graph
+
+Charge app.py contre la doublure Graph (latence et taux d'erreur
+configurables), remplit user_list puis lance broadcast_message avec
+GRAPH_BATCH_SIZE=1 (une requête par destinataire) et GRAPH_BATCH_SIZE=50.
+Relève le nombre de requêtes HTTP vers Graph, la durée, les livraisons et
+les erreurs rapportées destinataire par destinataire.
+
+La pause anti-spam de broadcast_message est neutralisée pour mesurer le
+coût réseau seul.
+
+Usage: python benchmarks/bench_broadcast.py --users 2000 --graph-latency 0.03
+"""
+
+import argparse
+import os
+import time
+import types
+
+from common import load_app, write_results
+from standins import StandIns, UpstreamProfile
+
+def run(app, standins, batch_size):
+    app.GRAPH_BATCH_SIZE = batch_size
+    with standins.lock:
+        standins.deliveries.clear()
+        standins.requests["graph"] = 0
+    real_time = app.time
+    app.time = types.SimpleNamespace(sleep=lambda seconds: None, perf_counter=time.perf_counter,
+                                     monotonic=time.monotonic, time=time.time)
+    try:
+        started = time.perf_counter()
+        result = app.broadcast_message("📢 Annonce de test")
+        elapsed = time.perf_counter() - started
+    finally:
+        app.time = real_time
+    return {
+        "graph_requests": standins.requests["graph"],
+        "delivered": len(standins.deliveries),
+        "sent": result["sent"],
+        "errors": result["errors"],
+        "failures": result["failures"],
+        "seconds": round(elapsed, 2),
+        "messages_per_second": round(result["sent"] / elapsed, 1)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Broadcast unitaire contre batch Graph")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--graph-latency", type=float, default=0.03)
+    parser.add_argument("--error-rate", type=float, default=0.01)
+    parser.add_argument("--out", default="bench_broadcast.json")
+    options = parser.parse_args()
+
+    standins = StandIns(graph=UpstreamProfile(options.graph_latency, error_rate=options.error_rate)).start()
+    os.environ.update({"PAGE_ACCESS_TOKEN": "broadcast", "GRAPH_API_URL": standins.url,
+                       "CAPTURE_FILE": "", "STATE_FILE": ""})
+    app = load_app()
+    app.logger.disabled = True
+    for i in range(options.users):
+        app.register_user(str(7000000000000000 + i))
+
+    results = {"users": options.users, "graph_latency_s": options.graph_latency}
+    for batch_size in (1, 50):
+        print(f"📢 GRAPH_BATCH_SIZE={batch_size}...")
+        results[f"batch_{batch_size}"] = run(app, standins, batch_size)
+        for key, value in results[f"batch_{batch_size}"].items():
+            print(f"   {key}: {value}")
+    standins.stop()
+    write_results(options.out, "broadcast", results)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+Temps de démarrage à froid (hébergement qui éteint le bot au repos)
+
+Pour chaque essai, lance `python app.py` dans un nouveau processus et mesure:
+- le délai jusqu'à la première réponse de /health (port ouvert + module chargé)
+- le délai jusqu'au premier webhook traité (réponse livrée à la doublure Graph)
+- le profil interne exposé par /health (imports, chargement, première réponse)
+
+Les services externes sont remplacés par benchmarks/standins.py.
+Le rapport inclut aussi les modules les plus lents à importer (-X importtime).
+
+Usage: python benchmarks/bench_coldstart.py --runs 5
+"""
+
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+
+from common import ROOT_DIR, free_port, http_json, percentile, write_results
+from standins import StandIns
+
+def child_env(standins, port):
+    env = dict(os.environ)
+    env.update({
+        "PORT": str(port),
+        "MISTRAL_API_KEY": "coldstart",
+        "PAGE_ACCESS_TOKEN": "coldstart",
+        "MISTRAL_API_URL": standins.url,
+        "GRAPH_API_URL": standins.url,
+        "POLLINATIONS_URL": standins.url,
+        "CAPTURE_FILE": ""
+    })
+    return env
+
+def one_run(standins, run, timeout):
+    """Un démarrage à froid complet; retourne les délais en millisecondes"""
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    with standins.lock:
+        delivered_before = len(standins.deliveries)
+
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT_DIR, "app.py")], cwd=ROOT_DIR,
+                               env=child_env(standins, port),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        profile = None
+        deadline = started + timeout
+        while time.perf_counter() < deadline:
+            try:
+                _, body = http_json(f"{base}/health", timeout=0.5)
+                profile = (body or {}).get("startup")
+                break
+            except (urllib.error.URLError, ConnectionError, socket.timeout):
+                time.sleep(0.005)
+        if profile is None:
+            return None
+        health_ms = (time.perf_counter() - started) * 1000
+
+        sent = time.perf_counter()
+        http_json(f"{base}/webhook", {
+            "object": "page",
+            "entry": [{"id": "1", "messaging": [{
+                "sender": {"id": str(7000000000000000 + run)},
+                "recipient": {"id": "1"},
+                "message": {"mid": f"m.coldstart.{run}", "text": "salut"}
+            }]}]
+        })
+        first_reply_ms = None
+        while time.perf_counter() < deadline:
+            with standins.lock:
+                if len(standins.deliveries) > delivered_before:
+                    first_reply_ms = (standins.deliveries[delivered_before][0] - started) * 1000
+                    break
+            time.sleep(0.005)
+
+        # Profil complet (première réponse notée après le premier /health)
+        _, body = http_json(f"{base}/health")
+        profile = (body or {}).get("startup", profile)
+
+        return {
+            "health_ms": round(health_ms, 1),
+            "webhook_reply_ms": round(first_reply_ms, 1) if first_reply_ms else None,
+            "webhook_after_ready_ms": round(first_reply_ms - (sent - started) * 1000, 1) if first_reply_ms else None,
+            "profile": profile
+        }
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+def slowest_imports(limit):
+    """Modules les plus coûteux à l'import de app.py (temps cumulé, ms)"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"], cwd=ROOT_DIR,
+                            env=dict(os.environ, MISTRAL_API_KEY="", PAGE_ACCESS_TOKEN=""),
+                            capture_output=True, text=True)
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|", 2)
+        try:
+            cumulative = int(cumulative)
+        except ValueError:
+            continue
+        # L'indentation du nom donne la profondeur: garder les deux premiers niveaux
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth <= 1:
+            modules.append((name.strip(), cumulative))
+    modules.sort(key=lambda item: item[1], reverse=True)
+    return [{"module": name, "cumulative_ms": round(us / 1000, 1)} for name, us in modules[:limit]]
+
+def main():
+    parser = argparse.ArgumentParser(description="Temps de démarrage à froid")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--top-imports", type=int, default=10)
+    parser.add_argument("--out", default="bench_coldstart.json")
+    options = parser.parse_args()
+
+    standins = StandIns().start()
+    runs = []
+    for run in range(options.runs):
+        result = one_run(standins, run, options.timeout)
+        if result is None:
+            print(f"❌ Essai {run + 1}: pas de réponse en {options.timeout} s")
+            continue
+        runs.append(result)
+        print(f"🥶 Essai {run + 1}: /health en {result['health_ms']} ms, "
+              f"première réponse livrée en {result['webhook_reply_ms']} ms")
+    standins.stop()
+
+    def summary(key):
+        values = [run[key] for run in runs if run.get(key) is not None]
+        return {f"p{p}": percentile(values, p) for p in (50, 90)} if values else {}
+
+    results = {
+        "runs": len(runs),
+        "health_ms": summary("health_ms"),
+        "webhook_reply_ms": summary("webhook_reply_ms"),
+        "webhook_after_ready_ms": summary("webhook_after_ready_ms"),
+        "last_profile": runs[-1]["profile"] if runs else None,
+        "slowest_imports": slowest_imports(options.top_imports)
+    }
+    print(f"⏱️ Première réponse /health: {results['health_ms']}")
+    print(f"📨 Premier webhook livré: {results['webhook_reply_ms']}")
+    for entry in results["slowest_imports"][:5]:
+        print(f"   📦 {entry['module']}: {entry['cumulative_ms']} ms")
+    write_results(options.out, "coldstart", results)
+
+if __name__ == "__main__":
+    main()
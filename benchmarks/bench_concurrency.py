@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Conversations simultanées par Go de RAM: serveur Flask (threads) contre cœur asynchrone
+
+Pour chaque mode (SERVER_MODE=flask puis asgi), lance `python app.py` contre
+les doublures avec un Mistral volontairement lent, envoie N messages de N
+utilisateurs différents d'un coup, puis relève pendant que tout est en vol:
+- conversations en cours (files chat de /health)
+- mémoire résidente (VmRSS) et nombre de threads du processus
+
+Le mode flask reçoit LANE_CHAT_WORKERS=N pour pouvoir porter N conversations
+(un thread chacune); le mode asgi les porte en coroutines.
+
+Usage: python benchmarks/bench_concurrency.py --conversations 2000 --mistral-latency 10
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+
+from common import ROOT_DIR, free_port, http_json, write_results
+from standins import StandIns, UpstreamProfile
+
+def process_status(pid):
+    """(RSS en Mo, threads) depuis /proc (Linux)"""
+    fields = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            fields[key] = value.split()
+    return int(fields["VmRSS"][0]) / 1024, int(fields["Threads"][0])
+
+def in_flight(base):
+    """Conversations en cours ou en attente dans la file chat"""
+    _, body = http_json(f"{base}/health", timeout=5)
+    chat = body["lanes"]["chat"]
+    return chat["active"] + chat["queued"]
+
+def post_messages(base, conversations, senders=32):
+    """Envoyer un message par utilisateur, depuis quelques threads clients"""
+    def worker(offset):
+        for i in range(offset, conversations, senders):
+            http_json(f"{base}/webhook", {
+                "object": "page",
+                "entry": [{"id": "1", "messaging": [{
+                    "sender": {"id": str(7000000000000000 + i)},
+                    "recipient": {"id": "1"},
+                    "message": {"mid": f"m.concurrency.{i}", "text": "raconte moi une histoire"}
+                }]}]
+            }, timeout=30)
+    threads = [threading.Thread(target=worker, args=(offset,)) for offset in range(senders)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+def run_mode(mode, standins, options):
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    env = dict(os.environ, **{
+        "PORT": str(port),
+        "SERVER_MODE": mode,
+        "MISTRAL_API_KEY": "concurrency",
+        "PAGE_ACCESS_TOKEN": "concurrency",
+        "MISTRAL_API_URL": standins.url,
+        "GRAPH_API_URL": standins.url,
+        "POLLINATIONS_URL": standins.url,
+        "CAPTURE_FILE": "",
+        "STATE_FILE": "",
+        "LOG_SAMPLING": "inbound=0.001,outbound=0.001",
+        "SHED_WAIT_SECONDS": "3600",
+        "LANE_CHAT_WORKERS": str(options.conversations),
+        "ASYNC_CHAT_CONCURRENCY": str(options.conversations),
+        # Mesurer la capacité de portage, pas la montée du limiteur adaptatif
+        "MISTRAL_LIMIT_INITIAL": str(options.conversations),
+        "MISTRAL_LIMIT_MAX": str(options.conversations)
+    })
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT_DIR, "app.py")], cwd=ROOT_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                http_json(f"{base}/health", timeout=0.5)
+                break
+            except (urllib.error.URLError, ConnectionError, OSError):
+                time.sleep(0.05)
+        time.sleep(1.0)
+        baseline_rss, baseline_threads = process_status(process.pid)
+
+        started = time.monotonic()
+        post_messages(base, options.conversations)
+        posted_s = time.monotonic() - started
+
+        # Relever le pic pendant que Mistral (lent) retient toutes les conversations
+        peak = {"in_flight": 0, "rss_mb": baseline_rss, "threads": baseline_threads}
+        while time.monotonic() - started < options.mistral_latency * 0.9:
+            rss, threads = process_status(process.pid)
+            flying = in_flight(base)
+            if flying >= peak["in_flight"]:
+                peak = {"in_flight": flying, "rss_mb": rss, "threads": threads}
+            time.sleep(0.2)
+
+        extra_mb = max(peak["rss_mb"] - baseline_rss, 0.001)
+        return {
+            "posted_s": round(posted_s, 2),
+            "baseline_rss_mb": round(baseline_rss, 1),
+            "baseline_threads": baseline_threads,
+            "peak_in_flight": peak["in_flight"],
+            "peak_rss_mb": round(peak["rss_mb"], 1),
+            "peak_threads": peak["threads"],
+            "kb_per_conversation": round(extra_mb * 1024 / max(peak["in_flight"], 1), 1),
+            "conversations_per_gb": round(peak["in_flight"] / (peak["rss_mb"] / 1024)),
+            "marginal_conversations_per_gb": round(peak["in_flight"] / (extra_mb / 1024))
+        }
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+def main():
+    parser = argparse.ArgumentParser(description="Conversations simultanées par Go de RAM")
+    parser.add_argument("--conversations", type=int, default=1000)
+    parser.add_argument("--mistral-latency", type=float, default=10.0, help="Durée d'une réponse Mistral simulée")
+    parser.add_argument("--modes", default="flask,asgi")
+    parser.add_argument("--out", default="bench_concurrency.json")
+    options = parser.parse_args()
+
+    standins = StandIns(mistral=UpstreamProfile(options.mistral_latency)).start()
+    results = {"conversations": options.conversations, "mistral_latency_s": options.mistral_latency}
+    for mode in options.modes.split(","):
+        print(f"🧵 Mode {mode}: {options.conversations} conversations...")
+        results[mode] = run_mode(mode, standins, options)
+        for key, value in results[mode].items():
+            print(f"   {key}: {value}")
+    standins.stop()
+    write_results(options.out, "concurrency", results)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Contention sur l'état partagé: sans verrou, verrou global, verrous par tranche
+
+64 threads (par défaut) rejouent le chemin d'un message: inscription dans
+user_list, ajout à user_memory (lecture + écriture sous le verrou de
+l'utilisateur) et lecture de user_last_image. Un thread "admin" prend des
+instantanés de user_memory pendant ce temps, comme /admin ou une diffusion.
+
+Modes comparés:
+- nu: UserIdSet/UserIdMap sans verrou (l'état avant ce changement)
+- global: conteneurs à une seule tranche (= un verrou global)
+- tranches: StripedUserIdSet/StripedUserIdMap (--stripes tranches)
+
+Relève le débit, la latence p50/p99 d'une opération, la durée des
+instantanés et les pertes: messages ou utilisateurs absents à la fin,
+erreurs levées pendant les parcours.
+
+Usage: python benchmarks/bench_contention.py --threads 64 --ops 5000 --users 20000
+"""
+
+import argparse
+import contextlib
+import random
+import threading
+import time
+
+from common import percentile, write_results
+from userids import StripedUserIdMap, StripedUserIdSet, UserIdMap, UserIdSet
+
+def containers(mode, stripes):
+    """(user_list, user_memory, user_last_image, lock_for)"""
+    if mode == "nu":
+        return UserIdSet(), UserIdMap(list), UserIdMap(), lambda user_id: contextlib.nullcontext()
+    stripes = 1 if mode == "global" else stripes
+    memory = StripedUserIdMap(list, stripes=stripes)
+    return StripedUserIdSet(stripes=stripes), memory, StripedUserIdMap(stripes=stripes), memory.lock_for
+
+def run(mode, options):
+    user_list, user_memory, user_last_image, lock_for = containers(mode, options.stripes)
+    psids = [str(7000000000000000 + i * 7919) for i in range(options.users)]
+    for user_id in psids[::10]:
+        user_last_image[user_id] = "https://example.com/image.png"
+    start = threading.Barrier(options.threads + 2)  # Workers, admin et thread principal
+    stop = threading.Event()
+    latencies = []
+    touched = set()
+    scans = {"count": 0, "errors": 0, "durations": []}
+    lock = threading.Lock()
+
+    def worker(seed):
+        rng = random.Random(seed)
+        samples = []
+        seen = set()
+        start.wait()
+        for number in range(options.ops):
+            user_id = psids[rng.randrange(options.users)]
+            began = time.perf_counter()
+            if user_id not in user_list:
+                user_list.add(user_id)
+            with lock_for(user_id):
+                user_memory[user_id].append(number)
+            user_last_image.get(user_id)
+            if number % 10 == 0:
+                samples.append(time.perf_counter() - began)
+            seen.add(user_id)
+        with lock:
+            latencies.extend(samples)
+            touched.update(seen)
+
+    def admin():
+        start.wait()
+        while not stop.is_set():
+            began = time.perf_counter()
+            try:
+                items = user_memory.snapshot() if hasattr(user_memory, "snapshot") else list(user_memory.items())
+                sum(len(messages) for _, messages in items)
+            except Exception:
+                scans["errors"] += 1
+            scans["durations"].append(time.perf_counter() - began)
+            scans["count"] += 1
+            stop.wait(options.scan_every)
+
+    threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(options.threads)]
+    scanner = threading.Thread(target=admin)
+    for thread in threads + [scanner]:
+        thread.start()
+    start.wait()
+    began = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - began
+    stop.set()
+    scanner.join()
+
+    total = options.threads * options.ops
+    stored = sum(len(messages) for _, messages in user_memory.items())
+    return {
+        "ops_per_s": round(total / elapsed),
+        "elapsed_s": round(elapsed, 3),
+        "p50_us": round(percentile(latencies, 50) * 1e6, 1),
+        "p99_us": round(percentile(latencies, 99) * 1e6, 1),
+        "lost_messages": total - stored,
+        "lost_users": len(touched) - sum(1 for user_id in touched if user_id in user_list),
+        "scans": scans["count"],
+        "scan_errors": scans["errors"],
+        "scan_p50_ms": round((percentile(scans["durations"], 50) or 0) * 1e3, 2)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Contention sur user_list / user_memory")
+    parser.add_argument("--threads", type=int, default=64)
+    parser.add_argument("--ops", type=int, default=5000, help="Opérations par thread")
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--stripes", type=int, default=32)
+    parser.add_argument("--scan-every", type=float, default=0.05, help="Secondes entre deux instantanés admin")
+    parser.add_argument("--out", default="bench_contention.json")
+    options = parser.parse_args()
+
+    results = {}
+    for mode in ("nu", "global", "tranches"):
+        results[mode] = run(mode, options)
+        print(f"🧵 {mode}: {results[mode]}")
+
+    write_results(options.out, "contention", results)
+
+if __name__ == "__main__":
+    main()
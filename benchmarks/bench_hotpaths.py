@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmarks des chemins chauds en mémoire
+
+Couvre, pour chaque taille de population (1k à 1M utilisateurs):
+- process_command: parsing et dispatch (/help, commande inconnue, chat avec IA simulée)
+- chat avec le cache FAQ en mode shadow puis on (embeddings simulés, sans latence réseau)
+- add_to_memory / get_memory_context
+- parcours JSON du webhook (sans envoi)
+- agrégations admin de commandes/admin.py (stats, memory, users)
+- broadcast_message avec un envoi simulé
+- empreinte mémoire par utilisateur (tracemalloc)
+
+Aucun appel réseau: Mistral et Facebook sont remplacés par des fonctions locales.
+Sans MISTRAL_API_KEY le cache FAQ est désactivé, donc chat_us n'en contient pas le
+coût: chat_faq_*_us le mesure avec un embedder local instantané. En mode on, la
+latence réelle de l'API d'embeddings s'y ajoute, bornée par FAQ_LOOKUP_BUDGET.
+
+Usage: python benchmarks/bench_hotpaths.py --sizes 1000,10000,100000,1000000
+"""
+
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+import types
+
+from common import load_app, load_command, measure, write_results
+from faq import FaqCache, normalize
+
+ADMIN_ID = "1000000000000001"
+
+def user_id(i):
+    """PSID réaliste (16 chiffres)"""
+    return str(7000000000000000 + i)
+
+def populate(app, size, messages_per_user=4):
+    """Remplir user_list et user_memory; retourne les octets alloués"""
+    app.user_list.clear()
+    app.user_memory.clear()
+    app.user_directory.clear()
+    app.memory_stats.reset_memory()
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for i in range(size):
+        uid = user_id(i)
+        app.register_user(uid)
+        for j in range(messages_per_user):
+            app.add_to_memory(uid, 'user' if j % 2 == 0 else 'bot', f"message {j} de test assez court")
+    allocated = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return allocated
+
+def bench_commands(app):
+    """Parsing + dispatch dans process_command"""
+    return {
+        "help_us": measure(lambda: app.process_command(ADMIN_ID, "/help"), number=2000),
+        "unknown_us": measure(lambda: app.process_command(ADMIN_ID, "/inconnue test"), number=2000),
+        "chat_us": measure(lambda: app.process_command(ADMIN_ID, "raconte moi une blague"), number=2000)
+    }
+
+def local_embedder(dimensions=1024):
+    """Embeddings simulés: un vecteur pseudo-aléatoire fixe par texte (dimension de mistral-embed)"""
+    vectors = {}
+
+    def embed(texts):
+        for text in texts:
+            if text not in vectors:
+                rng = random.Random(text)
+                vectors[text] = normalize([rng.gauss(0, 1) for _ in range(dimensions)])
+        return [vectors[text] for text in texts]
+    return embed
+
+def bench_faq(app):
+    """Chat avec un cache FAQ plein (FAQ_CAPACITY questions), par mode"""
+    real_cache = app.faq_cache
+    embed = local_embedder()
+    seeds = [((f"question fréquente numéro {i}",), "réponse") for i in range(real_cache.index.capacity)]
+    results = {}
+    try:
+        for mode in ("shadow", "on"):
+            app.faq_cache = FaqCache(embed, mode=mode)
+            app.faq_cache.seed(seeds)
+            # En mode on, chaque message attend son lot d'embeddings (EMBED_BATCH_WAIT)
+            results[f"chat_faq_{mode}_us"] = measure(lambda: app.process_command(ADMIN_ID, "raconte moi une blague"),
+                                                     repeat=3, number=50)
+    finally:
+        app.faq_cache = real_cache
+    return results
+
+def bench_memory(app, size):
+    """add_to_memory et get_memory_context sur des utilisateurs existants"""
+    ids = [user_id(random.randrange(size)) for _ in range(1000)]
+    index = [0]
+
+    def add():
+        index[0] = (index[0] + 1) % len(ids)
+        app.add_to_memory(ids[index[0]], 'user', "nouveau message")
+
+    def get():
+        index[0] = (index[0] + 1) % len(ids)
+        app.get_memory_context(ids[index[0]])
+
+    return {"add_to_memory_us": measure(add, number=5000), "get_memory_context_us": measure(get, number=5000)}
+
+def bench_webhook(app, size):
+    """Parcours du payload webhook (JSON, dédup, enregistrement) sans mise en file"""
+    client = app.app.test_client()
+    counter = [0]
+
+    def post():
+        counter[0] += 1
+        client.post("/webhook", json={
+            "object": "page",
+            "entry": [{"id": "1", "messaging": [{
+                "sender": {"id": user_id(counter[0] % size)},
+                "recipient": {"id": "1"},
+                "message": {"mid": f"m.bench.{counter[0]}", "text": "salut"}
+            }]}]
+        })
+
+    return {"webhook_post_us": measure(post, repeat=3, number=500)}
+
+def bench_admin(app, admin_module, size):
+    """Agrégations de /admin (un seul passage: O(utilisateurs))"""
+    execute = admin_module["execute"]
+    number = 1 if size >= 100000 else 20
+    return {
+        f"admin_{action}_us": measure(lambda: execute(ADMIN_ID, action), repeat=3, number=number)
+        for action in ("stats", "memory", "users")
+    }
+
+def bench_broadcast(app):
+    """broadcast_message sans réseau ni pause anti-spam"""
+    real_time = app.time
+    app.time = types.SimpleNamespace(sleep=lambda seconds: None, perf_counter=time.perf_counter,
+                                     monotonic=time.monotonic, time=time.time)
+    try:
+        start = time.perf_counter()
+        result = app.broadcast_message("📢 Annonce de test")
+        elapsed = time.perf_counter() - start
+    finally:
+        app.time = real_time
+    return {"broadcast_s": elapsed, "broadcast_us_per_user": elapsed / max(result["total"], 1) * 1e6}
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks des chemins chauds")
+    parser.add_argument("--sizes", default="1000,10000,100000")
+    parser.add_argument("--out", default="bench_hotpaths.json")
+    options = parser.parse_args()
+
+    app = load_app()
+    app.ADMIN_IDS.add(ADMIN_ID)
+    app.logger.disabled = True
+
+    # Aucun appel externe: IA et Facebook simulés
+    app.call_mistral_api = lambda messages, **kwargs: "Réponse simulée ✨"
+    app.send_message = lambda recipient_id, text: {"success": True}
+    app.send_batch = lambda payloads: [{"success": True}] * len(payloads)
+    app.dispatch_message = lambda sender_id, message_text: True
+    admin_module = load_command(app, "admin")
+
+    results = {}
+    for size in [int(value) for value in options.sizes.split(",")]:
+        print(f"👥 {size} utilisateurs...")
+        started = time.perf_counter()
+        allocated = populate(app, size)
+        entry = {
+            "populate_s": round(time.perf_counter() - started, 3),
+            "memory_bytes_per_user": round(allocated / size, 1)
+        }
+        entry.update(bench_commands(app))
+        entry.update(bench_faq(app))
+        entry.update(bench_memory(app, size))
+        entry.update(bench_webhook(app, size))
+        entry.update(bench_admin(app, admin_module, size))
+        entry.update(bench_broadcast(app))
+        results[str(size)] = {key: round(value, 3) if isinstance(value, float) else value
+                              for key, value in entry.items()}
+        for key, value in results[str(size)].items():
+            print(f"   {key}: {value}")
+
+    write_results(options.out, "hotpaths", results)
+
+if __name__ == "__main__":
+    main()
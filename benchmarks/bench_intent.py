@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark du routage des intentions
+
+Compare l'ancien routage (plusieurs lower() + any() séquentiels) avec
+classify_intent() sur un corpus de messages réels.
+
+Usage: python benchmarks/bench_intent.py [--out bench_intent.json]
+"""
+
+import argparse
+
+from common import load_app, measure, write_results
+
+CORPUS = [
+    "Salut ça va ?",
+    "Qui est ton créateur ?",
+    "tu peux me dessiner un chat ?",
+    "Quelles sont les actualités de 2025 ?",
+    "raconte moi une blague",
+    "c'est qui qui t'a fait ?",
+    "J'aimerais générer une image de dragon",
+    "Quoi de nouveau aujourd'hui ?",
+    "Parle-moi de One Piece, c'est quoi ton arc préféré et pourquoi ?",
+    "merci beaucoup tu es trop gentille 💕",
+    "Comment faire une tarte aux pommes sans four ? J'ai seulement un micro-ondes",
+    "envoie des photos stp",
+    "bonne nuit",
+    "C'est quoi le dernier film récent que tu conseilles ?",
+    "Explique moi la relativité générale simplement, comme à un enfant de 10 ans",
+]
+
+LEGACY_CREATOR = ['créateur', 'createur', 'qui t\'a', 'créé', 'créee', 'maker', 'développeur']
+LEGACY_IMAGE = ['image', 'images', 'photo', 'photos', 'dessiner', 'créer', 'génerer', 'generer']
+LEGACY_SEARCH = ['2025', 'actualité', 'récent', 'nouveau', 'maintenant', 'aujourd\'hui']
+
+def legacy_route(args):
+    """Routage d'origine de cmd_chat (avant classify_intent)"""
+    if any(word in args.lower() for word in LEGACY_CREATOR):
+        return "creator"
+    if any(word in args.lower() for word in LEGACY_IMAGE):
+        return "image"
+    if any(word in args.lower() for word in LEGACY_SEARCH):
+        return "search"
+    return "chat"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--out", default="bench_intent.json")
+    parser.add_argument("--number", type=int, default=2000)
+    options = parser.parse_args()
+
+    app = load_app()
+
+    # Les deux routages doivent être d'accord sur le corpus
+    mismatches = [m for m in CORPUS if legacy_route(m) != app.classify_intent(m)]
+    if mismatches:
+        print(f"⚠️ Routages différents: {mismatches}")
+
+    def run_legacy():
+        for message in CORPUS:
+            legacy_route(message)
+
+    def run_router():
+        for message in CORPUS:
+            app.classify_intent(message)
+
+    legacy_us = measure(run_legacy, number=options.number) / len(CORPUS)
+    router_us = measure(run_router, number=options.number) / len(CORPUS)
+
+    results = {
+        "messages": len(CORPUS),
+        "legacy_us_per_message": round(legacy_us, 3),
+        "router_us_per_message": round(router_us, 3),
+        "speedup": round(legacy_us / router_us, 2) if router_us else None,
+        "mismatches": mismatches
+    }
+    print(f"🐢 Ancien routage : {legacy_us:.2f} µs/message")
+    print(f"⚡ classify_intent : {router_us:.2f} µs/message")
+    write_results(options.out, "intent_router", results)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Stockage des PSID: set/dict de str contre UserIdSet/UserIdMap (int64)
+
+Pour chaque taille (1M utilisateurs par défaut), relève:
+- octets par utilisateur (tracemalloc), IDs compris
+- temps de remplissage
+- parcours complet comme une diffusion (str rendues une à une)
+- test d'appartenance (recherche d'un PSID reçu par le webhook)
+
+Puis l'empreinte réelle dans app.py: register_user (user_list, user_directory,
+compteurs) puis un add_to_memory par utilisateur, chaque PSID arrivant comme
+une str neuve comme depuis le webhook. Seul ce chiffre dit ce que coûte un
+utilisateur: un index resté en str garde chaque ID en vie.
+
+Usage: python benchmarks/bench_userids.py --sizes 100000,1000000 [--app-sizes 100000]
+"""
+
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+
+from common import load_app, measure, write_results
+from userids import UserIdMap, UserIdSet
+
+def psid(i):
+    """PSID réaliste (16 chiffres)"""
+    return str(7000000000000000 + i * 7919)
+
+def build(kind, size):
+    """Remplir un conteneur; retourne (conteneur, octets alloués, secondes)"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    if kind == "set":
+        container = set()
+        for i in range(size):
+            container.add(psid(i))
+    elif kind == "UserIdSet":
+        container = UserIdSet()
+        for i in range(size):
+            container.add(psid(i))
+    elif kind == "dict":
+        container = {}
+        for i in range(size):
+            container[psid(i)] = "https://example.com/image.png"
+    else:
+        container = UserIdMap()
+        for i in range(size):
+            container[psid(i)] = "https://example.com/image.png"
+    elapsed = time.perf_counter() - started
+    allocated = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return container, allocated, elapsed
+
+def app_footprint(app, size):
+    """Octets par utilisateur de l'état de app.py: inscription, puis premier message en mémoire"""
+    app.user_list.clear()
+    app.user_memory.clear()
+    app.user_directory.clear()
+    app.memory_stats.reset_memory()
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for i in range(size):
+        app.register_user(psid(i))
+    registered = tracemalloc.get_traced_memory()[0]
+    for i in range(size):
+        app.add_to_memory(psid(i), "user", "salut")
+    remembered = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return {
+        "register_bytes_per_user": round((registered - before) / size, 1),
+        "memory_bytes_per_user": round((remembered - registered) / size, 1),
+        "total_bytes_per_user": round((remembered - before) / size, 1)
+    }
+
+def scan(container):
+    """Parcours d'une diffusion: chaque destinataire en str"""
+    started = time.perf_counter()
+    count = 0
+    for user_id in container:
+        count += len(user_id) > 0
+    return time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description="PSID en str contre int64")
+    parser.add_argument("--sizes", default="1000000")
+    parser.add_argument("--app-sizes", default="100000", help="Tailles mesurées dans app.py (vide: ignorer)")
+    parser.add_argument("--out", default="bench_userids.json")
+    options = parser.parse_args()
+
+    results = {}
+    for size in [int(value) for value in options.sizes.split(",")]:
+        print(f"👥 {size} utilisateurs...")
+        lookups = [psid(random.randrange(size * 2)) for _ in range(1000)]  # Moitié connus, moitié inconnus
+        entry = {}
+        for kind in ("set", "UserIdSet", "dict", "UserIdMap"):
+            container, allocated, elapsed = build(kind, size)
+            position = [0]
+
+            def lookup():
+                position[0] = (position[0] + 1) % len(lookups)
+                return lookups[position[0]] in container
+
+            entry[kind] = {
+                "bytes_per_user": round(allocated / size, 1),
+                "build_s": round(elapsed, 3),
+                "scan_s": round(scan(container), 3),
+                "lookup_us": round(measure(lookup, repeat=3, number=10000), 3)
+            }
+            print(f"   {kind}: {entry[kind]}")
+            del container
+        results[str(size)] = entry
+
+    if options.app_sizes:
+        app = load_app()
+        for size in [int(value) for value in options.app_sizes.split(",")]:
+            print(f"🏠 app.py, {size} utilisateurs...")
+            results.setdefault(str(size), {})["app"] = app_footprint(app, size)
+            print(f"   app: {results[str(size)]['app']}")
+
+    write_results(options.out, "userids", results)
+
+if __name__ == "__main__":
+    main()
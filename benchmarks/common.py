@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Outils partagés par les benchmarks NakamaBot
+
+Chaque benchmark est un script autonome (python benchmarks/bench_xxx.py)
+qui importe app.py depuis la racine du dépôt et écrit ses résultats
+en JSON pour pouvoir comparer deux versions.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import platform
+import urllib.error
+import urllib.request
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+def load_app():
+    """Importer app.py sans clés API (aucun appel réseau réel)"""
+    os.environ.setdefault("MISTRAL_API_KEY", "")
+    os.environ.setdefault("PAGE_ACCESS_TOKEN", "")
+    import app
+    return app
+
+def load_command(app, name):
+    """Charger commandes/<name>.py avec les globales injectées depuis app.py"""
+    path = os.path.join(ROOT_DIR, "commandes", f"{name}.py")
+    namespace = {name: value for name, value in vars(app).items() if not name.startswith("__")}
+    namespace["__name__"] = f"commandes.{name}"
+    with open(path, encoding="utf-8") as f:
+        exec(compile(f.read(), path, "exec"), namespace)
+    return namespace
+
+def measure(func, repeat=5, number=1000):
+    """Meilleur temps moyen par appel (en microsecondes) sur plusieurs séries"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best * 1e6
+
+def percentile(values, p):
+    """Percentile p (0-100) par rang le plus proche"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+def write_results(path, name, results):
+    """Écrire les résultats au format JSON (un fichier par benchmark)"""
+    payload = {
+        "benchmark": name,
+        "python": platform.python_version(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+    print(f"💾 Résultats écrits dans {path}")
+
+def free_port():
+    """Port TCP libre sur la machine locale"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def http_json(url, payload=None, timeout=2.0):
+    """GET (ou POST JSON) sans dépendance externe; retourne (statut, corps)"""
+    data = json.dumps(payload).encode("utf-8") if payload is not None else None
+    req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            return response.status, json.loads(response.read() or b"null")
+    except urllib.error.HTTPError as e:
+        body = e.read()
+        try:
+            return e.code, json.loads(body or b"null")
+        except ValueError:
+            return e.code, None
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Rejeu d'un trafic webhook capturé contre des doublures locales
+
+1. Capturer en production: CAPTURE_FILE=traffic.jsonl python app.py
+   (payloads anonymisés, un par ligne: {"ts": ..., "payload": {...}})
+2. Rejouer: python benchmarks/replay.py traffic.jsonl --speed 10
+
+Mistral, Graph et Pollinations sont remplacés par benchmarks/standins.py
+(latence et erreurs injectables). La latence de bout en bout va de l'envoi
+du webhook jusqu'à la réception de la réponse par la doublure Graph.
+"""
+
+import argparse
+import json
+import os
+import time
+from collections import defaultdict, deque
+
+from common import load_app, percentile, write_results
+from standins import StandIns, UpstreamProfile
+
+def load_capture(path):
+    """Lire un fichier de capture JSONL (lignes vides ou invalides ignorées)"""
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if "payload" in record:
+                records.append(record)
+    return records
+
+def message_senders(payload):
+    """Expéditeurs des messages d'un payload (une réponse attendue par message)"""
+    senders = []
+    for entry in payload.get("entry", []):
+        for event in entry.get("messaging", []):
+            message = event.get("message")
+            if message and not message.get("is_echo") and event.get("sender", {}).get("id"):
+                senders.append(str(event["sender"]["id"]))
+    return senders
+
+def with_loop_suffix(payload, loop):
+    """Rendre les mid uniques à chaque tour pour ne pas être dédupliqués"""
+    if loop == 0:
+        return payload
+    payload = json.loads(json.dumps(payload))
+    for entry in payload.get("entry", []):
+        for event in entry.get("messaging", []):
+            if event.get("message", {}).get("mid"):
+                event["message"]["mid"] += f".{loop}"
+    return payload
+
+def wait_until_idle(app, timeout):
+    """Attendre que toutes les files soient vides"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if all(lane.queued == 0 and lane.active == 0 for lane in app.LANES.values()):
+            return True
+        time.sleep(0.05)
+    return False
+
+def main():
+    parser = argparse.ArgumentParser(description="Rejouer un trafic webhook capturé")
+    parser.add_argument("capture", help="Fichier JSONL produit avec CAPTURE_FILE")
+    parser.add_argument("--speed", type=float, default=1.0, help="Accélération (1 = rythme d'origine, 0 = sans pause)")
+    parser.add_argument("--loops", type=int, default=1, help="Nombre de passages sur la capture")
+    parser.add_argument("--mistral-latency", type=float, default=1.0)
+    parser.add_argument("--graph-latency", type=float, default=0.1)
+    parser.add_argument("--pollinations-latency", type=float, default=2.0)
+    parser.add_argument("--jitter", type=float, default=0.2, help="Variation aléatoire ajoutée à chaque latence")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Part des appels Mistral en erreur")
+    parser.add_argument("--graph-error-rate", type=float, default=0.0)
+    parser.add_argument("--drain-timeout", type=float, default=120.0)
+    parser.add_argument("--out", default="bench_replay.json")
+    options = parser.parse_args()
+
+    standins = StandIns(
+        mistral=UpstreamProfile(options.mistral_latency, options.jitter, options.error_rate),
+        graph=UpstreamProfile(options.graph_latency, options.jitter, options.graph_error_rate),
+        pollinations=UpstreamProfile(options.pollinations_latency, options.jitter)
+    ).start()
+
+    # La configuration est lue à l'import: tout pointer vers les doublures avant
+    os.environ.update({
+        "MISTRAL_API_KEY": "replay",
+        "PAGE_ACCESS_TOKEN": "replay",
+        "MISTRAL_API_URL": standins.url,
+        "GRAPH_API_URL": standins.url,
+        "POLLINATIONS_URL": standins.url,
+        "CAPTURE_FILE": "",
+        # Capture rejouée en accéléré: ne pas limiter les expéditeurs
+        "RATE_LIMITS": ""
+    })
+    app = load_app()
+    client = app.app.test_client()
+
+    records = load_capture(options.capture)
+    if not records:
+        print("❌ Capture vide")
+        return
+    first_ts = records[0]["ts"]
+    span = records[-1]["ts"] - first_ts
+
+    posted_at = defaultdict(deque)
+    ack_latencies = []
+    statuses = defaultdict(int)
+    expected = 0
+
+    print(f"▶️ Rejeu de {len(records)} payloads x{options.loops} (vitesse x{options.speed})")
+    started = time.perf_counter()
+    for loop in range(options.loops):
+        loop_start = time.perf_counter()
+        for record in records:
+            if options.speed > 0:
+                target = loop_start + (record["ts"] - first_ts) / options.speed
+                delay = target - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+
+            payload = with_loop_suffix(record["payload"], loop)
+            sent = time.perf_counter()
+            response = client.post("/webhook", json=payload)
+            ack_latencies.append(time.perf_counter() - sent)
+            statuses[response.status_code] += 1
+
+            for sender in message_senders(payload):
+                posted_at[sender].append(sent)
+                expected += 1
+
+        if options.speed > 0 and loop < options.loops - 1:
+            # Respecter l'écart entre deux passages comme entre deux payloads
+            time.sleep(max(0.0, loop_start + span / options.speed - time.perf_counter()))
+
+    idle = wait_until_idle(app, options.drain_timeout)
+    elapsed = time.perf_counter() - started
+    standins.stop()
+
+    # Associer chaque réponse reçue au plus ancien message en attente du même utilisateur
+    latencies = []
+    with standins.lock:
+        deliveries = sorted(standins.deliveries)
+    for delivered, recipient in deliveries:
+        if posted_at[recipient]:
+            latencies.append(delivered - posted_at[recipient].popleft())
+
+    results = {
+        "payloads": len(records) * options.loops,
+        "messages": expected,
+        "replies": len(latencies),
+        "drained": idle,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_replies_per_s": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "webhook_status": dict(statuses),
+        "ack_ms": {f"p{p}": round(percentile(ack_latencies, p) * 1000, 2) for p in (50, 90, 99)},
+        "end_to_end_ms": {f"p{p}": round(percentile(latencies, p) * 1000, 1) for p in (50, 90, 99)} if latencies else {},
+        "upstream_requests": standins.requests,
+        "lanes": app.lane_stats(),
+        "config": {k: v for k, v in vars(options).items() if k not in ("capture", "out")}
+    }
+    print(f"📨 {expected} messages, {len(latencies)} réponses en {elapsed:.1f} s")
+    print(f"⚡ Débit: {results['throughput_replies_per_s']} réponses/s")
+    print(f"⏱️ Bout en bout: {results['end_to_end_ms']}")
+    write_results(options.out, "replay", results)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+Doublures locales des services externes pour les tests de charge
+
+Un seul serveur HTTP local imite les trois services utilisés par le bot:
+- api.mistral.ai      POST /v1/chat/completions, POST /v1/embeddings, GET /v1/models
+- graph.facebook.com  POST /v18.0/me/messages, POST / (batch), GET /v18.0/me
+- Pollinations        GET /prompt/...
+
+Latence et taux d'erreur sont configurables par service. Chaque message
+reçu par la doublure Graph est horodaté pour mesurer la latence de bout en bout.
+"""
+
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# PNG transparent 1x1
+TINY_PNG = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6300010000050001"
+    "0d0a2db40000000049454e44ae426082"
+)
+
+class UpstreamProfile:
+    """Latence (secondes) et taux d'erreur (0-1) d'un service simulé"""
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, error_status=500):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+
+    def wait(self):
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def failed(self):
+        return random.random() < self.error_rate
+
+class StandInServer(ThreadingHTTPServer):
+    """Serveur HTTP à file d'acceptation profonde (rafales de milliers de connexions)"""
+    daemon_threads = True
+    request_queue_size = 4096
+
+    def handle_error(self, request, client_address):
+        # Client parti avant la réponse (processus du bot arrêté): rien à signaler
+        pass
+
+class StandIns:
+    """Serveur des doublures (démarré dans un thread)"""
+
+    def __init__(self, mistral=None, graph=None, pollinations=None, port=0):
+        self.profiles = {
+            "mistral": mistral or UpstreamProfile(),
+            "graph": graph or UpstreamProfile(),
+            "pollinations": pollinations or UpstreamProfile()
+        }
+        self.deliveries = []  # (horodatage, destinataire)
+        self.requests = {"mistral": 0, "graph": 0, "pollinations": 0}
+        self.lock = threading.Lock()
+        self.server = StandInServer(("127.0.0.1", port), self._handler())
+        self.thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+    def _count(self, service):
+        with self.lock:
+            self.requests[service] += 1
+
+    def _handler(self):
+        standins = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, body, content_type="application/json"):
+                payload = body if isinstance(body, bytes) else json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _body(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                if self.headers.get("Content-Type", "").startswith("application/x-www-form-urlencoded"):
+                    return {key: values[0] for key, values in urllib.parse.parse_qs(raw.decode("utf-8")).items()}
+                try:
+                    return json.loads(raw or b"{}")
+                except ValueError:
+                    return {}
+
+            def _serve(self, service, respond):
+                standins._count(service)
+                profile = standins.profiles[service]
+                profile.wait()
+                if profile.failed():
+                    return self._reply(profile.error_status, {"error": "injected"})
+                return respond()
+
+            def do_GET(self):
+                if self.path.startswith("/v1/models"):
+                    return self._serve("mistral", lambda: self._reply(200, {"data": [{"id": "mistral-small-latest"}]}))
+                if self.path.startswith("/v18.0/me"):
+                    return self._serve("graph", lambda: self._reply(200, {"id": "0", "name": "NakamaBot"}))
+                if self.path.startswith("/prompt/"):
+                    return self._serve("pollinations", lambda: self._reply(200, TINY_PNG, "image/png"))
+                self._reply(404, {"error": "not found"})
+
+            def do_HEAD(self):
+                self.send_response(200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def do_POST(self):
+                body = self._body()
+                if self.path.startswith("/v1/chat/completions"):
+                    return self._serve("mistral", lambda: self._reply(200, self._completion(body)))
+                if self.path.startswith("/v1/embeddings"):
+                    return self._serve("mistral", lambda: self._reply(200, self._embeddings(body)))
+                if self.path.startswith("/v18.0/me/messages"):
+                    def deliver():
+                        with standins.lock:
+                            standins.deliveries.append((time.perf_counter(), str(body.get("recipient", {}).get("id"))))
+                        return self._reply(200, {"recipient_id": body.get("recipient", {}).get("id"), "message_id": "m_replay"})
+                    return self._serve("graph", deliver)
+                if self.path == "/" and "batch" in body:
+                    return self._serve("graph", lambda: self._reply(200, self._batch(json.loads(body["batch"]))))
+                self._reply(404, {"error": "not found"})
+
+            @staticmethod
+            def _batch(items):
+                """Un résultat par élément; chaque élément peut échouer selon le profil Graph"""
+                profile = standins.profiles["graph"]
+                results = []
+                for item in items:
+                    fields = urllib.parse.parse_qs(item.get("body", ""))
+                    recipient = str(json.loads(fields.get("recipient", ["{}"])[0]).get("id"))
+                    if profile.failed():
+                        results.append({"code": profile.error_status, "body": json.dumps({"error": {"message": "injected"}})})
+                        continue
+                    with standins.lock:
+                        standins.deliveries.append((time.perf_counter(), recipient))
+                    results.append({"code": 200, "body": json.dumps({"recipient_id": recipient, "message_id": "m_batch"})})
+                return results
+
+            @staticmethod
+            def _embeddings(body):
+                """Sac de mots haché sur 64 dimensions: les paraphrases qui partagent des mots se ressemblent"""
+                data = []
+                for index, text in enumerate(body.get("input", [])):
+                    vector = [0.0] * 64
+                    for word in re.findall(r"\w+", text.lower()):
+                        vector[hashlib.blake2b(word.encode("utf-8"), digest_size=2).digest()[0] % 64] += 1.0
+                    data.append({"object": "embedding", "index": index, "embedding": vector})
+                tokens = sum(len(text.split()) for text in body.get("input", []))
+                return {"model": body.get("model"), "data": data, "usage": {"prompt_tokens": tokens, "total_tokens": tokens}}
+
+            @staticmethod
+            def _completion(body):
+                max_tokens = body.get("max_tokens", 200)
+                completion_tokens = min(max_tokens, random.randint(20, 120))
+                prompt_tokens = sum(len(str(m.get("content", ""))) // 4 for m in body.get("messages", []))
+                return {
+                    "model": body.get("model"),
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": "Coucou ! Réponse simulée ✨ " * 3},
+                        "finish_reason": "length" if completion_tokens == max_tokens else "stop"
+                    }],
+                    "usage": {
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": completion_tokens,
+                        "total_tokens": prompt_tokens + completion_tokens
+                    }
+                }
+
+        return Handler
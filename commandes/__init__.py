@@ -19,18 +19,34 @@ def execute(sender_id, args):
 ```
 
 Variables globales disponibles dans chaque commande:
-- user_memory: Mémoire des conversations
-- user_list: Liste des utilisateurs
-- game_sessions: Sessions de jeu actives
+- user_memory: Mémoire des conversations (StripedUserIdMap: s'utilise comme un defaultdict)
+- user_list: Liste des utilisateurs (StripedUserIdSet: s'utilise comme un set de str)
+  Ces conteneurs sont partagés entre threads: parcourir .snapshot(), et grouper
+  lecture + écriture d'un même utilisateur sous `with user_memory.lock_for(user_id):`
+- user_directory: Index des utilisateurs (pages par activité, recherche par préfixe)
+- memory_stats: Compteurs de mémoire tenus à jour (messages, actifs, top 5)
+- game_sessions: Sessions de jeu actives (StripedUserIdMap, comme user_memory)
 - ADMIN_IDS: IDs des administrateurs
-- call_mistral_api: Fonction pour appeler l'IA
+- call_mistral_api: Fonction pour appeler l'IA (lève TokenBudgetExceeded si le budget de tokens
+  est épuisé: répondre alors BUDGET_TEXT)
+- health_prober: Derniers résultats des sondes Mistral / Facebook / Pollinations
 - add_to_memory: Ajouter à la mémoire
 - get_memory_context: Récupérer le contexte
 - is_admin: Vérifier si admin
+- cached_response: Servir une réponse précalculée (rendue à nouveau si sa clé change)
+- shed_total: Nombre de messages servis en mode dégradé (surcharge)
+- mistral_limiter: Limiteur adaptatif des appels Mistral (.stats(): limite, en cours, attente)
+- token_ledger: Tokens Mistral par commande / utilisateur / fenêtre (top_users(), snapshot())
+- format_token_report: Résumé de consommation prêt à envoyer
+- format_completion_report: Longueurs de réponse, troncatures et max_tokens adaptatif
+- faq_cache / format_faq_report: Cache sémantique des questions fréquentes (lookup(), stats(), revue)
+- classify_intent: Router un message libre ('creator', 'image', 'search', 'chat')
+  (classify_intent(texte, AI_INTENTS): mots-clés du créateur propres à /ai)
 - broadcast_message: Diffuser un message
 - send_message: Envoyer un message
 - send_image_message: Envoyer une image
 - logger: Logger pour debug
+- POLLINATIONS_URL: URL de base du générateur d'images
 - datetime, random, requests, time, os, json: Modules utiles
 """
 
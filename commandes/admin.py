@@ -1,34 +1,46 @@
-def execute(sender_id, args=""):
-    """Panneau administrateur"""
-    if not is_admin(sender_id):
-        return f"🔐 Accès refusé! Admins seulement! ❌\nVotre ID: {sender_id}"
-    
-    if not args.strip():
-        return f"""🔐 PANNEAU ADMIN v3.0
+def render_panel(sender_id, users, conversations, games):
+    """Texte du panneau admin (recalculé seulement quand les compteurs changent)"""
+    return f"""🔐 PANNEAU ADMIN v3.0
 
 📊 COMMANDES DISPONIBLES:
 • /admin stats - Statistiques détaillées
-• /admin users - Liste des utilisateurs  
+• /admin users [page N | find ID] - Utilisateurs  
 • /admin games - Statistiques des jeux
 • /admin memory - État de la mémoire
 • /admin test - Test des services
+• /admin tokens - Consommation Mistral
+• /admin longueurs - max_tokens adaptatif
+• /admin faq [revue | oubli N] - Cache sémantique
 • /broadcast [msg] - Diffusion générale
 
 📈 ÉTAT ACTUEL:
-👥 Utilisateurs: {len(user_list)}
-💾 Conversations: {len(user_memory)}
-🎲 Jeux actifs: {len(game_sessions)}
+👥 Utilisateurs: {users}
+💾 Conversations: {conversations}
+🎲 Jeux actifs: {games}
 🔐 Admin ID: {sender_id}
 
 ✅ Système opérationnel
 👨‍💻 Créé par Durand"""
+
+def execute(sender_id, args=""):
+    """Panneau administrateur"""
+    if not is_admin(sender_id):
+        return f"🔐 Accès refusé! Admins seulement! ❌\nVotre ID: {sender_id}"
+    
+    if not args.strip():
+        return cached_response("admin_panel_v3", render_panel, sender_id,
+                               len(user_list), len(user_memory), len(game_sessions))
     
     action = args.strip().lower()
     
+    if action.startswith("faq"):
+        return format_faq_report(action[3:])
+    
     if action == "stats":
-        # Calculer des statistiques détaillées
-        total_messages = sum(len(messages) for messages in user_memory.values())
-        active_users = len([uid for uid in user_list if uid in user_memory])
+        # Compteurs tenus à jour par add_to_memory (aucun parcours des utilisateurs)
+        total_messages = memory_stats.messages
+        active_users = memory_stats.active_users
+        limits = mistral_limiter.stats()
         
         return f"""📊 STATISTIQUES COMPLÈTES
 
@@ -46,23 +58,40 @@ def execute(sender_id, args=""):
 • Sessions actives: {len(game_sessions)}
 • Participation: {(len(game_sessions)/len(user_list)*100):.1f}%
 
+⏳ CHARGE:
+• Réponses dégradées: {shed_total()}
+• Limite Mistral: {limits['limit']} appels ({limits['inflight']} en cours, {limits['waiting']} en attente)
+
 🔐 SYSTÈME:
 • Admin ID: {sender_id}
 • Version: 3.0
 • Créateur: Durand"""
     
-    elif action == "users":
+    elif action == "users" or action.startswith("users "):
         if not user_list:
             return "👥 Aucun utilisateur enregistré!"
         
-        text = f"👥 LISTE DES UTILISATEURS ({len(user_list)}):\n\n"
-        for i, user_id in enumerate(list(user_list)[:20], 1):  # Limiter à 20 pour éviter les messages trop longs
+        option = action[len("users"):].strip()
+        if option.startswith("find "):
+            prefix = option[len("find "):].strip()
+            rows = user_directory.find(prefix)
+            text = f"🔎 UTILISATEURS COMMENÇANT PAR {prefix} ({len(rows)}):\n\n"
+        else:
+            page = option[len("page "):].strip() if option.startswith("page ") else "1"
+            page = int(page) if page.isdigit() else 1
+            rows = user_directory.page(page)
+            pages = max(1, -(-len(user_directory) // user_directory.PAGE_SIZE))
+            text = f"👥 UTILISATEURS ({len(user_list)}) - page {page}/{pages}, plus récents d'abord:\n\n"
+        
+        from datetime import datetime
+        for user_id, last_seen in rows:
             status = "🎲" if user_id in game_sessions else ("💬" if user_id in user_memory else "👤")
-            text += f"{status} {i}. {user_id}\n"
+            seen = datetime.fromtimestamp(last_seen).strftime('%d/%m %H:%M') if last_seen else "?"
+            text += f"{status} {user_id} - {seen}\n"
         
-        if len(user_list) > 20:
-            text += f"\n... et {len(user_list) - 20} autres utilisateurs"
-            
+        if not rows:
+            text += "Aucun résultat.\n"
+        text += "\n💡 /admin users page N - /admin users find <début d'ID>"
         return text
     
     elif action == "games":
@@ -70,7 +99,7 @@ def execute(sender_id, args=""):
             return "🎲 Aucun jeu actif actuellement!"
         
         text = f"🎲 JEUX ACTIFS ({len(game_sessions)}):\n\n"
-        for user_id, session in list(game_sessions.items()):
+        for user_id, session in game_sessions.snapshot():  # Instantané: les parties continuent pendant le parcours
             score = session.get('score', 0)
             started = session.get('started', 'Inconnu')
             text += f"👤 {user_id}: {score} points\n"
@@ -88,7 +117,7 @@ def execute(sender_id, args=""):
         if not user_memory:
             return "💾 Aucune conversation en mémoire!"
         
-        total_messages = sum(len(messages) for messages in user_memory.values())
+        total_messages = memory_stats.messages
         avg_messages = total_messages / len(user_memory) if user_memory else 0
         
         text = f"💾 ÉTAT DE LA MÉMOIRE:\n\n"
@@ -97,31 +126,39 @@ def execute(sender_id, args=""):
         text += f"📈 Moyenne/session: {avg_messages:.1f}\n"
         text += f"💽 Capacité/session: 10 messages max\n\n"
         
-        # Top 5 des utilisateurs les plus actifs
-        top_users = sorted(user_memory.items(), key=lambda x: len(x[1]), reverse=True)[:5]
-        text += "🏆 TOP 5 ACTIFS:\n"
-        for i, (user_id, messages) in enumerate(top_users, 1):
-            text += f"{i}. {user_id}: {len(messages)} msgs\n"
+        # Top 5 des utilisateurs les plus actifs: messages cumulés depuis le dernier clear-memory
+        # (pas seulement ceux encore en mémoire, qui plafonnent à la taille de la session)
+        text += "🏆 TOP 5 ACTIFS (messages cumulés):\n"
+        for i, (user_id, count) in enumerate(memory_stats.top_users(), 1):
+            text += f"{i}. {user_id}: {count} msgs cumulés\n"
         
         return text
     
+    elif action == "tokens":
+        return format_token_report()
+    
+    elif action == "longueurs":
+        return format_completion_report()
+    
     elif action == "test":
         results = []
         
-        # Test IA Mistral
-        try:
-            test_response = call_mistral_api([{"role": "user", "content": "Test"}], max_tokens=10)
-            results.append(f"🧠 IA Mistral: {'✅' if test_response else '❌'}")
-        except Exception as e:
-            results.append(f"🧠 IA Mistral: ❌ ({str(e)[:30]})")
-        
-        # Test Facebook API
-        results.append(f"📱 Facebook API: {'✅' if 'PAGE_ACCESS_TOKEN' in globals() and globals()['PAGE_ACCESS_TOKEN'] else '❌'}")
+        # Résultats des sondes d'arrière-plan (aucun appel IA ici)
+        labels = {"mistral": "🧠 IA Mistral", "facebook": "📱 Facebook API", "pollinations": "🎨 Pollinations"}
+        probes = health_prober.snapshot()
+        for name, label in labels.items():
+            probe = probes.get(name)
+            if not probe:
+                results.append(f"{label}: ⏳ pas encore sondé")
+            elif probe["ok"]:
+                results.append(f"{label}: ✅ {probe['latency_ms']:.0f} ms ({probe['checked_at'][11:19]})")
+            else:
+                results.append(f"{label}: ❌ {probe.get('error') or probe.get('status')} ({probe['checked_at'][11:19]})")
         
         # Test structure des données
         results.append(f"💾 Mémoire utilisateurs: {'✅' if user_memory else '❌'}")
         results.append(f"👥 Liste utilisateurs: {'✅' if user_list else '❌'}")
-        results.append(f"🎲 Sessions de jeu: {'✅' if isinstance(game_sessions, dict) else '❌'}")
+        results.append(f"🎲 Sessions de jeu: {'✅' if hasattr(game_sessions, 'items') else '❌'}")
         
         return "🔍 TESTS SYSTÈME:\n\n" + "\n".join(results)
     
@@ -139,11 +176,14 @@ Pour effacer les données, utilisez:
     elif action == "clear-memory":
         count = len(user_memory)
         user_memory.clear()
+        memory_stats.reset_memory()
         return f"🗑️ Mémoire effacée! {count} conversations supprimées."
     
     elif action == "clear-users":
         count = len(user_list)
         user_list.clear()
+        user_directory.clear()
+        memory_stats.reset_users()
         return f"🗑️ Liste utilisateurs effacée! {count} utilisateurs supprimés."
     
     elif action == "clear-games":
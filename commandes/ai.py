@@ -12,8 +12,7 @@ def execute(sender_id, args=""):
         return f"💭 {random.choice(topics)} ✨"
     
     # Vérifier si on demande le créateur
-    creator_keywords = ['créateur', 'createur', 'qui t\'a', 'qui t\'a créé', 'maker', 'developer', 'qui t\'a fait']
-    if any(word in args.lower() for word in creator_keywords):
+    if classify_intent(args, AI_INTENTS) == "creator":
         return "🎌 Mon créateur est Durand! C'est lui qui m'a donné vie pour être votre compagnon IA! ✨👨‍💻 Il est génial, non? 💖"
     
     # Obtenir le contexte de conversation
@@ -36,7 +35,10 @@ def execute(sender_id, args=""):
     messages.append({"role": "user", "content": args})
     
     # Appeler l'API Mistral
-    response = call_mistral_api(messages, max_tokens=200, temperature=0.8)
+    try:
+        response = call_mistral_api(messages, max_tokens=200, temperature=0.8)
+    except TokenBudgetExceeded:
+        return BUDGET_TEXT
     
     if response:
         # Ajouter à la mémoire
@@ -1,12 +1,20 @@
 import os
 import glob
 
-def execute(sender_id, args=""):
-    """Aide du bot - Liste automatiquement toutes les commandes disponibles"""
+COMMANDS_DIR = "Commandes"
+
+def commands_version():
+    """Version du dossier des commandes (change quand un fichier est ajouté ou retiré)"""
+    try:
+        return os.stat(COMMANDS_DIR).st_mtime_ns
+    except OSError:
+        return 0
+
+def render_help(version, admin):
+    """Construire l'aide - appelé seulement quand le dossier des commandes change"""
     
     # Découvrir automatiquement toutes les commandes
-    commands_dir = "Commandes"
-    command_files = glob.glob(f"{commands_dir}/*.py")
+    command_files = glob.glob(f"{COMMANDS_DIR}/*.py")
     
     # Descriptions personnalisées pour certaines commandes
     command_descriptions = {
@@ -50,7 +58,7 @@ def execute(sender_id, args=""):
             text += f"/{cmd} - {desc}\n"
     
     # Section admin si applicable
-    if is_admin(sender_id):
+    if admin:
         admin_commands = ["admin", "broadcast"]
         admin_available = [cmd for cmd in admin_commands if cmd in sorted_commands]
         if admin_available:
@@ -64,3 +72,8 @@ def execute(sender_id, args=""):
     text += "\n✨ Ton compagnon otaku! 💖"
     
     return text
+
+def execute(sender_id, args=""):
+    """Aide du bot - Liste automatiquement toutes les commandes disponibles"""
+    admin = is_admin(sender_id)
+    return cached_response("help_v3_admin" if admin else "help_v3", render_help, commands_version(), admin)
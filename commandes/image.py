@@ -1,5 +1,29 @@
 import urllib.parse
 
+# Textes fixes rendus une seule fois au chargement
+USAGE_TEXT = """🎨🎌 GÉNÉRATEUR D'IMAGES IA! 🎌🎨
+
+🖼️ /image [description] - Génère ton image
+🎨 /image beautiful sunset mountain - Exemple
+🌸 /image cute cat wearing hat - Exemple
+⚡ /image random - Surprise aléatoire
+🎭 /image styles - Voir les styles
+
+✨ Décris ton imagination, je la créé! 💖"""
+
+STYLES_TEXT = """🎨 STYLES DISPONIBLES:
+
+🌸 anime - Style anime classique
+⚡ realistic - Photo-réaliste
+🔥 cyberpunk - Futuriste néon
+🌙 fantasy - Monde magique
+🎭 artistic - Style artistique
+🤖 sci-fi - Science-fiction
+🌈 colorful - Explosion de couleurs
+🖼️ portrait - Portrait détaillé
+
+💡 Combine les styles: "anime cyberpunk girl" ✨"""
+
 def validate_image_prompt(prompt):
     """Valider et nettoyer les prompts d'images"""
     if not prompt or len(prompt.strip()) < 3:
@@ -19,33 +43,14 @@ def validate_image_prompt(prompt):
 def execute(sender_id, args=""):
     """Générateur d'images IA - Version finale optimisée"""
     if not args.strip():
-        return """🎨🎌 GÉNÉRATEUR D'IMAGES IA! 🎌🎨
-
-🖼️ /image [description] - Génère ton image
-🎨 /image beautiful sunset mountain - Exemple
-🌸 /image cute cat wearing hat - Exemple
-⚡ /image random - Surprise aléatoire
-🎭 /image styles - Voir les styles
-
-✨ Décris ton imagination, je la créé! 💖"""
+        return USAGE_TEXT
     
     prompt = args.strip().lower()
     sender_id = str(sender_id)
     
     # Commandes spéciales
     if prompt == "styles":
-        return """🎨 STYLES DISPONIBLES:
-
-🌸 anime - Style anime classique
-⚡ realistic - Photo-réaliste
-🔥 cyberpunk - Futuriste néon
-🌙 fantasy - Monde magique
-🎭 artistic - Style artistique
-🤖 sci-fi - Science-fiction
-🌈 colorful - Explosion de couleurs
-🖼️ portrait - Portrait détaillé
-
-💡 Combine les styles: "anime cyberpunk girl" ✨"""
+        return STYLES_TEXT
     
     if prompt == "random":
         themes = [
@@ -74,7 +79,7 @@ def execute(sender_id, args=""):
         
         # Générer l'image avec API gratuite Pollinations
         seed = random.randint(100000, 999999)
-        image_url = f"https://image.pollinations.ai/prompt/{encoded_prompt}?width=768&height=768&seed={seed}&enhance=true&model=flux&nologo=true"
+        image_url = f"{POLLINATIONS_URL}/prompt/{encoded_prompt}?width=768&height=768&seed={seed}&enhance=true&model=flux&nologo=true"
         
         # Sauvegarder dans la mémoire
         add_to_memory(sender_id, 'user', f"Image demandée: {validated_prompt}")
@@ -11,7 +11,10 @@ def execute(sender_id, args=""):
     }]
     
     # Essayer d'obtenir une présentation personnalisée via l'IA
-    response = call_mistral_api(messages, max_tokens=150, temperature=0.9)
+    try:
+        response = call_mistral_api(messages, max_tokens=150, temperature=0.9)
+    except TokenBudgetExceeded:
+        response = None  # Budget épuisé: la présentation par défaut suffit
     
     # Si l'IA répond, utiliser sa réponse, sinon utiliser une présentation par défaut
     if response:
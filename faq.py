@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+"""
+Cache sémantique des questions fréquentes (FAQ) pour NakamaBot
+
+Les messages de chat sont plongés en vecteurs (embeddings, regroupés en lots
+par EmbeddingBatcher) et comparés aux questions en cache par similarité
+cosinus (VectorIndex, NumPy si installé). Une question n'entre en cache que
+posée par plusieurs utilisateurs distincts, avec une réponse générée sans
+mémoire de conversation. La fonction d'embedding est fournie par l'appelant
+(app.embed_texts en production).
+"""
+
+import heapq
+import logging
+import os
+import queue
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from tracing import trace_span
+
+logger = logging.getLogger(__name__)
+
+FAQ_MODE = os.getenv("FAQ_MODE", "shadow")  # on: servir les réponses en cache, shadow: mesurer sans servir, off
+FAQ_THRESHOLD = float(os.getenv("FAQ_THRESHOLD", "0.92"))  # Similarité cosinus minimale
+FAQ_CAPACITY = int(os.getenv("FAQ_CAPACITY", "2000"))  # Questions apprises gardées (anneau)
+FAQ_CANDIDATES = int(os.getenv("FAQ_CANDIDATES", "2000"))  # Questions ratées récentes, en attente de répétition
+FAQ_PROMOTE = int(os.getenv("FAQ_PROMOTE", "3"))  # Utilisateurs distincts à poser la question avant sa mise en cache
+FAQ_LOOKUP_BUDGET = float(os.getenv("FAQ_LOOKUP_BUDGET", "0.3"))  # Attente max de l'embedding (mode on), puis l'IA répond
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "32"))
+EMBED_BATCH_WAIT = float(os.getenv("EMBED_BATCH_WAIT", "0.02"))  # Attente max pour grouper des messages
+
+_numpy_module = None
+
+def _numpy():
+    """NumPy si installé (import différé: pas de coût au démarrage), sinon None"""
+    global _numpy_module
+    if _numpy_module is None:
+        try:
+            import numpy
+            _numpy_module = numpy
+        except ImportError:
+            _numpy_module = False
+    return _numpy_module or None
+
+def normalize(vector):
+    norm = sum(value * value for value in vector) ** 0.5 or 1.0
+    return [value / norm for value in vector]
+
+class VectorIndex:
+    """Plus proche voisin (cosinus) sur des vecteurs normalisés, en anneau de capacité fixe
+
+    Avec NumPy, une matrice float32 préallouée et un produit matriciel par recherche;
+    sinon des listes et un produit scalaire en Python (quelques milliers de lignes au plus).
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.rows = None
+        self.items = []
+        self.next = 0
+
+    def add(self, vector, item):
+        """Ajouter (écrase la plus ancienne ligne une fois plein); retourne (ligne, élément écrasé ou None)"""
+        numpy = _numpy()
+        if self.rows is None:
+            self.rows = numpy.zeros((self.capacity, len(vector)), dtype=numpy.float32) if numpy else []
+        evicted = None
+        if len(self.items) < self.capacity:
+            row = len(self.items)
+            self.items.append(item)
+            if not numpy:
+                self.rows.append(vector)
+        else:
+            row = self.next
+            self.next = (self.next + 1) % self.capacity
+            evicted, self.items[row] = self.items[row], item
+            if not numpy:
+                self.rows[row] = vector
+        if numpy:
+            self.rows[row] = vector
+        return row, evicted
+
+    def remove(self, row):
+        self.items[row] = None
+        if isinstance(self.rows, list):
+            self.rows[row] = [0.0] * len(self.rows[row])
+        else:
+            self.rows[row] = 0.0
+
+    def nearest(self, vector):
+        """(similarité, ligne) du plus proche voisin, (0.0, None) si l'index est vide"""
+        if not self.items:
+            return 0.0, None
+        if isinstance(self.rows, list):
+            scores = [sum(a * b for a, b in zip(row, vector)) for row in self.rows]
+            row = max(range(len(scores)), key=scores.__getitem__)
+            return scores[row], row
+        numpy = _numpy()
+        scores = self.rows[:len(self.items)] @ numpy.asarray(vector, dtype=numpy.float32)
+        row = int(scores.argmax())
+        return float(scores[row]), row
+
+class EmbeddingBatcher:
+    """Regroupe les messages arrivés dans la même fenêtre en un seul appel d'embeddings"""
+
+    def __init__(self, embed_texts, batch_size, wait):
+        self.embed_texts = embed_texts  # textes -> vecteurs normalisés (None si échec)
+        self.batch_size = batch_size
+        self.wait = wait
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.texts = 0
+
+    def submit(self, text):
+        """Future du vecteur de text (résultat None si l'appel échoue)"""
+        from concurrent.futures import Future
+        future = Future()
+        self.queue.put((text, future))
+        if self.thread is None or not self.thread.is_alive():
+            with self.lock:
+                if self.thread is None or not self.thread.is_alive():
+                    self.thread = threading.Thread(target=self.run, name="embeddings", daemon=True)
+                    self.thread.start()
+        return future
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.wait
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                vectors = self.embed_texts([text for text, _ in batch]) or [None] * len(batch)
+                self.batches += 1
+                self.texts += len(batch)
+            except Exception as e:
+                logger.warning(f"⚠️ Erreur lot d'embeddings: {e}")
+                vectors = [None] * len(batch)
+            for (_, future), vector in zip(batch, vectors):
+                # Annulé par un appelant lassé d'attendre (asyncio.wait_for): plus personne à servir
+                if future.set_running_or_notify_cancel():
+                    future.set_result(vector)
+
+class FaqEntry:
+    """Question en cache et sa réponse (texte, ou fonction pour les questions connues d'avance)"""
+
+    def __init__(self, entry_id, question, answer, source):
+        self.id = entry_id
+        self.question = question
+        self.answer = answer
+        self.source = source
+        self.hits = 0
+
+    def render(self):
+        return self.answer() if callable(self.answer) else self.answer
+
+class FaqLookup:
+    """Résultat d'une recherche: réponse à servir, ou vecteur à apprendre après l'appel à l'IA"""
+    __slots__ = ("question", "vector", "answer", "learn")
+
+    def __init__(self, question, vector=None, answer=None, learn=False):
+        self.question = question
+        self.vector = vector
+        self.answer = answer
+        self.learn = learn
+
+class FaqCache:
+    """Cache sémantique des questions fréquentes
+
+    Une question ratée entre dans les candidates; quand promote utilisateurs distincts en ont
+    posé une paraphrase (similarité >= threshold), la question suivante est envoyée à l'IA sans
+    la mémoire de son auteur et c'est cette réponse-là qui est mise en cache: rien de personnel
+    n'est resservi aux autres, et une même personne qui insiste ne suffit pas.
+
+    Modes:
+    - on: l'embedding est attendu au plus budget secondes (sinon l'IA répond comme sans cache)
+    - shadow: rien n'est attendu ni servi; la correspondance est calculée à l'arrivée de
+      l'embedding, et une question devenue fréquente est retenue sans réponse, pour que le
+      taux de réussite mesuré soit celui qu'aurait le mode on
+    - off: aucun embedding
+    """
+
+    def __init__(self, embed_texts, mode=FAQ_MODE, threshold=FAQ_THRESHOLD, promote=FAQ_PROMOTE,
+                 capacity=FAQ_CAPACITY, candidates=FAQ_CANDIDATES, budget=FAQ_LOOKUP_BUDGET, enabled=True):
+        self.embed_texts = embed_texts
+        self.mode = mode
+        self.threshold = threshold
+        self.promote = promote
+        self.budget = budget
+        self.enabled = enabled  # False sans clé API: aucune recherche
+        self.lock = threading.Lock()
+        self.embedder = EmbeddingBatcher(embed_texts, EMBED_BATCH_SIZE, EMBED_BATCH_WAIT)
+        self.index = VectorIndex(capacity)
+        self.candidates = VectorIndex(candidates)
+        self.entries = {}  # id -> (FaqEntry, ligne dans l'index)
+        self.next_id = 1
+        self.counters = defaultdict(int)  # hit, shadow_hit, miss, skip, late, learned, forgotten
+        self.recent_hits = deque(maxlen=50)  # (horodatage, question posée, id, similarité)
+
+    def _store(self, vector, question, answer, source):
+        """Ajouter une entrée (appelé sous verrou)"""
+        entry = FaqEntry(self.next_id, question, answer, source)
+        self.next_id += 1
+        row, evicted = self.index.add(vector, entry)
+        if evicted is not None:
+            self.entries.pop(evicted.id, None)
+        self.entries[entry.id] = (entry, row)
+        return entry
+
+    def seed(self, seeds):
+        """Embarquer les questions connues d'avance, [(variantes, réponse)] (un seul appel d'embeddings)"""
+        if self.mode == "off" or not self.enabled:
+            return 0
+        questions = [(question, answer) for variants, answer in seeds for question in variants]
+        vectors = self.embed_texts([question for question, _ in questions])
+        if not vectors:
+            return 0
+        with self.lock:
+            for (question, answer), vector in zip(questions, vectors):
+                self._store(vector, question, answer, "seed")
+        return len(questions)
+
+    def match(self, question, vector, sender_id=None):
+        """Chercher la question; sans réponse, dire s'il faudra apprendre celle de l'IA"""
+        with self.lock:
+            if vector is None:
+                self.counters["skip"] += 1
+                return FaqLookup(question)
+            score, row = self.index.nearest(vector)
+            entry = self.index.items[row] if row is not None else None
+            if entry is not None and score >= self.threshold:
+                entry.hits += 1
+                self.recent_hits.append((time.time(), question, entry.id, round(score, 3)))
+                if self.mode == "on" and entry.answer is not None:
+                    self.counters["hit"] += 1
+                    return FaqLookup(question, vector, answer=entry.render())
+                self.counters["shadow_hit"] += 1
+                return FaqLookup(question, vector)
+            self.counters["miss"] += 1
+            # Paraphrase d'une question déjà ratée ?
+            score, row = self.candidates.nearest(vector)
+            if row is not None and self.candidates.items[row] is not None and score >= self.threshold:
+                senders = self.candidates.items[row]  # Auteurs distincts (au plus promote)
+                if len(senders) < self.promote:
+                    senders.add(sender_id)
+                return FaqLookup(question, vector, learn=len(senders) >= self.promote)
+            self.candidates.add(vector, {sender_id})
+            return FaqLookup(question, vector)
+
+    def _observe(self, question, sender_id, future):
+        """Mode shadow: correspondance calculée dans le thread des embeddings, hors du chemin de la réponse"""
+        try:
+            lookup = self.match(question, future.result(), sender_id)
+            if lookup.learn:
+                self._learn(lookup, None, "shadow")
+        except Exception as e:
+            logger.warning(f"⚠️ Erreur FAQ (observation): {e}")
+
+    def _late(self, question):
+        with self.lock:
+            self.counters["late"] += 1
+        return FaqLookup(question)
+
+    def lookup(self, question, sender_id=None):
+        """Réponse en cache (mode on), ou de quoi apprendre celle de l'IA; n'attend jamais plus de budget secondes"""
+        if self.mode == "off" or not self.enabled:
+            return FaqLookup(question)
+        future = self.embedder.submit(question)
+        if self.mode != "on":
+            future.add_done_callback(lambda future: self._observe(question, sender_id, future))
+            return FaqLookup(question)
+        with trace_span("faq"):
+            try:
+                vector = future.result(timeout=self.budget)
+            except FutureTimeout:
+                return self._late(question)
+            return self.match(question, vector, sender_id)
+
+    async def lookup_async(self, question, sender_id=None):
+        """lookup() pour le cœur asynchrone (aio.py)"""
+        import asyncio
+        if self.mode != "on" or not self.enabled:
+            return self.lookup(question, sender_id)
+        with trace_span("faq"):
+            try:
+                # shield: le délai dépassé abandonne l'attente sans annuler le future du lot
+                vector = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(self.embedder.submit(question))),
+                                                self.budget)
+            except asyncio.TimeoutError:
+                return self._late(question)
+            return self.match(question, vector, sender_id)
+
+    def learn(self, lookup, answer):
+        """Mettre en cache la réponse de l'IA à une question devenue fréquente
+
+        answer doit venir de chat_messages(..., memory=False) quand lookup.learn est vrai.
+        """
+        if not (lookup.learn and answer and lookup.vector is not None):
+            return None
+        return self._learn(lookup, answer, "chat")
+
+    def _learn(self, lookup, answer, source):
+        with self.lock:
+            score, row = self.index.nearest(lookup.vector)
+            if row is not None and self.index.items[row] is not None and score >= self.threshold:
+                return None  # Apprise entre-temps par un autre message
+            self.counters["learned"] += 1
+            entry = self._store(lookup.vector, lookup.question, answer, source)
+        logger.info("🧠 FAQ apprise #%d (%s): %.60s", entry.id, source, lookup.question)
+        return entry
+
+    def forget(self, entry_id):
+        """Retirer une entrée (fausse correspondance signalée en revue)"""
+        with self.lock:
+            item = self.entries.pop(entry_id, None)
+            if item is None:
+                return None
+            self.index.remove(item[1])
+            self.counters["forgotten"] += 1
+            return item[0]
+
+    def stats(self):
+        with self.lock:
+            served = self.counters["hit"] + self.counters["shadow_hit"]
+            lookups = served + self.counters["miss"]
+            return {
+                "mode": self.mode,
+                "entries": len(self.entries),
+                "lookups": lookups,
+                "hit_rate": round(served / lookups, 3) if lookups else 0.0,
+                "counters": dict(self.counters),
+                "embedding_batches": self.embedder.batches,
+                "embedded_texts": self.embedder.texts,
+                "numpy": bool(_numpy())
+            }
+
+    def top_entries(self, count=5):
+        with self.lock:
+            return heapq.nlargest(count, (entry for entry, _ in self.entries.values()), key=lambda entry: entry.hits)
+
+    def review(self, count=10):
+        """Dernières réponses servies depuis le cache: (question posée, entrée, similarité), à vérifier"""
+        with self.lock:
+            hits = list(self.recent_hits)[-count:]
+            return [(asked, self.entries.get(entry_id, (None,))[0], entry_id, score) for _, asked, entry_id, score in reversed(hits)]
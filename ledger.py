@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+Comptabilité des tokens Mistral pour NakamaBot
+
+TokenLedger compte les tokens par commande, par utilisateur (jour courant),
+par modèle et sur des fenêtres glissantes (heure, jour), et applique les
+budgets quotidiens: au-delà du budget, modèle économique; au-delà de la
+limite dure, aucun appel (TokenBudgetExceeded côté appelant).
+
+CompletionBudget ajuste le max_tokens de chaque usage (chat, recherche,
+/start...) d'après les longueurs réellement générées et le taux de réponses
+coupées (finish_reason=length).
+"""
+
+import heapq
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import datetime
+
+from userids import UserIdMap
+
+COMPLETION_ADAPTIVE = os.getenv("COMPLETION_ADAPTIVE", "1") == "1"  # 0: garder les max_tokens fixes des appelants
+COMPLETION_HISTORY = int(os.getenv("COMPLETION_HISTORY", "500"))  # Réponses gardées par usage
+COMPLETION_MIN_SAMPLES = int(os.getenv("COMPLETION_MIN_SAMPLES", "50"))  # Avant ça, max_tokens de l'appelant
+COMPLETION_QUANTILE = float(os.getenv("COMPLETION_QUANTILE", "0.98"))
+COMPLETION_HEADROOM = float(os.getenv("COMPLETION_HEADROOM", "1.25"))  # Marge au-dessus du quantile
+COMPLETION_TRUNCATION_TARGET = float(os.getenv("COMPLETION_TRUNCATION_TARGET", "0.02"))  # Au-delà, on desserre
+COMPLETION_FLOOR = 32
+COMPLETION_MAX_FACTOR = 2  # Jamais plus de 2× le max_tokens demandé par l'appelant
+COMPLETION_REFRESH = 20  # Recalcul du plafond toutes les N réponses
+
+# === CONSOMMATION DE TOKENS ===
+
+class TokenBudgetExceeded(Exception):
+    """Budget de tokens épuisé: aucun appel Mistral, la commande répond BUDGET_TEXT elle-même"""
+
+class RollingCounter:
+    """Appels et tokens par tranche de temps, dans un anneau de taille fixe"""
+
+    def __init__(self, bucket_seconds, buckets):
+        self.bucket_seconds = bucket_seconds
+        self.slots = [[-1, 0, 0, 0] for _ in range(buckets)]  # [tranche, appels, prompt, completion]
+
+    def add(self, now, prompt, completion):
+        number = int(now // self.bucket_seconds)
+        slot = self.slots[number % len(self.slots)]
+        if slot[0] != number:
+            slot[:] = [number, 0, 0, 0]
+        slot[1] += 1
+        slot[2] += prompt
+        slot[3] += completion
+
+    def totals(self, now):
+        """(appels, prompt, completion) sur toute la fenêtre"""
+        oldest = int(now // self.bucket_seconds) - len(self.slots) + 1
+        live = [slot for slot in self.slots if slot[0] >= oldest]
+        return tuple(sum(slot[i] for slot in live) for i in (1, 2, 3))
+
+class TokenLedger:
+    """Tokens Mistral par commande, par utilisateur (jour courant), par modèle et par fenêtre de temps"""
+
+    def __init__(self, default_model, cheap_model, user_budget=0, hard_limit=0, command_budgets=None, exempt=()):
+        self.default_model = default_model
+        self.cheap_model = cheap_model
+        self.user_budget = user_budget
+        self.hard_limit = hard_limit
+        self.command_budgets = command_budgets or {}
+        self.exempt = exempt  # Utilisateurs jamais limités (admins)
+        self.lock = threading.Lock()
+        self.day = None
+        self.per_command = defaultdict(lambda: [0, 0, 0])  # Depuis le démarrage: appels, prompt, completion
+        self.per_model = defaultdict(lambda: [0, 0, 0])
+        self.command_today = defaultdict(int)  # Tokens du jour (budgets par commande)
+        self.user_today = UserIdMap(typecode='q')  # Tokens du jour, seulement pour les utilisateurs qui ont appelé l'IA
+        self.minutes = RollingCounter(60, 60)
+        self.hours = RollingCounter(3600, 24)
+        self.downgraded = 0
+        self.refused = 0
+
+    def _roll(self):
+        """Remettre les compteurs du jour à zéro au changement de date (appelé sous verrou)"""
+        today = datetime.now().toordinal()
+        if today != self.day:
+            self.day = today
+            self.user_today.clear()
+            self.command_today.clear()
+
+    def record(self, user_id, command, model, prompt, completion):
+        """user_id None: dépense sans utilisateur (embeddings, tâches rejouées), comptée par commande seulement"""
+        now = time.time()
+        tokens = prompt + completion
+        with self.lock:
+            self._roll()
+            for counters in (self.per_command[command], self.per_model[model]):
+                counters[0] += 1
+                counters[1] += prompt
+                counters[2] += completion
+            self.command_today[command] += tokens
+            if user_id is not None:
+                self.user_today[user_id] = self.user_today.get(user_id, 0) + tokens
+            self.minutes.add(now, prompt, completion)
+            self.hours.add(now, prompt, completion)
+
+    def decide(self, user_id, command):
+        """Modèle autorisé pour cet appel (None: budget épuisé, réponse toute prête)
+
+        user_id None (aucun utilisateur derrière l'appel): seuls les budgets par commande s'appliquent.
+        """
+        if user_id in self.exempt:
+            return self.default_model
+        with self.lock:
+            self._roll()
+            used = self.user_today.get(user_id, 0) if user_id is not None else 0
+            command_used = self.command_today.get(command, 0)
+            if self.hard_limit and used >= self.hard_limit:
+                self.refused += 1
+                return None
+            budget = self.command_budgets.get(command)
+            if (self.user_budget and used >= self.user_budget) or (budget and command_used >= budget):
+                self.downgraded += 1
+                return self.cheap_model
+        return self.default_model
+
+    def top_users(self, count=10):
+        """[(user_id, tokens du jour)] des plus gros consommateurs"""
+        with self.lock:
+            self._roll()
+            return heapq.nlargest(count, self.user_today.items(), key=lambda item: item[1])
+
+    def snapshot(self):
+        now = time.time()
+        with self.lock:
+            self._roll()
+            return {
+                "last_hour": self.minutes.totals(now),
+                "last_day": self.hours.totals(now),
+                "per_command": {command: list(counters) for command, counters in self.per_command.items()},
+                "per_model": {model: list(counters) for model, counters in self.per_model.items()},
+                "users_today": len(self.user_today),
+                "downgraded": self.downgraded,
+                "refused": self.refused
+            }
+
+# === MAX_TOKENS ADAPTATIF ===
+
+class CompletionProfile:
+    """Longueurs de réponse récentes d'un usage (chat, recherche, /start...) et plafond qui en découle"""
+
+    def __init__(self):
+        self.samples = deque(maxlen=COMPLETION_HISTORY)  # (tokens de réponse, tronquée)
+        self.recorded = 0  # Réponses comptées depuis le début (l'historique, lui, plafonne)
+        self.cap = None  # None tant que l'historique est trop court
+        self.capped_at = 0  # max_tokens demandé lors du dernier calcul
+        self.phases = {"fixe": [0, 0, 0, 0.0], "adaptatif": [0, 0, 0, 0.0]}  # appels, tokens, tronquées, secondes
+
+    def truncation_rate(self):
+        return sum(1 for _, truncated in self.samples if truncated) / max(len(self.samples), 1)
+
+    def quantile(self, q):
+        lengths = sorted(tokens for tokens, _ in self.samples)
+        return lengths[min(int(len(lengths) * q), len(lengths) - 1)] if lengths else 0
+
+    def refresh(self, requested):
+        """Plafond = quantile haut × marge; si trop de réponses coupées, on repart du maximum observé"""
+        if len(self.samples) < COMPLETION_MIN_SAMPLES:
+            self.cap = None
+            return
+        if self.truncation_rate() > COMPLETION_TRUNCATION_TARGET:
+            target = max(tokens for tokens, _ in self.samples) * 1.5
+        else:
+            target = self.quantile(COMPLETION_QUANTILE) * COMPLETION_HEADROOM
+        self.cap = int(min(max(target, COMPLETION_FLOOR), requested * COMPLETION_MAX_FACTOR))
+        self.capped_at = requested
+
+class CompletionBudget:
+    """max_tokens par usage, déduit des longueurs réellement générées et du taux de finish_reason=length"""
+
+    def __init__(self, adaptive=COMPLETION_ADAPTIVE):
+        self.adaptive = adaptive
+        self.lock = threading.Lock()
+        self.profiles = defaultdict(CompletionProfile)
+        self.requested = {}  # Dernier max_tokens demandé par usage (pour le rapport)
+
+    def max_tokens(self, purpose, requested):
+        """(max_tokens à envoyer, phase) pour un appel"""
+        with self.lock:
+            self.requested[purpose] = requested
+            profile = self.profiles[purpose]
+            if profile.cap is not None and profile.capped_at != requested:
+                profile.refresh(requested)
+            if not self.adaptive or profile.cap is None:
+                return requested, "fixe"
+            return profile.cap, "adaptatif"
+
+    def record(self, purpose, phase, requested, payload, seconds):
+        """Comptabiliser une réponse: longueur, troncature et durée de génération"""
+        usage = payload.get("usage") or {}
+        tokens = int(usage.get("completion_tokens") or 0)
+        choices = payload.get("choices") or [{}]
+        truncated = choices[0].get("finish_reason") == "length"
+        with self.lock:
+            profile = self.profiles[purpose]
+            profile.samples.append((tokens, truncated))
+            profile.recorded += 1
+            counters = profile.phases[phase]
+            counters[0] += 1
+            counters[1] += tokens
+            counters[2] += truncated
+            counters[3] += seconds
+            if profile.cap is None or profile.recorded % COMPLETION_REFRESH == 0:
+                profile.refresh(requested)
+
+    def stats(self):
+        with self.lock:
+            return {
+                purpose: {
+                    "samples": len(profile.samples),
+                    "requested": self.requested.get(purpose),
+                    "max_tokens": profile.cap if self.adaptive and profile.cap is not None else self.requested.get(purpose),
+                    "p50": profile.quantile(0.5),
+                    "p95": profile.quantile(0.95),
+                    "truncation_rate": round(profile.truncation_rate(), 4),
+                    "phases": {phase: list(counters) for phase, counters in profile.phases.items()}
+                }
+                for purpose, profile in self.profiles.items()
+            }
@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+"""
+Limiteurs de débit pour NakamaBot
+
+AdaptiveLimiter borne les appels simultanés vers une API et ajuste la limite
+en continu (AIMD sur la latence observée): elle monte tant que la latence
+reste proche de la base, baisse quand elle se dégrade ou que l'API signale
+une surcharge (429, 5xx, délai dépassé). Utilisable depuis les threads
+(slot) comme depuis le cœur asynchrone (slot_async).
+
+SenderRateLimiter limite, lui, le débit de chaque utilisateur à l'entrée du
+webhook: un seau à jetons par (utilisateur, classe de commande).
+"""
+
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager, asynccontextmanager
+
+LIMITER_WAIT_SECONDS = float(os.getenv("LIMITER_WAIT_SECONDS", "20"))  # Attente max d'une place
+LIMITER_TOLERANCE = float(os.getenv("LIMITER_TOLERANCE", "2.0"))  # Latence acceptable = base x tolérance
+LIMITER_HISTORY = int(os.getenv("LIMITER_HISTORY", "200"))
+RATE_SWEEP_EVERY = 1000  # Nettoyage des seaux inactifs toutes les N admissions
+
+class LimiterTimeout(Exception):
+    """Aucune place libérée à temps par le limiteur"""
+
+class _LimiterWaiter:
+    """Appel en attente d'une place (thread ou coroutine)"""
+
+    def __init__(self, loop=None, future=None):
+        self.granted = False
+        self.event = threading.Event() if loop is None else None
+        self.loop = loop
+        self.future = future
+
+    def wake(self):
+        if self.event is not None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(lambda: self.future.done() or self.future.set_result(True))
+
+class _LimiterSlot:
+    """Place obtenue; overloaded=True si l'appel a révélé une surcharge (429, 5xx, délai)"""
+
+    def __init__(self):
+        self.overloaded = False
+        self.started = time.monotonic()
+
+class AdaptiveLimiter:
+    """Limite d'appels simultanés ajustée en continu (AIMD sur la latence observée)
+
+    - latence proche de la base (minimum récent) et limite utilisée: +1 par fenêtre de limite
+    - latence > base x LIMITER_TOLERANCE: limite x 0.9
+    - 429, 5xx, délai dépassé ou connexion impossible: limite x 0.5
+      (les autres erreurs, payload invalide ou bug local, libèrent la place sans rien changer)
+    Une baisse au plus par intervalle d'une latence de base, pour ne pas s'effondrer sur une rafale.
+    """
+
+    def __init__(self, name, initial, min_limit, max_limit):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(initial)
+        self.inflight = 0
+        self.waiters = deque()
+        self.samples = deque(maxlen=100)  # Latences récentes des appels réussis
+        self.history = deque(maxlen=LIMITER_HISTORY)  # (horodatage, limite, raison)
+        self.lock = threading.Lock()
+        self.last_decrease = 0.0
+        self.rejected = 0
+        self.overloads = 0
+        self._record("start")
+
+    def _record(self, reason):
+        limit = int(self.limit)
+        if not self.history or self.history[-1][1] != limit:
+            self.history.append((time.time(), limit, reason))
+
+    def _grant(self):
+        """Donner les places libres aux plus anciens en attente (appelé sous verrou)"""
+        while self.waiters and self.inflight < int(self.limit):
+            waiter = self.waiters.popleft()
+            self.inflight += 1
+            waiter.granted = True
+            waiter.wake()
+
+    def baseline(self):
+        return min(self.samples) if self.samples else None
+
+    def mean_latency(self):
+        samples = list(self.samples)
+        return sum(samples) / len(samples) if samples else None
+
+    def acquire(self, timeout=LIMITER_WAIT_SECONDS):
+        """Attendre une place (False si l'attente dépasse timeout)"""
+        with self.lock:
+            if self.inflight < int(self.limit) and not self.waiters:
+                self.inflight += 1
+                return True
+            waiter = _LimiterWaiter()
+            self.waiters.append(waiter)
+        waiter.event.wait(timeout)
+        return self._settle(waiter)
+
+    async def acquire_async(self, timeout=LIMITER_WAIT_SECONDS):
+        """acquire() pour le cœur asynchrone (aio.py): attend sans bloquer l'event loop"""
+        import asyncio
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            if self.inflight < int(self.limit) and not self.waiters:
+                self.inflight += 1
+                return True
+            waiter = _LimiterWaiter(loop, loop.create_future())
+            self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter.future, timeout)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            if self._settle(waiter):
+                self.release(0.0, overloaded=False, sample=False)
+            raise
+        return self._settle(waiter)
+
+    def _settle(self, waiter):
+        with self.lock:
+            if waiter.granted:
+                return True
+            self.waiters.remove(waiter)
+            self.rejected += 1
+            return False
+
+    def release(self, latency, overloaded, sample=True):
+        """Fin d'un appel: libérer sa place et ajuster la limite"""
+        now = time.monotonic()
+        with self.lock:
+            used = self.inflight >= int(self.limit) / 2
+            self.inflight -= 1
+            baseline = self.baseline()
+            cooled = now - self.last_decrease > (baseline or 1.0)
+            if overloaded:
+                self.overloads += 1
+                if cooled:
+                    self.limit = max(self.min_limit, self.limit * 0.5)
+                    self.last_decrease = now
+                    self._record("overload")
+            elif sample:
+                self.samples.append(latency)
+                if baseline is not None and latency > baseline * LIMITER_TOLERANCE:
+                    if cooled:
+                        self.limit = max(self.min_limit, self.limit * 0.9)
+                        self.last_decrease = now
+                        self._record("latency")
+                elif used:
+                    self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                    self._record("increase")
+            self._grant()
+
+    @contextmanager
+    def slot(self):
+        """with limiter.slot() as slot: un appel limité (LimiterTimeout si aucune place)"""
+        if not self.acquire():
+            raise LimiterTimeout(self.name)
+        slot = _LimiterSlot()
+        try:
+            yield slot
+        except Exception as e:
+            slot.overloaded = overloaded_error(e)
+            raise
+        finally:
+            self.release(time.monotonic() - slot.started, slot.overloaded)
+
+    @asynccontextmanager
+    async def slot_async(self):
+        """slot() pour le cœur asynchrone (aio.py)"""
+        if not await self.acquire_async():
+            raise LimiterTimeout(self.name)
+        slot = _LimiterSlot()
+        try:
+            yield slot
+        except Exception as e:
+            slot.overloaded = overloaded_error(e)
+            raise
+        finally:
+            self.release(time.monotonic() - slot.started, slot.overloaded)
+
+    def stats(self, history=False):
+        with self.lock:
+            baseline = self.baseline()
+            stats = {
+                "limit": int(self.limit),
+                "inflight": self.inflight,
+                "waiting": len(self.waiters),
+                "baseline_ms": round(baseline * 1000, 1) if baseline is not None else None,
+                "rejected": self.rejected,
+                "overloads": self.overloads
+            }
+            if history:
+                stats["history"] = [{"ts": round(ts, 3), "limit": limit, "reason": reason}
+                                    for ts, limit, reason in self.history]
+            return stats
+
+def overloaded_status(status_code):
+    """Réponse qui doit faire baisser la limite"""
+    return status_code == 429 or status_code >= 500
+
+def overloaded_error(error):
+    """Exception qui doit faire baisser la limite: délai dépassé ou connexion refusée / coupée"""
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    library = type(error).__module__.split(".")[0]
+    if library == "requests":
+        from requests.exceptions import ConnectionError as RequestsConnectionError, Timeout
+        return isinstance(error, (RequestsConnectionError, Timeout))
+    if library == "httpx":
+        import httpx
+        return isinstance(error, (httpx.TimeoutException, httpx.NetworkError))
+    return False
+
+# === LIMITATION PAR UTILISATEUR ===
+
+def parse_rates(spec):
+    """"chat=6/60,image=3/60" -> {"chat": (6, 60.0), "image": (3, 60.0)}"""
+    rates = {}
+    for item in spec.split(","):
+        name, _, value = item.partition("=")
+        burst, _, period = value.partition("/")
+        try:
+            rates[name.strip()] = (int(burst), float(period))
+        except ValueError:
+            continue
+    return rates
+
+class SenderRateLimiter:
+    """Seau à jetons par (utilisateur, classe), stocké comme un seul flottant (GCRA)
+
+    Pour chaque utilisateur on garde l'instant où son seau sera de nouveau plein; un message
+    est admis si cet instant est à moins d'une rafale dans le futur. Un seau plein équivaut
+    à une absence d'entrée: les seaux sont créés au premier message et supprimés une fois pleins.
+    Un utilisateur limité reçoit au plus un "doucement" par période de sa classe, les messages
+    refusés entre-temps sont ignorés sans réponse.
+    """
+
+    def __init__(self, rates):
+        self.rates = {name: (period / burst, period * (burst - 1) / burst) for name, (burst, period) in rates.items()}
+        self.periods = {name: period for name, (_, period) in rates.items()}
+        self.full_at = {name: {} for name in rates}  # classe -> utilisateur -> instant où le seau est plein
+        self.notified = {}  # utilisateur -> fin de l'épisode déjà signalé
+        self.lock = threading.Lock()
+        self.admissions = 0
+        self.counters = defaultdict(int)  # (classe, "notified" | "dropped")
+
+    def admit(self, sender_id, lane_name, now=None):
+        """(admis, secondes avant le prochain message admis)"""
+        if lane_name not in self.rates:
+            return True, 0.0
+        interval, tolerance = self.rates[lane_name]
+        now = time.monotonic() if now is None else now
+        buckets = self.full_at[lane_name]
+        with self.lock:
+            self.admissions += 1
+            if self.admissions % RATE_SWEEP_EVERY == 0:
+                self._sweep(now)
+            full_at = max(buckets.get(sender_id, now), now)
+            if full_at - now > tolerance:
+                return False, full_at - now - tolerance
+            buckets[sender_id] = full_at + interval
+            return True, 0.0
+
+    def throttled(self, sender_id, lane_name, wait, now=None):
+        """Message refusé: True s'il faut prévenir l'utilisateur (au plus une fois par période)"""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            if self.notified.get(sender_id, 0.0) > now:
+                self.counters[(lane_name, "dropped")] += 1
+                return False
+            self.notified[sender_id] = now + max(wait, self.periods[lane_name])
+            self.counters[(lane_name, "notified")] += 1
+            return True
+
+    def _sweep(self, now):
+        """Oublier les seaux redevenus pleins et les épisodes terminés (appelé sous verrou)"""
+        for buckets in self.full_at.values():
+            for sender_id in [sender_id for sender_id, full_at in buckets.items() if full_at <= now]:
+                del buckets[sender_id]
+        for sender_id in [sender_id for sender_id, until in self.notified.items() if until <= now]:
+            del self.notified[sender_id]
+
+    def stats(self):
+        with self.lock:
+            return {
+                "tracked": {name: len(buckets) for name, buckets in self.full_at.items()},
+                "throttled": {f"{name}_{action}": count for (name, action), count in self.counters.items()}
+            }
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Métriques au format texte Prometheus pour NakamaBot
+
+- Counter: compteur monotone avec étiquettes
+- Histogram: seaux fixes, le calcul du seau se fait hors verrou
+- Gauge: valeur lue au moment de l'export (aucun coût sur le chemin chaud)
+
+register_metric() ajoute une métrique à l'export, render_metrics() produit le
+texte servi par /metrics.
+"""
+
+import bisect
+import logging
+import threading
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+class Counter:
+    """Compteur monotone avec étiquettes"""
+
+    kind = "counter"
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.values = defaultdict(float)
+        self.lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] += amount
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, key, value) for key, value in self.values.items()]
+
+class Histogram:
+    """Histogramme à seaux fixes (le calcul du seau se fait hors verrou)"""
+
+    kind = "histogram"
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.values = {}  # étiquettes -> [compte par seau..., +Inf] , somme
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(label_values)
+            if entry is None:
+                entry = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def samples(self):
+        with self.lock:
+            snapshot = [(key, list(counts), total) for key, (counts, total) in self.values.items()]
+        result = []
+        for key, counts, total in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                result.append((f"{self.name}_bucket", key + (("le", str(bound)),), cumulative))
+            result.append((f"{self.name}_sum", key, total))
+            result.append((f"{self.name}_count", key, cumulative))
+        return result
+
+class Gauge:
+    """Valeur lue au moment de l'export (aucun coût sur le chemin chaud)"""
+
+    def __init__(self, name, description, labels, read, kind="gauge"):
+        self.kind = kind
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.read = read
+
+    def samples(self):
+        value = self.read()
+        if isinstance(value, dict):
+            return [(self.name, key if isinstance(key, tuple) else (key,), v) for key, v in value.items()]
+        return [(self.name, (), value)]
+
+METRICS = []
+
+def register_metric(metric):
+    """Ajouter une métrique à l'export /metrics"""
+    METRICS.append(metric)
+    return metric
+
+def _format_labels(names, values):
+    pairs = []
+    for i, value in enumerate(values):
+        # Les seaux d'histogramme arrivent déjà sous forme (nom, valeur)
+        name, value = value if isinstance(value, tuple) else (names[i], value)
+        escaped = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def render_metrics(metrics=None):
+    """Exporter les métriques (toutes celles enregistrées par défaut) au format texte Prometheus"""
+    lines = []
+    for metric in METRICS if metrics is None else metrics:
+        lines.append(f"# HELP {metric.name} {metric.description}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        try:
+            for name, label_values, value in metric.samples():
+                lines.append(f"{name}{_format_labels(metric.labels, label_values)} {value}")
+        except Exception as e:
+            logger.error(f"❌ Erreur métrique {metric.name}: {e}")
+    return "\n".join(lines) + "\n"
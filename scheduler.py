@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+Diffusions étalées pour NakamaBot
+
+Un /broadcast --over 2h (ou --offpeak) n'envoie pas tout d'un coup: le
+planificateur livre un quota par tick pour finir à l'échéance, et ralentit
+quand les réponses des destinataires risquent de saturer Mistral (taux de
+réponse observé × latence moyenne contre la limite adaptative). L'envoi
+effectif, le limiteur et l'événement d'arrêt sont fournis par app.py.
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+from collections import defaultdict, OrderedDict
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_TICK = float(os.getenv("BROADCAST_TICK", "10"))  # Secondes entre deux envois d'une diffusion étalée
+BROADCAST_OFFPEAK = os.getenv("BROADCAST_OFFPEAK", "2-6")  # Heures creuses locales (début-fin)
+BROADCAST_LLM_SHARE = float(os.getenv("BROADCAST_LLM_SHARE", "0.5"))  # Part de la limite Mistral laissée aux réponses
+BROADCAST_REPLY_WINDOW = float(os.getenv("BROADCAST_REPLY_WINDOW", "1800"))  # Message reçu dans ce délai = réponse
+BROADCAST_REPLY_PRIOR = 0.3  # Taux de réponse supposé avant d'en avoir observé
+
+def parse_duration(text):
+    """'2h', '90m', '45s', '1h30m' -> secondes (None si illisible)"""
+    parts = re.findall(r"(\d+(?:\.\d+)?)\s*([hms])", text.lower())
+    if not parts or re.sub(r"[\d.\shms]", "", text.lower()):
+        return None
+    return sum(float(value) * {"h": 3600, "m": 60, "s": 1}[unit] for value, unit in parts)
+
+def next_offpeak(now=None):
+    """(début, fin) de la plage d'heures creuses BROADCAST_OFFPEAK en cours ou à venir"""
+    start_hour, end_hour = (int(hour) for hour in BROADCAST_OFFPEAK.split("-"))
+    now = datetime.fromtimestamp(now if now is not None else time.time())
+    duration = timedelta(hours=(end_hour - start_hour) % 24 or 24)
+    start = now.replace(hour=start_hour, minute=0, second=0, microsecond=0)
+    if start > now:
+        start -= timedelta(days=1)  # Plage commencée la veille, peut-être pas finie
+    if start + duration <= now:
+        start += timedelta(days=1)
+    return max(start, now).timestamp(), (start + duration).timestamp()
+
+class StaggeredBroadcast:
+    """Une diffusion étalée: destinataires restants, fenêtre de livraison et compteurs"""
+
+    def __init__(self, text, recipients, start_at, deadline, admin_id=None):
+        self.text = text
+        self.recipients = list(recipients)
+        self.index = 0
+        self.start_at = start_at
+        self.deadline = deadline
+        self.admin_id = admin_id
+        self.sent = 0
+        self.errors = 0
+        self.failures = defaultdict(int)
+
+    @property
+    def remaining(self):
+        return len(self.recipients) - self.index
+
+    def schedule_info(self):
+        """Fenêtre à sauver avec les destinataires restants (reprise après redémarrage)"""
+        return {"start_at": self.start_at, "deadline": self.deadline, "admin_id": self.admin_id}
+
+class BroadcastScheduler:
+    """Diffusions étalées sur une fenêtre, freinées par le taux de réponse observé et la capacité Mistral
+
+    À chaque tick, une diffusion reçoit le quota qui la fait finir à l'échéance, borné par la
+    capacité: chaque destinataire répond avec la probabilité observée, chaque réponse occupe
+    une place Mistral pendant la latence moyenne; les livraisons s'arrêtent dès que la part
+    BROADCAST_LLM_SHARE de la limite adaptative est occupée.
+
+    deliver(lot, texte) envoie un lot et rend un résultat par destinataire, limiter est le
+    limiteur adaptatif Mistral, stopping l'événement d'arrêt et notify(admin_id, texte)
+    prévient l'admin à la fin d'une diffusion.
+    """
+
+    def __init__(self, tick, deliver, limiter, stopping, notify=None, batch_size=50):
+        self.tick = tick
+        self.send = deliver
+        self.limiter = limiter
+        self.stopping = stopping
+        self.notify = notify
+        self.batch_size = max(batch_size, 1)
+        self.jobs = []
+        self.lock = threading.Lock()
+        self.awaiting = OrderedDict()  # Destinataire -> heure de livraison, dans l'ordre de livraison
+        self.settled = 0  # Livraisons suivies d'une réponse ou sorties de la fenêtre de réponse
+        self.replies = 0
+        self.throttled = 0  # Ticks sans envoi faute de capacité
+        self.thread = None
+        self.idle = threading.Event()  # Effacé pendant l'envoi d'un lot
+        self.idle.set()
+
+    def schedule(self, text, recipients, start_at, deadline, admin_id=None):
+        job = StaggeredBroadcast(text, recipients, start_at, deadline, admin_id)
+        with self.lock:
+            self.jobs.append(job)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="broadcast-scheduler", daemon=True)
+                self.thread.start()
+        logger.info("🗓️ Diffusion étalée: %d destinataires du %s au %s", len(job.recipients),
+                    datetime.fromtimestamp(start_at).strftime("%d/%m %H:%M"),
+                    datetime.fromtimestamp(deadline).strftime("%d/%m %H:%M"))
+        return job
+
+    def cancel(self):
+        with self.lock:
+            cancelled, self.jobs = self.jobs, []
+        return len(cancelled)
+
+    def park(self, timeout=30.0):
+        """Arrêt en cours: laisser finir le lot en vol, puis rendre [(texte, destinataires restants, fenêtre)] à sauver"""
+        self.idle.wait(timeout)
+        with self.lock:
+            jobs, self.jobs = self.jobs, []
+            # Un lot en vol a déjà avancé job.index: ses destinataires ne seront pas renvoyés
+            return [(job.text, job.recipients[job.index:], job.schedule_info()) for job in jobs if job.remaining]
+
+    def note_inbound(self, sender_id):
+        """Message reçu: compte comme réponse s'il suit de près une livraison"""
+        if not self.awaiting:
+            return
+        with self.lock:
+            if self.awaiting.pop(sender_id, None) is not None:
+                self.replies += 1
+                self.settled += 1
+
+    def reply_ratio(self):
+        """Part des destinataires qui répondent (lissée vers BROADCAST_REPLY_PRIOR au début)"""
+        return (self.replies + BROADCAST_REPLY_PRIOR * 20) / (self.settled + 20)
+
+    def _expire(self, now):
+        with self.lock:
+            while self.awaiting:
+                delivered_at = next(iter(self.awaiting.values()))
+                if now - delivered_at < BROADCAST_REPLY_WINDOW:
+                    break
+                self.awaiting.popitem(last=False)
+                self.settled += 1
+
+    def capacity(self):
+        """Livraisons possibles pendant un tick sans dépasser la part de Mistral laissée aux réponses"""
+        stats = self.limiter.stats()
+        headroom = stats["limit"] * BROADCAST_LLM_SHARE - stats["inflight"] - stats["waiting"]
+        if headroom <= 0:
+            return 0
+        latency = self.limiter.mean_latency() or 2.0
+        return int(headroom * self.tick / (self.reply_ratio() * latency))
+
+    def pace(self, job, now):
+        """Quota du tick pour finir à l'échéance (en retard: rythme moyen prévu, jamais tout d'un coup)"""
+        time_left = job.deadline - now
+        if time_left <= self.tick:
+            time_left = max(job.deadline - job.start_at, self.tick) * job.remaining / len(job.recipients)
+        return max(1, -int(-job.remaining * self.tick // max(time_left, self.tick)))
+
+    def deliver(self, job, count):
+        end = job.index + count
+        while not self.stopping.is_set():
+            with self.lock:
+                if job.index >= end:
+                    return
+                # Lot réservé avant l'envoi: park() ne le confie pas une seconde fois à l'état sauvé
+                batch = [str(user_id) for user_id in job.recipients[job.index:min(job.index + self.batch_size, end)]]
+                job.index += len(batch)
+                self.idle.clear()
+            try:
+                results = self.send(batch, job.text)
+            finally:
+                self.idle.set()
+            now = time.time()
+            sent = 0
+            with self.lock:
+                for user_id, result in zip(batch, results):
+                    if result.get("success"):
+                        sent += 1
+                        self.awaiting.pop(user_id, None)
+                        self.awaiting[user_id] = now
+                    else:
+                        job.failures[result.get("error") or "inconnue"] += 1
+                job.sent += sent
+                job.errors += len(batch) - sent
+
+    def finish(self, job):
+        with self.lock:
+            if job in self.jobs:
+                self.jobs.remove(job)
+        logger.info("📊 Diffusion étalée terminée: %d succès, %d erreurs", job.sent, job.errors)
+        if job.admin_id and self.notify:
+            self.notify(job.admin_id,
+                        f"📊 Diffusion étalée terminée ! ✅ {job.sent} envoyés, ❌ {job.errors} erreurs, "
+                        f"💬 {self.reply_ratio() * 100:.0f}% de réponses 💕")
+
+    def run_once(self):
+        now = time.time()
+        self._expire(now)
+        with self.lock:
+            jobs = [job for job in self.jobs if job.start_at <= now]
+        if not jobs:
+            return
+        capacity = self.capacity()
+        if capacity <= 0:
+            self.throttled += 1
+            return
+        for job in jobs:
+            if self.stopping.is_set() or capacity <= 0:
+                return
+            count = min(self.pace(job, now), capacity, job.remaining)
+            capacity -= count
+            self.deliver(job, count)
+            if not job.remaining:
+                self.finish(job)
+
+    def run(self):
+        while not self.stopping.is_set():
+            started = time.monotonic()
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"❌ Erreur planificateur de diffusion: {e}")
+            with self.lock:
+                if not self.jobs:
+                    self.thread = None
+                    return
+            self.stopping.wait(max(self.tick - (time.monotonic() - started), 0))
+
+    def stats(self):
+        with self.lock:
+            return {
+                "jobs": [{"remaining": job.remaining, "sent": job.sent, "errors": job.errors,
+                          "start_at": job.start_at, "deadline": job.deadline} for job in self.jobs],
+                "reply_ratio": round(self.reply_ratio(), 3),
+                "replies": self.replies,
+                "awaiting": len(self.awaiting),
+                "throttled_ticks": self.throttled
+            }
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""
+Réglages communs des tests: app.py importé depuis la racine du dépôt,
+sans clés API (aucun appel réseau réel) ni fichier d'état
+"""
+
+import os
+import sys
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+os.environ["MISTRAL_API_KEY"] = ""
+os.environ["PAGE_ACCESS_TOKEN"] = ""
+os.environ["STATE_FILE"] = ""
+
+@pytest.fixture
+def load_command():
+    """Charger commandes/<name>.py avec les globales injectées depuis app.py"""
+    import app
+
+    def load(name):
+        path = os.path.join(ROOT_DIR, "commandes", f"{name}.py")
+        namespace = {key: value for key, value in vars(app).items() if not key.startswith("__")}
+        namespace["__name__"] = f"commandes.{name}"
+        with open(path, encoding="utf-8") as f:
+            exec(compile(f.read(), path, "exec"), namespace)
+        return namespace
+    return load
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""
+Cœur asynchrone (aio.py): estimation d'attente des files et arrêt en douceur
+"""
+
+import asyncio
+import os
+import threading
+
+import app as bot
+import aio
+from limiter import AdaptiveLimiter
+
+def test_chat_lane_wait_follows_upstream_limit():
+    limiter = AdaptiveLimiter("test", 4, 1, 8)
+    limiter.samples.append(2.0)
+    lane = aio.AsyncLane("chat", 1000, 1, sheddable=True, limiter=limiter)
+    lane.active = 3
+    assert lane.estimated_wait() == 0.0
+    # 1000 coroutines possibles, mais 4 places Mistral de 2 s chacune
+    lane.active, lane.queued = 4, 60
+    assert lane.estimated_wait() == (64 - 4 + 1) / 4 * 2.0
+    assert lane.overloaded()
+    limiter.limit = 64
+    assert not lane.overloaded()
+
+def test_lane_without_limiter_keeps_thread_estimate():
+    lane = aio.AsyncLane("image", 200, 1)
+    lane.active, lane.queued, lane.service_time = 200, 199, 3.0
+    assert lane.estimated_wait() == 200 / 200 * 3.0
+
+def test_shutdown_drains_then_returns(monkeypatch, tmp_path):
+    state_file = tmp_path / "state.json"
+    monkeypatch.setattr(bot, "draining", threading.Event())
+    monkeypatch.setattr(bot, "drain_done", threading.Event())
+    monkeypatch.setattr(bot, "STATE_FILE", str(state_file))
+    asyncio.run(asyncio.wait_for(aio.shutdown(), 10))
+    assert bot.draining.is_set() and bot.drain_done.is_set()
+    assert os.path.exists(state_file)
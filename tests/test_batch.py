@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Envois groupés Graph (send_batch / send_text_batch): alignement des résultats et renvois unitaires
+"""
+
+import json
+
+import pytest
+
+import app as bot
+
+class FakeResponse:
+    def __init__(self, status_code, items):
+        self.status_code = status_code
+        self.items = items
+
+    def json(self):
+        return self.items
+
+class FakeSession:
+    """Session HTTP factice: garde les requêtes batch et renvoie la réponse prévue"""
+
+    def __init__(self, response):
+        self.response = response
+        self.posted = []
+
+    def post(self, url, data=None, timeout=None):
+        self.posted.append(json.loads(data["batch"]))
+        return self.response
+
+@pytest.fixture
+def graph(monkeypatch):
+    def install(status_code, items):
+        session = FakeSession(FakeResponse(status_code, items))
+        monkeypatch.setattr(bot, "PAGE_ACCESS_TOKEN", "jeton")
+        monkeypatch.setattr(bot, "http", lambda: session)
+        return session
+    return install
+
+def test_batch_result_classifies_items():
+    assert bot.batch_result({"code": 200, "body": "{}"}) == {"success": True}
+    assert bot.batch_result(None)["retry"]
+    error = bot.batch_result({"code": 400, "body": json.dumps({"error": {"message": "No matching user"}})})
+    assert error == {"success": False, "error": "API Error 400: No matching user"}
+    assert not error.get("retry")
+
+def test_send_batch_pads_unprocessed_items(graph):
+    session = graph(200, [{"code": 200, "body": "{}"}])
+    results = bot.send_batch([bot.text_message_payload(f"u{number}", "salut") for number in range(3)])
+    assert [result["success"] for result in results] == [True, False, False]
+    assert all(result.get("retry") for result in results[1:])
+    assert len(session.posted) == 1 and len(session.posted[0]) == 3
+
+def test_send_batch_fails_every_item_on_http_error(graph):
+    graph(500, None)
+    results = bot.send_batch([bot.text_message_payload("u1", "salut"), bot.text_message_payload("u2", "salut")])
+    assert results == [{"success": False, "error": "API Error 500"}] * 2
+
+def test_send_text_batch_retries_only_unprocessed_items(monkeypatch):
+    monkeypatch.setattr(bot, "GRAPH_BATCH_SIZE", 50)
+    monkeypatch.setattr(bot, "send_batch", lambda payloads: [
+        {"success": True},
+        {"success": False, "error": "Not processed", "retry": True},
+        {"success": False, "error": "API Error 400"},
+    ])
+    resent = []
+    monkeypatch.setattr(bot, "send_message", lambda recipient_id, text: resent.append(recipient_id) or {"success": True})
+    results = bot.send_text_batch(["u1", "u2", "u3"], "annonce")
+    assert resent == ["u2"]
+    assert [result["success"] for result in results] == [True, True, False]
+
+def test_send_text_batch_without_batching(monkeypatch):
+    monkeypatch.setattr(bot, "GRAPH_BATCH_SIZE", 1)
+    monkeypatch.setattr(bot, "send_batch", lambda payloads: pytest.fail("batch inattendu"))
+    monkeypatch.setattr(bot, "send_message", lambda recipient_id, text: {"success": True, "to": recipient_id})
+    assert [result["to"] for result in bot.send_text_batch(["u1", "u2"], "annonce")] == ["u1", "u2"]
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+Déduplication des relivraisons Facebook par mid (RecentMessageIds)
+"""
+
+import time
+
+import app as bot
+
+def test_duplicate_within_window():
+    mids = bot.RecentMessageIds(ttl=60, capacity=10)
+    assert not mids.seen_before("m.1")
+    assert mids.seen_before("m.1")
+    assert not mids.seen_before("m.2")
+    assert mids.duplicates == 1
+
+def test_capacity_evicts_oldest():
+    mids = bot.RecentMessageIds(ttl=60, capacity=3)
+    for mid in ("m.1", "m.2", "m.3", "m.4"):
+        assert not mids.seen_before(mid)
+    assert len(mids.seen) == 3
+    # m.1 est sorti de l'anneau: il redevient nouveau (et pousse m.2 dehors)
+    assert not mids.seen_before("m.1")
+    assert mids.seen_before("m.4")
+    assert not mids.seen_before("m.2")
+
+def test_ttl_expires_entries():
+    mids = bot.RecentMessageIds(ttl=0.05, capacity=10)
+    assert not mids.seen_before("m.1")
+    time.sleep(0.1)
+    assert not mids.seen_before("m.1")
+    assert len(mids.ring) == 1 and len(mids.seen) == 1
+
+def test_redelivered_event_is_dispatched_once(monkeypatch):
+    dispatched = []
+    monkeypatch.setattr(bot, "delivered_mids", bot.RecentMessageIds(ttl=60, capacity=10))
+    monkeypatch.setattr(bot, "dispatch_message", lambda sender_id, text: dispatched.append(text))
+    message = {"mid": "m.redelivered", "text": "salut"}
+    bot.handle_message_event("7000000000000200", message)
+    bot.handle_message_event("7000000000000200", message)
+    assert dispatched == ["salut"]
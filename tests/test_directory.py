@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+UserDirectory contre une référence naïve (dict + tri à chaque lecture)
+
+Les nouvelles clés sont rangées à la lecture: on alterne petites vagues
+d'inscriptions (insertions une à une) et grosses vagues (tri complet).
+"""
+
+import random
+
+import app as bot
+
+class Reference:
+    def __init__(self):
+        self.seen = {}
+
+    def touch(self, user_id, now):
+        self.seen.pop(user_id, None)
+        self.seen[user_id] = now
+
+    def numeric_ids(self):
+        return sorted((user_id for user_id in self.seen if bot.encode(user_id) is not None), key=int)
+
+    def page(self, number, size):
+        recent = list(reversed(self.seen.items()))
+        return recent[(number - 1) * size:number * size]
+
+def check(directory, reference):
+    assert len(directory) == len(reference.seen)
+    assert directory.snapshot() == list(reference.seen.items())
+    # PSID dans l'ordre numérique, puis les IDs non numériques (ordre d'arrivée)
+    listed = [user_id for user_id, _ in directory.iter_all(chunk=97)]
+    numeric = reference.numeric_ids()
+    assert listed[:len(numeric)] == numeric
+    assert sorted(listed[len(numeric):]) == sorted(set(reference.seen) - set(numeric))
+    for number in (1, 3):
+        assert directory.page(number) == reference.page(number, directory.PAGE_SIZE)
+    for prefix in ("", "1", "42", "7000", "s"):
+        found = [user_id for user_id, _ in directory.find(prefix, limit=10 ** 6)]
+        assert sorted(found) == sorted(user_id for user_id in reference.seen if user_id.startswith(prefix)), prefix
+
+def test_directory_matches_reference(monkeypatch):
+    rng = random.Random(11)
+    clock = [1000.0]
+    monkeypatch.setattr(bot.time, "time", lambda: clock[0])
+    directory, reference = bot.UserDirectory(), Reference()
+    pool = [str(rng.randrange(10 ** 15, 10 ** 16)) for _ in range(5000)] + [str(i) for i in range(200)] + ["system", "007"]
+    for wave in (10, 3000, 1, 0, 1500, 50):
+        for _ in range(wave):
+            clock[0] += 1
+            user_id = rng.choice(pool)
+            directory.touch(user_id)
+            reference.touch(user_id, clock[0])
+        check(directory, reference)
+
+def test_new_users_are_appended_until_read():
+    directory = bot.UserDirectory()
+    for user_id in ("7000000000000003", "7000000000000001", "7000000000000002"):
+        directory.touch(user_id)
+    assert len(directory.unsorted_keys) == 3 and len(directory.sorted_keys) == 0
+    assert [user_id for user_id, _ in directory.after("", 10)] == ["7000000000000001", "7000000000000002", "7000000000000003"]
+    assert len(directory.unsorted_keys) == 0
+
+def test_restore_round_trip():
+    directory = bot.UserDirectory()
+    for user_id in ("7000000000000009", "system", "12", "7000000000000009"):
+        directory.touch(user_id)
+    restored = bot.UserDirectory()
+    restored.restore(directory.snapshot())
+    assert restored.snapshot() == directory.snapshot()
+    assert list(restored.iter_all()) == list(directory.iter_all())
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Cache sémantique (faq.py) avec un embedder local: seuil, modes, apprentissage, oubli
+
+Les vecteurs sont choisis à la main: la similarité cosinus entre deux questions
+est connue d'avance, aucun appel réseau.
+"""
+
+import math
+import time
+
+import pytest
+
+import app as bot
+from faq import FaqCache, normalize
+
+def at(cosine):
+    """Vecteur dont la similarité avec [1, 0, 0] vaut cosine"""
+    return [cosine, math.sqrt(1 - cosine ** 2), 0.0]
+
+VECTORS = {
+    "Qui t'a créée ?": [1.0, 0.0, 0.0],
+    "C'est qui ton créateur ?": at(0.95),
+    "Tu as été faite par qui ?": at(0.90),
+    "Quelle heure est-il ?": [0.0, 0.0, 1.0],
+    "Il est quelle heure ?": [0.0, 0.1, 0.995],
+}
+
+class Embedder:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = 0
+
+    def __call__(self, texts):
+        self.calls += 1
+        time.sleep(self.delay)
+        return [normalize(VECTORS[text]) for text in texts]
+
+def cache(mode="on", **options):
+    embedder = options.pop("embedder", Embedder())
+    faq = FaqCache(embedder, mode=mode, threshold=0.92, promote=3, **options)
+    faq.seed([(("Qui t'a créée ?",), "Durand !")])
+    return faq
+
+def wait_until(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "délai dépassé"
+        time.sleep(0.005)
+
+def test_threshold_separates_paraphrases():
+    faq = cache()
+    assert faq.lookup("C'est qui ton créateur ?", "u1").answer == "Durand !"
+    assert faq.lookup("Tu as été faite par qui ?", "u1").answer is None
+    assert (faq.counters["hit"], faq.counters["miss"]) == (1, 1)
+
+def test_shadow_measures_without_serving():
+    faq = cache("shadow")
+    lookup = faq.lookup("C'est qui ton créateur ?", "u1")
+    assert lookup.answer is None and not lookup.learn
+    wait_until(lambda: faq.counters["shadow_hit"] == 1)
+    assert faq.counters["hit"] == 0
+    assert faq.review()[0][1].question == "Qui t'a créée ?"
+
+def test_off_never_embeds():
+    embedder = Embedder()
+    faq = cache("off", embedder=embedder)
+    assert faq.lookup("Qui t'a créée ?", "u1").answer is None
+    assert embedder.calls == 0 and not faq.entries
+
+def test_slow_embedding_falls_through_to_the_model():
+    faq = cache(budget=0.05, embedder=Embedder(delay=0.3))
+    started = time.monotonic()
+    lookup = faq.lookup("C'est qui ton créateur ?", "u1")
+    assert time.monotonic() - started < 0.25
+    assert lookup.answer is None and not lookup.learn
+    assert faq.counters["late"] == 1
+
+def test_learns_after_distinct_senders():
+    faq = cache()
+    assert not faq.lookup("Quelle heure est-il ?", "u1").learn
+    # La même personne qui insiste ne compte qu'une fois
+    assert not faq.lookup("Il est quelle heure ?", "u1").learn
+    assert not faq.lookup("Il est quelle heure ?", "u2").learn
+    lookup = faq.lookup("Quelle heure est-il ?", "u3")
+    assert lookup.learn
+    entry = faq.learn(lookup, "Je n'ai pas de montre !")
+    assert entry.source == "chat"
+    assert faq.lookup("Il est quelle heure ?", "u4").answer == "Je n'ai pas de montre !"
+
+def test_shadow_learns_questions_without_answers():
+    faq = cache("shadow")
+    for sender_id in ("u1", "u2", "u3"):
+        assert not faq.lookup("Quelle heure est-il ?", sender_id).learn
+        wait_until(lambda: faq.counters["miss"] == int(sender_id[1:]))
+    wait_until(lambda: faq.counters["learned"] == 1)
+    faq.lookup("Il est quelle heure ?", "u4")
+    wait_until(lambda: faq.counters["shadow_hit"] == 1)
+    entry = faq.top_entries(1)[0]
+    assert (entry.source, entry.answer, entry.hits) == ("shadow", None, 1)
+
+@pytest.fixture
+def admin(monkeypatch, load_command):
+    monkeypatch.setattr(bot, "ADMIN_IDS", {"42"})
+    monkeypatch.setattr(bot, "faq_cache", cache())
+    execute = load_command("admin")["execute"]
+    return lambda args: execute("42", args)
+
+def test_admin_forget_removes_entry(admin):
+    assert bot.faq_cache.lookup("C'est qui ton créateur ?", "u1").answer == "Durand !"
+    assert "#1" in admin("faq revue")
+    assert admin("faq oubli 1") == "🗑️ Entrée #1 oubliée : Qui t'a créée ?"
+    assert bot.faq_cache.lookup("C'est qui ton créateur ?", "u1").answer is None
+    assert admin("faq oubli 1").startswith("❌ Usage")
+    assert admin("faq oubli abc").startswith("❌ Usage")
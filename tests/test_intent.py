@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Routage des messages libres: quelle intention pour quel message, sur chaque chemin
+
+cmd_chat (et le mode dégradé) gardent les mots-clés d'origine de cmd_chat,
+commandes/ai.py garde les siens: un même message peut donc être routé
+différemment selon le chemin.
+"""
+
+import pytest
+
+import app as bot
+
+# cmd_chat: creator > image > search > chat
+CHAT_ROUTES = [
+    ("Qui est ton créateur ?", "creator"),
+    ("c'est qui qui t'a fait ?", "creator"),
+    ("Qui t'a créé ? et dessine-moi un chat", "creator"),
+    ("tu peux me dessiner un chat ?", "image"),
+    ("J'aimerais generer une image de dragon", "image"),
+    ("envoie des photos de 2025", "image"),
+    ("Quelles sont les actualités de 2025 ?", "search"),
+    ("Quoi de nouveau aujourd'hui ?", "search"),
+    ("raconte moi une blague", "chat"),
+    ("je suis developer python", "chat"),
+    ("", "chat"),
+]
+
+# commandes/ai.py: seulement "creator", et sans 'créé' ni 'développeur' isolés
+AI_ROUTES = [
+    ("Qui est ton créateur ?", "creator"),
+    ("qui t'a fait ?", "creator"),
+    ("who is your developer", "creator"),
+    ("j'ai créé un gâteau", "chat"),
+    ("je suis développeur", "chat"),
+    ("dessine-moi un chat", "chat"),
+    ("quoi de neuf aujourd'hui ?", "chat"),
+]
+
+LEGACY_CHAT_KEYWORDS = [
+    ("creator", ['créateur', 'createur', 'qui t\'a', 'créé', 'créee', 'maker', 'développeur']),
+    ("image", ['image', 'images', 'photo', 'photos', 'dessiner', 'créer', 'génerer', 'generer']),
+    ("search", ['2025', 'actualité', 'récent', 'nouveau', 'maintenant', 'aujourd\'hui']),
+]
+
+def legacy_chat_route(text):
+    """Routage de cmd_chat avant classify_intent (any() successifs)"""
+    for intent, words in LEGACY_CHAT_KEYWORDS:
+        if any(word in text.lower() for word in words):
+            return intent
+    return "chat"
+
+@pytest.mark.parametrize("text, intent", CHAT_ROUTES)
+def test_chat_routes(text, intent):
+    assert bot.classify_intent(text) == intent
+
+@pytest.mark.parametrize("text, intent", AI_ROUTES)
+def test_ai_routes(text, intent):
+    assert bot.classify_intent(text, bot.AI_INTENTS) == intent
+
+def test_chat_router_matches_legacy_scans():
+    corpus = [text for text, _ in CHAT_ROUTES + AI_ROUTES] + [
+        "Le Maker Faire c'est quand ?", "IMAGES STP", "C'est récent ?", "je l'ai créee hier",
+        "merci beaucoup tu es trop gentille 💕", "Explique moi la relativité générale"
+    ]
+    for text in corpus:
+        assert bot.classify_intent(text) == legacy_chat_route(text), text
+
+def test_degraded_reply_uses_chat_routes():
+    assert bot.degraded_reply("Qui est ton créateur ?") == bot.CREATOR_TEXT
+    assert bot.degraded_reply("tu peux dessiner un chat ?") == bot.IMAGE_HINT_TEXT
+    assert bot.degraded_reply("Quoi de nouveau ?") == bot.BUSY_TEXT
+    assert bot.degraded_reply("/image chat") == bot.BUSY_TEXT
+
+def test_ai_command_does_not_answer_creator_for_developers(load_command):
+    execute = load_command("ai")["execute"]
+    assert "Mon créateur est Durand" in execute("123", "qui t'a fait ?")
+    # Sans clé Mistral l'IA ne répond pas: on obtient l'excuse, pas la réponse toute prête
+    assert "Mon créateur est Durand" not in execute("123", "je suis développeur")
+    assert "Mon créateur est Durand" not in execute("123", "j'ai créé un gâteau")
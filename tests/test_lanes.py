@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Files de priorité (WorkLane): isolation, estimation d'attente et mode dégradé
+"""
+
+import threading
+import time
+
+import pytest
+
+import app as bot
+
+class Recorder:
+    """File "static" factice: garde les envois au lieu de les exécuter"""
+
+    def __init__(self):
+        self.jobs = []
+
+    def submit(self, func, *args):
+        self.jobs.append((func.__name__, args))
+
+@pytest.fixture
+def blocked_lane():
+    """File à un worker occupé par une tâche qui attend le feu vert"""
+    lane = bot.WorkLane("test", 1, sheddable=True)
+    release = threading.Event()
+    lane.submit(release.wait, 5)
+    deadline = time.monotonic() + 2
+    while lane.stats()["active"] != 1:
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+    yield lane
+    release.set()
+    lane.executor.shutdown(wait=True)
+
+def test_busy_lane_does_not_delay_other_lanes(blocked_lane):
+    static = bot.WorkLane("static-test", 1)
+    started = time.monotonic()
+    assert static.submit(lambda: "ok").result(timeout=1) == "ok"
+    assert time.monotonic() - started < 0.5
+    assert blocked_lane.stats()["active"] == 1
+    static.executor.shutdown(wait=True)
+
+def test_wait_estimate_grows_with_backlog(blocked_lane, monkeypatch):
+    blocked_lane.service_time = 0.5
+    assert blocked_lane.estimated_wait() == 0.5
+    for _ in range(3):
+        blocked_lane.submit(time.sleep, 0)
+    assert blocked_lane.estimated_wait() == 4 * 0.5
+    monkeypatch.setattr(bot, "SHED_WAIT_SECONDS", 1.0)
+    assert blocked_lane.overloaded()
+    assert not bot.WorkLane("idle", 1, sheddable=True).overloaded()
+
+@pytest.mark.parametrize("text, reply", [
+    ("Qui est ton créateur ?", bot.CREATOR_TEXT),
+    ("tu peux dessiner un chat ?", bot.IMAGE_HINT_TEXT),
+    ("raconte moi une blague", bot.BUSY_TEXT),
+])
+def test_overloaded_lane_sends_degraded_reply(blocked_lane, monkeypatch, text, reply):
+    static = Recorder()
+    monkeypatch.setattr(bot, "LANES", {"chat": blocked_lane, "static": static})
+    monkeypatch.setattr(bot, "SHED_WAIT_SECONDS", 0.0)
+    blocked_lane.service_time = 1.0
+    assert bot.dispatch_message("7000000000000100", text) is False
+    assert static.jobs == [("send_message", ("7000000000000100", reply))]
+    assert blocked_lane.stats()["shed"] == 1 and blocked_lane.stats()["queued"] == 0
+
+def test_lane_accepts_work_below_threshold(blocked_lane, monkeypatch):
+    static = Recorder()
+    monkeypatch.setattr(bot, "LANES", {"chat": blocked_lane, "static": static})
+    blocked_lane.service_time = 0.01
+    monkeypatch.setattr(bot, "handle_text_message", lambda sender_id, text: None)
+    assert bot.dispatch_message("7000000000000101", "salut")
+    assert blocked_lane.stats()["queued"] == 1 and not static.jobs
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+Comptabilité des tokens (ledger.py): budgets quotidiens, chemin "budget épuisé" et max_tokens adaptatif
+"""
+
+import pytest
+
+import app as bot
+import ledger as ledgers
+from ledger import CompletionBudget, RollingCounter, TokenBudgetExceeded, TokenLedger
+
+def ledger(**budgets):
+    return TokenLedger("grand", "petit", exempt={"admin"}, **budgets)
+
+def test_user_budget_downgrades_then_refuses():
+    tokens = ledger(user_budget=100, hard_limit=200)
+    assert tokens.decide("u1", "chat") == "grand"
+    tokens.record("u1", "chat", "grand", 80, 20)
+    assert tokens.decide("u1", "chat") == "petit"
+    tokens.record("u1", "chat", "petit", 90, 10)
+    assert tokens.decide("u1", "chat") is None
+    assert tokens.decide("u2", "chat") == "grand"
+    assert (tokens.downgraded, tokens.refused) == (1, 1)
+
+def test_command_budget_and_exempt_users():
+    tokens = ledger(hard_limit=50, command_budgets={"vision": 100})
+    tokens.record(None, "vision", "grand", 100, 0)  # Dépense sans utilisateur: comptée par commande
+    assert tokens.decide(None, "vision") == "petit"
+    assert tokens.decide("u1", "chat") == "grand"
+    tokens.record("admin", "chat", "grand", 500, 0)
+    assert tokens.decide("admin", "vision") == "grand"
+
+def test_daily_counters_roll_over():
+    tokens = ledger(hard_limit=10)
+    tokens.record("u1", "chat", "grand", 10, 0)
+    assert tokens.decide("u1", "chat") is None
+    tokens.day -= 1  # Veille
+    assert tokens.decide("u1", "chat") == "grand"
+    assert tokens.snapshot()["per_command"]["chat"] == [1, 10, 0]  # Les cumuls, eux, restent
+
+def test_rolling_counter_forgets_old_buckets():
+    window = RollingCounter(60, 3)
+    window.add(0, 10, 1)
+    window.add(61, 20, 2)
+    assert window.totals(120) == (2, 30, 3)
+    assert window.totals(180) == (1, 20, 2)
+    assert window.totals(300) == (0, 0, 0)
+
+@pytest.fixture
+def exhausted(monkeypatch):
+    """L'utilisateur a épuisé sa limite dure; tout appel HTTP ferait échouer le test"""
+    tokens = ledger(hard_limit=10)
+    tokens.record("7000000000000300", "chat", "grand", 10, 0)
+    monkeypatch.setattr(bot, "token_ledger", tokens)
+    monkeypatch.setattr(bot, "MISTRAL_API_KEY", "clé")
+
+    def no_network():
+        raise AssertionError("appel réseau inattendu")
+    monkeypatch.setattr(bot, "http", no_network)
+    return tokens
+
+def test_exhausted_budget_raises_before_any_call(exhausted):
+    with bot.traced("webhook", sender_id="7000000000000300", command="chat"):
+        with pytest.raises(TokenBudgetExceeded):
+            bot.call_mistral_api([{"role": "user", "content": "salut"}])
+    assert exhausted.refused == 1
+
+def test_exhausted_budget_answers_budget_text(exhausted):
+    with bot.traced("webhook", sender_id="7000000000000300"):
+        assert bot.process_command("7000000000000300", "raconte moi une blague") == bot.BUDGET_TEXT
+    assert bot.UPSTREAM_CALLS.values[("mistral", "budget")] >= 1
+
+def answer(tokens, truncated=False):
+    return {"usage": {"completion_tokens": tokens}, "choices": [{"finish_reason": "length" if truncated else "stop"}]}
+
+@pytest.fixture
+def short_history(monkeypatch):
+    monkeypatch.setattr(ledgers, "COMPLETION_MIN_SAMPLES", 10)
+    return CompletionBudget(adaptive=True)
+
+def feed(budget, lengths, requested=500, truncated=()):
+    for number, tokens in enumerate(lengths):
+        budget.record("chat", "fixe", requested, answer(tokens, number in truncated), 0.1)
+
+def test_fixed_until_enough_samples(short_history):
+    feed(short_history, [100] * 9)
+    assert short_history.max_tokens("chat", 500) == (500, "fixe")
+    feed(short_history, [100])
+    assert short_history.max_tokens("chat", 500) == (int(100 * ledgers.COMPLETION_HEADROOM), "adaptatif")
+    assert short_history.max_tokens("search", 500) == (500, "fixe")  # Chaque usage a son historique
+
+def test_cap_is_bounded_by_floor_and_requested(short_history):
+    feed(short_history, [5] * 10)
+    assert short_history.max_tokens("chat", 500) == (ledgers.COMPLETION_FLOOR, "adaptatif")
+    other = CompletionBudget(adaptive=True)
+    for _ in range(10):
+        other.record("chat", "fixe", 500, answer(2000), 0.1)
+    assert other.max_tokens("chat", 500) == (500 * ledgers.COMPLETION_MAX_FACTOR, "adaptatif")
+
+def test_cap_follows_a_new_requested_value(short_history):
+    feed(short_history, [100] * 10)
+    assert short_history.max_tokens("chat", 50) == (50 * ledgers.COMPLETION_MAX_FACTOR, "adaptatif")
+
+def test_truncations_loosen_the_cap(short_history):
+    feed(short_history, [100] * 8 + [200, 200], truncated={8, 9})
+    assert short_history.max_tokens("chat", 500) == (300, "adaptatif")  # Maximum observé × 1,5
+    assert short_history.stats()["chat"]["truncation_rate"] == 0.2
+
+def test_disabled_budget_keeps_requested_value(monkeypatch):
+    monkeypatch.setattr(ledgers, "COMPLETION_MIN_SAMPLES", 10)
+    budget = CompletionBudget(adaptive=False)
+    feed(budget, [100] * 20)
+    assert budget.max_tokens("chat", 500) == (500, "fixe")
+    assert budget.stats()["chat"]["max_tokens"] == 500
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Limiteurs (limiter.py): AIMD du limiteur adaptatif Mistral, seaux GCRA par utilisateur
+"""
+
+import threading
+import time
+
+import pytest
+
+import limiter as limiters
+from limiter import LIMITER_TOLERANCE, AdaptiveLimiter, SenderRateLimiter, parse_rates
+
+def saturate(limiter, latency):
+    """Un cycle à pleine charge: toutes les places prises puis rendues avec la même latence"""
+    taken = int(limiter.limit)
+    for _ in range(taken):
+        assert limiter.acquire(timeout=0)
+    for _ in range(taken):
+        limiter.release(latency, overloaded=False)
+
+def test_increases_while_latency_stays_near_baseline():
+    limiter = AdaptiveLimiter("test", 4, 1, 6)
+    for _ in range(20):
+        saturate(limiter, 0.1)
+    assert int(limiter.limit) == 6
+    assert [reason for _, _, reason in limiter.history][:2] == ["start", "increase"]
+
+def test_idle_limiter_does_not_grow():
+    limiter = AdaptiveLimiter("test", 4, 1, 64)
+    for _ in range(50):
+        assert limiter.acquire(timeout=0)
+        limiter.release(0.1, overloaded=False)
+    assert limiter.limit == 4
+
+def test_slow_responses_decrease_once_per_baseline():
+    limiter = AdaptiveLimiter("test", 10, 1, 64)
+    saturate(limiter, 0.1)
+    before = limiter.limit
+    slow = 0.1 * LIMITER_TOLERANCE * 2
+    for _ in range(3):
+        assert limiter.acquire(timeout=0)
+        limiter.release(slow, overloaded=False)
+    # Une seule baisse de 10 % tant que la latence de base (0,1 s) ne s'est pas écoulée
+    assert limiter.limit == pytest.approx(before * 0.9)
+    assert limiter.history[-1][2] == "latency"
+
+def test_overload_halves_down_to_minimum():
+    limiter = AdaptiveLimiter("test", 16, 2, 64)
+    for _ in range(6):
+        assert limiter.acquire(timeout=0)
+        limiter.release(0.0, overloaded=True)
+        limiter.last_decrease = 0.0  # Sortir de la période de grâce à chaque fois
+    assert limiter.limit == 2
+    assert limiter.overloads == 6
+
+def test_slot_classifies_errors():
+    limiter = AdaptiveLimiter("test", 8, 1, 64)
+    with pytest.raises(TimeoutError):
+        with limiter.slot():
+            raise TimeoutError()
+    assert (limiter.limit, limiter.overloads) == (4, 1)
+    with pytest.raises(ValueError):
+        with limiter.slot():
+            raise ValueError("payload invalide")
+    assert (limiter.limit, limiter.overloads, limiter.inflight) == (4, 1, 0)
+
+def test_waiters_get_freed_slots_in_order():
+    limiter = AdaptiveLimiter("test", 1, 1, 1)
+    assert limiter.acquire(timeout=0)
+    assert not limiter.acquire(timeout=0.01)
+    assert limiter.rejected == 1
+    granted = []
+    waiting = [threading.Thread(target=lambda number=number: granted.append((number, limiter.acquire(timeout=2))))
+               for number in range(2)]
+    for thread in waiting:
+        thread.start()
+        while len(limiter.waiters) <= waiting.index(thread):
+            time.sleep(0.001)
+    limiter.release(0.1, overloaded=False)
+    waiting[0].join(1)
+    assert granted == [(0, True)]
+    limiter.release(0.1, overloaded=False)
+    waiting[1].join(1)
+    assert granted == [(0, True), (1, True)] and limiter.inflight == 1
+
+def test_parse_rates_skips_invalid_items():
+    assert parse_rates("chat=6/60, image=3/60,vision=oops,static") == {"chat": (6, 60.0), "image": (3, 60.0)}
+
+def test_burst_then_refill():
+    rates = SenderRateLimiter({"chat": (3, 30.0)})  # Un jeton toutes les 10 s, rafale de 3
+    assert [rates.admit("u1", "chat", now=100.0)[0] for _ in range(3)] == [True, True, True]
+    assert rates.admit("u1", "chat", now=100.0) == (False, 10.0)
+    assert rates.admit("u1", "chat", now=105.0) == (False, 5.0)
+    assert rates.admit("u1", "chat", now=110.0) == (True, 0.0)
+    assert not rates.admit("u1", "chat", now=110.0)[0]
+    # Seau redevenu plein après une période entière sans message
+    assert [rates.admit("u1", "chat", now=140.0)[0] for _ in range(4)] == [True, True, True, False]
+
+def test_buckets_are_per_sender_and_lane():
+    rates = SenderRateLimiter({"chat": (1, 60.0), "image": (1, 60.0)})
+    assert rates.admit("u1", "chat", now=0.0)[0]
+    assert not rates.admit("u1", "chat", now=1.0)[0]
+    assert rates.admit("u2", "chat", now=1.0)[0]
+    assert rates.admit("u1", "image", now=1.0)[0]
+    assert rates.admit("u1", "static", now=1.0) == (True, 0.0)  # Classe sans limite
+
+def test_one_slow_down_notice_per_period():
+    rates = SenderRateLimiter({"chat": (1, 60.0)})
+    assert rates.throttled("u1", "chat", 5.0, now=0.0)
+    assert not rates.throttled("u1", "chat", 5.0, now=30.0)
+    assert rates.throttled("u1", "chat", 5.0, now=61.0)
+    assert rates.stats()["throttled"] == {"chat_notified": 2, "chat_dropped": 1}
+
+def test_sweep_forgets_full_buckets(monkeypatch):
+    monkeypatch.setattr(limiters, "RATE_SWEEP_EVERY", 4)
+    rates = SenderRateLimiter({"chat": (2, 10.0)})
+    for number in range(3):
+        rates.admit(f"u{number}", "chat", now=0.0)
+    assert rates.stats()["tracked"] == {"chat": 3}
+    rates.admit("u9", "chat", now=60.0)  # 4e admission: nettoyage avant de compter u9
+    assert rates.stats()["tracked"] == {"chat": 1}
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Diffusions étalées (scheduler.py): durées, heures creuses, lots réservés, annulation et mise de côté
+"""
+
+import threading
+from datetime import datetime
+
+import pytest
+
+import scheduler as schedulers
+from scheduler import BroadcastScheduler, StaggeredBroadcast, next_offpeak, parse_duration
+
+class FakeLimiter:
+    """Limiteur Mistral figé: limite et latence moyenne choisies par le test"""
+
+    def __init__(self, limit=20, inflight=0, latency=1.0):
+        self.limit = limit
+        self.inflight = inflight
+        self.latency = latency
+
+    def stats(self):
+        return {"limit": self.limit, "inflight": self.inflight, "waiting": 0}
+
+    def mean_latency(self):
+        return self.latency
+
+class Outbox:
+    """Envoi factice: garde les lots et l'avancement de la diffusion au moment de l'envoi"""
+
+    def __init__(self, failing=()):
+        self.batches = []
+        self.failing = set(failing)
+        self.job = None
+
+    def __call__(self, batch, text):
+        self.batches.append((batch, self.job.index if self.job else None))
+        return [{"success": False, "error": "API Error 400"} if user_id in self.failing else {"success": True}
+                for user_id in batch]
+
+@pytest.fixture
+def outbox():
+    return Outbox()
+
+@pytest.fixture
+def planner(outbox):
+    notices = []
+    planner = BroadcastScheduler(10, outbox, FakeLimiter(), threading.Event(),
+                                 notify=lambda admin_id, text: notices.append((admin_id, text)), batch_size=2)
+    planner.notices = notices
+    return planner
+
+def add_job(planner, count, start_at=0, deadline=0, admin_id=None):
+    job = StaggeredBroadcast("annonce", [f"u{number}" for number in range(count)], start_at, deadline, admin_id)
+    planner.jobs.append(job)
+    return job
+
+@pytest.mark.parametrize("text, seconds", [
+    ("2h", 7200), ("90m", 5400), ("1h30m", 5400), ("45s", 45), ("1.5h", 5400), ("demain", None), ("2h soir", None),
+])
+def test_parse_duration(text, seconds):
+    assert parse_duration(text) == seconds
+
+def at(day, hour):
+    return datetime(2026, 3, day, hour).timestamp()
+
+def test_next_offpeak(monkeypatch):
+    monkeypatch.setattr(schedulers, "BROADCAST_OFFPEAK", "2-6")
+    day = datetime(2026, 3, 10)
+    assert next_offpeak(day.replace(hour=10).timestamp()) == (at(11, 2), at(11, 6))
+    assert next_offpeak(day.replace(hour=3).timestamp()) == (at(10, 3), at(10, 6))
+    monkeypatch.setattr(schedulers, "BROADCAST_OFFPEAK", "22-4")
+    assert next_offpeak(day.replace(hour=1).timestamp()) == (at(10, 1), at(10, 4))  # Plage commencée la veille
+
+def test_deliver_claims_each_batch_before_sending(planner, outbox):
+    outbox.failing = {"u3"}
+    job = add_job(planner, 6)
+    outbox.job = job
+    planner.deliver(job, 5)
+    # Chaque lot est retiré de la diffusion avant l'appel d'envoi
+    assert outbox.batches == [(["u0", "u1"], 2), (["u2", "u3"], 4), (["u4"], 5)]
+    assert (job.index, job.sent, job.errors, job.remaining) == (5, 4, 1, 1)
+    assert job.failures == {"API Error 400": 1}
+    assert list(planner.awaiting) == ["u0", "u1", "u2", "u4"]
+
+def test_park_skips_the_batch_in_flight(planner):
+    in_flight, release = threading.Event(), threading.Event()
+
+    def slow_send(batch, text):
+        in_flight.set()
+        release.wait(2)
+        return [{"success": True} for _ in batch]
+    planner.send = slow_send
+    job = add_job(planner, 5, deadline=1234, admin_id="admin")
+    sending = threading.Thread(target=planner.deliver, args=(job, 2))
+    sending.start()
+    assert in_flight.wait(2)
+    threading.Timer(0.05, release.set).start()
+    parked = planner.park(timeout=2)
+    sending.join(2)
+    assert parked == [("annonce", ["u2", "u3", "u4"], {"start_at": 0, "deadline": 1234, "admin_id": "admin"})]
+    assert job.sent == 2 and not planner.jobs
+
+def test_cancel_drops_pending_jobs(planner, outbox):
+    add_job(planner, 3)
+    add_job(planner, 4)
+    assert planner.cancel() == 2
+    assert planner.jobs == [] and planner.park(timeout=0) == []
+    planner.run_once()
+    assert outbox.batches == []
+
+def test_run_once_finishes_and_notifies(planner, outbox):
+    job = add_job(planner, 3, admin_id="admin")
+    planner.run_once()  # Échéance dépassée: tout part en un tick
+    assert [batch for batch, _ in outbox.batches] == [["u0", "u1"], ["u2"]]
+    assert not planner.jobs and job.sent == 3
+    assert planner.notices[0][0] == "admin" and "3 envoyés" in planner.notices[0][1]
+
+def test_saturated_limiter_throttles(planner, outbox):
+    planner.limiter.inflight = planner.limiter.limit * schedulers.BROADCAST_LLM_SHARE
+    add_job(planner, 3)
+    planner.run_once()
+    assert outbox.batches == [] and planner.throttled == 1
+
+def test_replies_are_counted_once(planner):
+    add_job(planner, 2)
+    planner.deliver(planner.jobs[0], 2)
+    planner.note_inbound("u1")
+    planner.note_inbound("u1")
+    planner.note_inbound("inconnu")
+    assert (planner.replies, planner.settled, list(planner.awaiting)) == (1, 1, ["u0"])
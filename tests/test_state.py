@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Arrêt en douceur: vidage des files, fichier d'état, puis restauration au démarrage suivant
+"""
+
+import json
+import threading
+from collections import deque
+
+import pytest
+
+import app as bot
+from scheduler import BroadcastScheduler, StaggeredBroadcast
+from userids import StripedUserIdMap, StripedUserIdSet
+
+class Recorder:
+    """File factice au redémarrage: garde les tâches relancées au lieu de les exécuter"""
+
+    def __init__(self):
+        self.jobs = []
+
+    def submit(self, func, *args):
+        self.jobs.append((func.__name__, args))
+
+def fresh_state(monkeypatch):
+    """Mémoire, annuaire et compteurs vides (ceux d'app.py sont partagés par tous les tests)"""
+    monkeypatch.setattr(bot, "user_memory", StripedUserIdMap(lambda: deque(maxlen=8)))
+    monkeypatch.setattr(bot, "user_list", StripedUserIdSet())
+    monkeypatch.setattr(bot, "user_last_image", StripedUserIdMap())
+    monkeypatch.setattr(bot, "user_directory", bot.UserDirectory())
+    monkeypatch.setattr(bot, "memory_stats", bot.MemoryStats())
+    monkeypatch.setattr(bot, "_parked_broadcasts", [])
+
+def idle_scheduler():
+    """Planificateur arrêté: les diffusions reprises restent en liste sans être livrées"""
+    stopped = threading.Event()
+    stopped.set()
+    return BroadcastScheduler(10, lambda batch, text: pytest.fail("livraison inattendue"), None, stopped)
+
+@pytest.fixture
+def stopping(monkeypatch, tmp_path):
+    monkeypatch.setattr(bot, "STATE_FILE", str(tmp_path / "state.json"))
+    monkeypatch.setattr(bot, "DRAIN_TIMEOUT", 0.2)
+    monkeypatch.setattr(bot, "draining", threading.Event())
+    monkeypatch.setattr(bot, "drain_done", threading.Event())
+    fresh_state(monkeypatch)
+    # File "static" occupée: ce qui attend derrière doit être mis de côté
+    release = threading.Event()
+    static = bot.WorkLane("static-test", 1)
+    static.submit(release.wait, 5)
+    monkeypatch.setattr(bot, "LANES", {"static": static})
+    yield static
+    release.set()
+    static.executor.shutdown(wait=True)
+
+def test_drain_then_restore_round_trip(stopping, monkeypatch):
+    def render_card():
+        pass
+    stopping.submit(bot.send_message, "7000000000000400", "ta réponse 💕")
+    stopping.submit(render_card)  # Non rejouable: abandonnée
+    bot.register_user("7000000000000400")
+    bot.user_list.add("ancien-id")
+    bot.add_to_memory("7000000000000400", "user", "salut")
+    bot.user_last_image["7000000000000400"] = "https://exemple.test/chat.png"
+    bot.park_broadcast("annonce", ["7000000000000401", "7000000000000402"])
+    staggered = idle_scheduler()
+    staggered.jobs.append(StaggeredBroadcast("promo", ["a", "b", "c"], 100.0, 200.0, admin_id="admin"))
+    staggered.jobs[0].index = 1
+    monkeypatch.setattr(bot, "broadcast_scheduler", staggered)
+
+    bot.draining.set()
+    bot.drain("test")
+    assert bot.drain_done.is_set()
+    with open(bot.STATE_FILE, encoding="utf-8") as f:
+        saved = json.load(f)
+    assert saved["jobs"] == [["send_message", ["7000000000000400", "ta réponse 💕"]]]
+    assert not staggered.jobs
+
+    # Processus suivant: tout repart de zéro
+    fresh_state(monkeypatch)
+    lanes = {"static": Recorder(), "broadcast": Recorder()}
+    monkeypatch.setattr(bot, "LANES", lanes)
+    restarted = idle_scheduler()
+    monkeypatch.setattr(bot, "broadcast_scheduler", restarted)
+    assert bot.restore_state() is not None
+
+    assert set(bot.user_list) == {"7000000000000400", "ancien-id"}
+    assert bot.user_directory.last_seen("7000000000000400") is not None
+    assert [message["content"] for message in bot.user_memory["7000000000000400"]] == ["salut"]
+    assert bot.user_last_image["7000000000000400"] == "https://exemple.test/chat.png"
+    assert bot.memory_stats.messages == 1 and bot.memory_stats.active_users == 1
+    assert lanes["static"].jobs == [("send_message", ("7000000000000400", "ta réponse 💕"))]
+    assert lanes["broadcast"].jobs == [("broadcast_message", ("annonce", ["7000000000000401", "7000000000000402"]))]
+    job, = restarted.jobs
+    assert (job.text, job.recipients, job.start_at, job.deadline, job.admin_id) == ("promo", ["b", "c"], 100.0, 200.0, "admin")
+    # Fichier consommé: un second démarrage ne rejoue rien
+    assert bot.restore_state() is None
+
+def test_unreadable_state_is_ignored(monkeypatch, tmp_path):
+    state_file = tmp_path / "state.json"
+    state_file.write_text("{pas du json", encoding="utf-8")
+    monkeypatch.setattr(bot, "STATE_FILE", str(state_file))
+    assert bot.restore_state() is None
+    assert state_file.exists()
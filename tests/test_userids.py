@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+userids.py contre set/dict: mêmes opérations aléatoires, même état attendu
+
+Les IDs mêlent PSID réalistes, petits entiers (collisions et agrandissements
+fréquents) et IDs gardés en str ("007", "system", plus de 18 chiffres).
+Usage: python -m pytest tests
+"""
+
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from userids import StripedUserIdMap, StripedUserIdSet, UserIdMap, UserIdSet, encode
+
+def id_pool(rng):
+    psids = [str(rng.randrange(10 ** 15, 10 ** 16)) for _ in range(300)]
+    small = [str(value) for value in range(50)]
+    odd = ["007", "00", "system", "1" * 25, "١٢٣", "-5", " 42"]
+    return psids + small + odd
+
+def test_encode_round_trip():
+    for value in ("0", "7", "7000000000000000", "9" * 18):
+        assert str(encode(value)) == value
+        assert encode(int(value)) == int(value)
+    for value in ("007", "", "system", "1" * 19, "١٢٣", "-5", " 42", True, -1, 10 ** 18, 1.0):
+        assert encode(value) is None
+
+def check_set(container, reference):
+    assert len(container) == len(reference)
+    assert sorted(container) == sorted(reference)
+
+def check_map(container, reference):
+    assert len(container) == len(reference)
+    assert sorted(container) == sorted(reference)
+    assert sorted(container.items()) == sorted(reference.items())
+
+def run_set(container, seed):
+    rng = random.Random(seed)
+    pool = id_pool(rng)
+    reference = set()
+    for step in range(20000):
+        user_id = rng.choice(pool)
+        action = rng.random()
+        if action < 0.45:
+            container.add(user_id)
+            reference.add(user_id)
+        elif action < 0.75:
+            container.discard(user_id)
+            reference.discard(user_id)
+        elif action < 0.9995:
+            assert (user_id in container) == (user_id in reference)
+        else:
+            container.clear()
+            reference.clear()
+        if step % 2000 == 0:
+            check_set(container, reference)
+    check_set(container, reference)
+
+def run_map(container, seed, numeric=False):
+    rng = random.Random(seed)
+    pool = id_pool(rng)
+    reference = {}
+    for step in range(20000):
+        user_id = rng.choice(pool)
+        action = rng.random()
+        if action < 0.35:
+            value = step if numeric else f"v{step}"
+            container[user_id] = value
+            reference[user_id] = value
+        elif action < 0.5:
+            assert container.pop(user_id, None) == reference.pop(user_id, None)
+        elif action < 0.6:
+            default = 0 if numeric else "d"
+            assert container.setdefault(user_id, default) == reference.setdefault(user_id, default)
+        elif action < 0.9995:
+            assert container.get(user_id) == reference.get(user_id)
+            assert (user_id in container) == (user_id in reference)
+        else:
+            container.clear()
+            reference.clear()
+        if step % 2000 == 0:
+            check_map(container, reference)
+    check_map(container, reference)
+
+def test_set_matches_builtin_set():
+    run_set(UserIdSet(), 1)
+
+def test_striped_set_matches_builtin_set():
+    container = StripedUserIdSet(stripes=7)
+    run_set(container, 2)
+    assert sorted(container.snapshot()) == sorted(container)
+
+def test_map_matches_builtin_dict():
+    run_map(UserIdMap(), 3)
+
+def test_typed_map_matches_builtin_dict():
+    run_map(UserIdMap(typecode='q'), 4, numeric=True)
+
+def test_striped_map_matches_builtin_dict():
+    container = StripedUserIdMap(stripes=5)
+    run_map(container, 5)
+    assert sorted(container.snapshot()) == sorted(container.items())
+
+def test_default_factory_like_defaultdict():
+    container = UserIdMap(list)
+    container["7000000000000000"].append(1)
+    container["system"].append(2)
+    container[7000000000000000].append(3)
+    assert container.items() == [("7000000000000000", [1, 3])] + [("system", [2])]
+    assert container.get("42") is None and "42" not in container
+    counters = UserIdMap(int, typecode='q')
+    for user_id in ["5", "5", "6"]:
+        counters[user_id] = counters[user_id] + 1
+    assert sorted(counters.items()) == [("5", 2), ("6", 1)]
+
+def test_missing_key_raises():
+    container = UserIdMap()
+    try:
+        container["7000000000000000"]
+    except KeyError:
+        pass
+    else:
+        raise AssertionError("KeyError attendue")
+    try:
+        del container["system"]
+    except KeyError:
+        pass
+    else:
+        raise AssertionError("KeyError attendue")
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+Traçage des requêtes pour NakamaBot
+
+Une trace suit un événement webhook du parsing jusqu'à l'envoi: traced()
+l'ouvre dans un ContextVar, trace_span() y ajoute des spans, et chaque tâche
+mise en file la garde ouverte (hold_trace / release_trace) jusqu'à ce que
+tout le travail soit fini. Les traces closes vont dans trace_buffer: anneau
+des récentes (échantillonnées) + tas des plus lentes.
+"""
+
+import contextvars
+import heapq
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "2000"))  # Traces toujours conservées au-delà
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.05"))  # Part des traces rapides gardées
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "200"))
+
+_current_trace = contextvars.ContextVar("nakamabot_trace", default=None)
+
+class Trace:
+    """Trace d'un événement webhook: spans imbriqués du parsing jusqu'à l'envoi"""
+
+    def __init__(self, name, **attrs):
+        self.trace_id = os.urandom(8).hex()
+        self.name = name
+        self.attrs = attrs
+        self.started_at = datetime.now().isoformat()
+        self.t0 = time.perf_counter()
+        self.spans = []
+        self.duration_ms = None
+        self.pending = 1  # L'événement lui-même + chaque tâche mise en file
+        self.lock = threading.Lock()
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "attrs": self.attrs,
+            "started_at": self.started_at,
+            "duration_ms": self.duration_ms,
+            "spans": sorted(self.spans, key=lambda span: span["start_ms"])
+        }
+
+class TraceBuffer:
+    """Anneau des traces récentes (échantillonnées) + tas des traces les plus lentes"""
+
+    def __init__(self, size, slow_ms, sample_rate):
+        self.slow_ms = slow_ms
+        self.sample_rate = sample_rate
+        self.size = size
+        self.recent = deque(maxlen=size)
+        self.slowest = []  # Tas min de (durée, id, trace)
+        self.lock = threading.Lock()
+
+    def add(self, trace):
+        slow = trace.duration_ms >= self.slow_ms
+        if not slow and random.random() >= self.sample_rate:
+            return
+        with self.lock:
+            self.recent.append(trace)
+            if slow:
+                entry = (trace.duration_ms, trace.trace_id, trace)
+                if len(self.slowest) < self.size:
+                    heapq.heappush(self.slowest, entry)
+                elif entry > self.slowest[0]:
+                    heapq.heapreplace(self.slowest, entry)
+
+    def slowest_traces(self, n=10):
+        """Les n traces les plus lentes (lentes conservées + récentes échantillonnées)"""
+        with self.lock:
+            candidates = {trace.trace_id: trace for _, _, trace in self.slowest}
+            candidates.update((trace.trace_id, trace) for trace in self.recent)
+        return sorted(candidates.values(), key=lambda trace: trace.duration_ms, reverse=True)[:n]
+
+trace_buffer = TraceBuffer(TRACE_BUFFER_SIZE, TRACE_SLOW_MS, TRACE_SAMPLE_RATE)
+
+@contextmanager
+def traced(name, **attrs):
+    """Ouvrir une trace courante; elle se clôt quand ses tâches en file sont finies"""
+    trace = Trace(name, **attrs)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+        release_trace(trace)
+
+def current_trace():
+    return _current_trace.get()
+
+def annotate_trace(**attrs):
+    """Ajouter des attributs à la trace courante (commande, file...)"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.attrs.update(attrs)
+
+def hold_trace(trace):
+    """Une tâche de plus doit se terminer avant de clore la trace"""
+    if trace is not None:
+        with trace.lock:
+            trace.pending += 1
+
+def release_trace(trace):
+    """Une partie du travail est terminée; clore la trace quand tout l'est"""
+    if trace is None:
+        return
+    with trace.lock:
+        trace.pending -= 1
+        if trace.pending > 0 or trace.duration_ms is not None:
+            return
+        trace.duration_ms = round((time.perf_counter() - trace.t0) * 1000, 1)
+    trace_buffer.add(trace)
+
+@contextmanager
+def trace_span(name):
+    """Mesurer un bloc comme span de la trace courante (sans effet hors trace)"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        trace.spans.append({
+            "name": name,
+            "start_ms": round((start - trace.t0) * 1000, 1),
+            "duration_ms": round((end - start) * 1000, 1),
+            "thread": threading.current_thread().name
+        })
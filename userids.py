@@ -0,0 +1,432 @@
+# -*- coding: utf-8 -*-
+"""
+Identifiants utilisateurs compacts pour NakamaBot
+
+Les PSID Messenger sont des entiers d'une quinzaine de chiffres. En str, chacun
+coûte ~65 octets plus l'entrée du set ou du dict qui le référence. Ici, ils
+sont rangés en int64 dans un tableau (array('q')) à adressage ouvert:
+- UserIdSet: ensemble d'IDs (user_list)
+- UserIdMap: dictionnaire ID -> valeur, avec fabrique optionnelle comme
+  defaultdict (user_memory, user_last_image)
+
+Façade str: on passe et on récupère des str (ou des int). Un ID qui ne
+survit pas à l'aller-retour str -> int -> str ("007", "system", plus de 18
+chiffres) est gardé tel quel dans un set/dict Python annexe.
+
+Partagés entre les threads Flask: StripedUserIdSet / StripedUserIdMap
+répartissent les IDs en tranches, chacune avec son verrou (pas de verrou
+global), et le parcours se fait sur un instantané cohérent.
+"""
+
+import threading
+from array import array
+from contextlib import contextmanager
+
+EMPTY = -1  # Case jamais utilisée
+DELETED = -2  # Case libérée (la recherche continue au-delà)
+MIN_CAPACITY = 8
+MAX_LOAD = 0.6
+
+_FIBONACCI = 0x9E3779B97F4A7C15  # Hachage multiplicatif: disperse les PSID proches
+_MASK64 = (1 << 64) - 1
+_is_key = (0).__le__  # Case occupée (clé >= 0), utilisable par filter() sans boucle Python
+
+def encode(user_id):
+    """PSID -> int64, ou None s'il doit rester en str"""
+    if isinstance(user_id, str):
+        if user_id.isdigit() and user_id.isascii() and len(user_id) <= 18 and (user_id[0] != "0" or user_id == "0"):
+            return int(user_id)
+        return None
+    if isinstance(user_id, int) and not isinstance(user_id, bool) and 0 <= user_id < 10 ** 18:
+        return user_id
+    return None
+
+class _IdTable:
+    """Table int64 à adressage ouvert (sondage linéaire), agrandie au-delà de MAX_LOAD"""
+
+    def __init__(self):
+        self._allocate(MIN_CAPACITY)
+
+    def _allocate(self, capacity):
+        self._keys = array('q', [EMPTY]) * capacity
+        self._shift = 64 - (capacity.bit_length() - 1)
+        self._mask = capacity - 1
+        self._count = 0
+        self._filled = 0  # Clés + cases libérées
+
+    def _find(self, key):
+        """(case, trouvée): la case de key, sinon la première case libre de sa séquence"""
+        keys = self._keys
+        index = ((key * _FIBONACCI) & _MASK64) >> self._shift
+        free = -1
+        while True:
+            current = keys[index]
+            if current == key:
+                return index, True
+            if current == EMPTY:
+                return (index if free < 0 else free), False
+            if current == DELETED and free < 0:
+                free = index
+            index = (index + 1) & self._mask
+
+    def _claim(self, index, key):
+        """Occuper une case libre renvoyée par _find; True si la table doit être reconstruite"""
+        if self._keys[index] == EMPTY:
+            self._filled += 1
+        self._keys[index] = key
+        self._count += 1
+        return self._filled > len(self._keys) * MAX_LOAD
+
+    def _capacity_for(self, count):
+        """Plus petite capacité où count reste sous 3/4 de MAX_LOAD (un agrandissement double la table)"""
+        capacity = MIN_CAPACITY
+        while count > capacity * MAX_LOAD * 0.75:
+            capacity *= 2
+        return capacity
+
+    def _int_keys(self):
+        return filter(_is_key, self._keys)
+
+class UserIdSet(_IdTable):
+    """Ensemble de PSID (8 octets par case, ~14 à 27 octets par utilisateur)"""
+
+    def __init__(self, ids=()):
+        super().__init__()
+        self._others = set()
+        self.update(ids)
+
+    def add(self, user_id):
+        key = encode(user_id)
+        if key is None:
+            self._others.add(user_id)
+            return
+        index, found = self._find(key)
+        if not found and self._claim(index, key):
+            self._rebuild()
+
+    def update(self, ids):
+        for user_id in ids:
+            self.add(user_id)
+
+    def discard(self, user_id):
+        key = encode(user_id)
+        if key is None:
+            self._others.discard(user_id)
+            return
+        index, found = self._find(key)
+        if found:
+            self._keys[index] = DELETED
+            self._count -= 1
+
+    def _rebuild(self):
+        keys = list(self._int_keys())
+        self._allocate(self._capacity_for(len(keys)))
+        for key in keys:
+            self._claim(self._find(key)[0], key)
+
+    def clear(self):
+        self._allocate(MIN_CAPACITY)
+        self._others.clear()
+
+    def __contains__(self, user_id):
+        key = encode(user_id)
+        if key is None:
+            return user_id in self._others
+        return self._find(key)[1]
+
+    def _frozen(self):
+        """Copie brute (tableau et IDs annexes) pour un instantané"""
+        return self._keys[:], list(self._others)
+
+    def __iter__(self):
+        """IDs en str (ordre du tableau, pas d'insertion)"""
+        yield from map(str, self._int_keys())
+        yield from list(self._others)
+
+    def __len__(self):
+        return self._count + len(self._others)
+
+    def __repr__(self):
+        return f"UserIdSet({len(self)} ids)"
+
+class UserIdMap(_IdTable):
+    """Dictionnaire PSID -> valeur (clés int64 et liste de valeurs parallèles)
+
+    default_factory: comme defaultdict, crée la valeur d'une clé absente lue avec [].
+    typecode: valeurs numériques rangées dans un array (ex. 'q' compteurs, 'd' horodatages)
+    plutôt que comme objets Python: 8 octets par case au lieu d'un pointeur plus l'objet.
+    """
+
+    def __init__(self, default_factory=None, items=(), typecode=None):
+        self.default_factory = default_factory
+        self.typecode = typecode
+        self._blank = 0 if typecode else None
+        super().__init__()
+        self._others = {}
+        self.update(items)
+
+    def _allocate(self, capacity):
+        super()._allocate(capacity)
+        self._values = array(self.typecode, [0]) * capacity if self.typecode else [None] * capacity
+
+    def _rebuild(self):
+        items = [(key, value) for key, value in zip(self._keys, self._values) if key >= 0]
+        self._allocate(self._capacity_for(len(items)))
+        for key, value in items:
+            index = self._find(key)[0]
+            self._claim(index, key)
+            self._values[index] = value
+
+    def __setitem__(self, user_id, value):
+        key = encode(user_id)
+        if key is None:
+            self._others[user_id] = value
+            return
+        index, found = self._find(key)
+        if found:
+            self._values[index] = value
+            return
+        self._values[index] = value
+        if self._claim(index, key):
+            self._rebuild()
+
+    def __getitem__(self, user_id):
+        key = encode(user_id)
+        if key is None:
+            if user_id not in self._others and self.default_factory is not None:
+                self._others[user_id] = self.default_factory()
+            return self._others[user_id]
+        index, found = self._find(key)
+        if found:
+            return self._values[index]
+        if self.default_factory is None:
+            raise KeyError(user_id)
+        value = self.default_factory()
+        self[user_id] = value
+        return value
+
+    def get(self, user_id, default=None):
+        key = encode(user_id)
+        if key is None:
+            return self._others.get(user_id, default)
+        index, found = self._find(key)
+        return self._values[index] if found else default
+
+    def setdefault(self, user_id, default=None):
+        if user_id in self:
+            return self[user_id]
+        self[user_id] = default
+        return default
+
+    def pop(self, user_id, *default):
+        key = encode(user_id)
+        if key is None:
+            return self._others.pop(user_id, *default)
+        index, found = self._find(key)
+        if not found:
+            if default:
+                return default[0]
+            raise KeyError(user_id)
+        value = self._values[index]
+        self._keys[index] = DELETED
+        self._values[index] = self._blank
+        self._count -= 1
+        return value
+
+    def __delitem__(self, user_id):
+        self.pop(user_id)
+
+    def update(self, items=()):
+        for user_id, value in (items.items() if hasattr(items, "items") else items):
+            self[user_id] = value
+
+    def clear(self):
+        self._allocate(MIN_CAPACITY)
+        self._others.clear()
+
+    def __contains__(self, user_id):
+        key = encode(user_id)
+        if key is None:
+            return user_id in self._others
+        return self._find(key)[1]
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [value for key, value in zip(self._keys, self._values) if key >= 0] + list(self._others.values())
+
+    def items(self):
+        return [(str(key), value) for key, value in zip(self._keys, self._values) if key >= 0] + list(self._others.items())
+
+    def _frozen(self):
+        """Copie brute (clés, valeurs et paires annexes) pour un instantané"""
+        return self._keys[:], self._values[:], list(self._others.items())
+
+    def __iter__(self):
+        yield from map(str, self._int_keys())
+        yield from list(self._others)
+
+    def __len__(self):
+        return self._count + len(self._others)
+
+    def __repr__(self):
+        return f"UserIdMap({len(self)} ids)"
+
+class _Striped:
+    """Tranches d'IDs protégées chacune par son verrou (réentrant)
+
+    Une opération sur un utilisateur ne verrouille que sa tranche: les threads qui servent
+    des utilisateurs différents avancent en parallèle. clear() et les instantanés prennent
+    tous les verrous, dans l'ordre, le temps de copier les tableaux (sans conversion en str).
+    Ne pas appeler clear() ni un instantané en tenant déjà lock_for(): interblocage possible.
+    """
+
+    def __init__(self, shards):
+        self._shards = shards
+        self._locks = [threading.RLock() for _ in shards]
+
+    def _stripe(self, user_id):
+        key = encode(user_id)
+        return (hash(user_id) if key is None else key) % len(self._shards)
+
+    def lock_for(self, user_id):
+        """Verrou de la tranche de user_id: rend atomique une suite d'opérations sur cet utilisateur"""
+        return self._locks[self._stripe(user_id)]
+
+    def _shard(self, user_id):
+        stripe = self._stripe(user_id)
+        return self._shards[stripe], self._locks[stripe]
+
+    @contextmanager
+    def _all_locks(self):
+        for lock in self._locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(self._locks):
+                lock.release()
+
+    def _frozen(self):
+        with self._all_locks():
+            return [shard._frozen() for shard in self._shards]
+
+    def clear(self):
+        with self._all_locks():
+            for shard in self._shards:
+                shard.clear()
+
+    def __contains__(self, user_id):
+        shard, lock = self._shard(user_id)
+        with lock:
+            return user_id in shard
+
+    def __len__(self):
+        return sum(map(len, self._shards))
+
+class StripedUserIdSet(_Striped):
+    """UserIdSet partagé entre threads (user_list)"""
+
+    def __init__(self, ids=(), stripes=32):
+        super().__init__([UserIdSet() for _ in range(stripes)])
+        self.update(ids)
+
+    def add(self, user_id):
+        shard, lock = self._shard(user_id)
+        with lock:
+            shard.add(user_id)
+
+    def update(self, ids):
+        for user_id in ids:
+            self.add(user_id)
+
+    def discard(self, user_id):
+        shard, lock = self._shard(user_id)
+        with lock:
+            shard.discard(user_id)
+
+    def snapshot(self):
+        """Liste des IDs en str, cohérente à un instant donné"""
+        ids = []
+        for keys, others in self._frozen():
+            ids.extend(map(str, filter(_is_key, keys)))
+            ids.extend(others)
+        return ids
+
+    def __iter__(self):
+        return iter(self.snapshot())
+
+    def __repr__(self):
+        return f"StripedUserIdSet({len(self)} ids, {len(self._shards)} tranches)"
+
+class StripedUserIdMap(_Striped):
+    """UserIdMap partagé entre threads (user_memory, user_last_image, game_sessions)
+
+    La valeur d'une clé absente lue avec [] est créée une seule fois, même sous concurrence.
+    Modifier la valeur elle-même (deque, dict de session) reste à la charge de l'appelant,
+    sous lock_for(user_id) si plusieurs étapes doivent être atomiques.
+    """
+
+    def __init__(self, default_factory=None, items=(), stripes=32, typecode=None):
+        super().__init__([UserIdMap(default_factory, typecode=typecode) for _ in range(stripes)])
+        self.update(items)
+
+    @property
+    def default_factory(self):
+        return self._shards[0].default_factory
+
+    def __getitem__(self, user_id):
+        shard, lock = self._shard(user_id)
+        with lock:
+            return shard[user_id]
+
+    def __setitem__(self, user_id, value):
+        shard, lock = self._shard(user_id)
+        with lock:
+            shard[user_id] = value
+
+    def get(self, user_id, default=None):
+        shard, lock = self._shard(user_id)
+        with lock:
+            return shard.get(user_id, default)
+
+    def setdefault(self, user_id, default=None):
+        shard, lock = self._shard(user_id)
+        with lock:
+            return shard.setdefault(user_id, default)
+
+    def pop(self, user_id, *default):
+        shard, lock = self._shard(user_id)
+        with lock:
+            return shard.pop(user_id, *default)
+
+    def __delitem__(self, user_id):
+        self.pop(user_id)
+
+    def update(self, items=()):
+        for user_id, value in (items.items() if hasattr(items, "items") else items):
+            self[user_id] = value
+
+    def snapshot(self):
+        """Liste de paires (ID en str, valeur), cohérente à un instant donné"""
+        items = []
+        for keys, values, others in self._frozen():
+            items.extend((str(key), value) for key, value in zip(keys, values) if key >= 0)
+            items.extend(others)
+        return items
+
+    def items(self):
+        return self.snapshot()
+
+    def keys(self):
+        return [user_id for user_id, _ in self.snapshot()]
+
+    def values(self):
+        return [value for _, value in self.snapshot()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __repr__(self):
+        return f"StripedUserIdMap({len(self)} ids, {len(self._shards)} tranches)"